@@ -2,6 +2,7 @@ import argparse
 import logging
 
 from basic_games import button_masher, good_timing, submission
+from queued_logging import LOG_FORMATS, configure_logging
 
 GAME_CATALOGUE = {
     "masher": {
@@ -54,6 +55,12 @@ PARSER.add_argument(
     choices=getLogLevels(),
     help="Set log level to one of the named levels. Otherwise doesn't log.",
 )
+PARSER.add_argument(
+    "--log-format",
+    choices=LOG_FORMATS,
+    default="text",
+    help="Write log records as text or as one JSON object per line.",
+)
 
 
 def main():
@@ -64,8 +71,8 @@ def main():
         logging.disable()
     else:
         numeric_level = getattr(logging, args.log_level)
-        logging.basicConfig(level=numeric_level)
-        logging.info(f"Log level set to {args.log_level}[{numeric_level}]")
+        configure_logging(numeric_level, args.log_format)
+        logging.info("Log level set to %s[%d]", args.log_level, numeric_level)
 
     score = GAME_CATALOGUE[args.game]["module"].App().run()
     if score is not None:
@@ -0,0 +1,337 @@
+"""
+Generate load against a score server by replaying the client's protocol.
+
+Each simulated visit opens an `AuthedSession` with the game's authentication
+method, as `submission.attempt_posts_with` does, and posts one score. The
+time taken by each endpoint is recorded and summarised as JSON. When visits
+arrive at a given rate, each visit's first request is timed from when the
+visit was due to arrive, so time spent waiting for a free client counts too.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+import requests
+
+from basic_games import GAME_CATALOGUE, getLogLevels, socket, submission
+
+AUTH_METHODS = {
+    game["server_name"]: game["auth_method"] for game in GAME_CATALOGUE.values()
+}
+SCORE_RANGES = {"BUTTON": (0, 200), "TIMING": (0.0, 30.0)}
+USER_DISTRIBUTIONS = ("uniform", "zipf")
+STARTUP_TIMEOUT = 10  # seconds
+PERCENTILES = (50, 95, 99)
+
+
+def game_mix(mix_string):
+    """Return `{game: weight}` from a `game=weight,...` string."""
+    mix = dict()
+    for part in mix_string.split(","):
+        game, weight = part.split("=")
+        game = game.strip().upper()
+        if game not in AUTH_METHODS:
+            raise ValueError(f"unknown game {game}")
+        mix[game] = float(weight)
+    return mix
+
+
+class Recorder:
+    """Latencies and failures per endpoint, safe to share between threads."""
+
+    def __init__(self):
+        self.latencies = dict()
+        self.failures = dict()
+        self.delays = []
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok):
+        """Record one request to an endpoint."""
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.failures[endpoint] = self.failures.get(endpoint, 0) + 1
+
+    def record_delay(self, seconds):
+        """Record how long a visit waited past its arrival for a free client."""
+        with self._lock:
+            self.delays.append(seconds)
+
+    def summary(self, elapsed):
+        """Return throughput and latency percentiles per endpoint."""
+        report = dict()
+        with self._lock:
+            for endpoint, recorded in sorted(self.latencies.items()):
+                stats = {
+                    "requests": len(recorded),
+                    "failures": self.failures.get(endpoint, 0),
+                    "throughput": len(recorded) / elapsed,
+                }
+                stats.update(latency_stats(recorded))
+                report[endpoint] = stats
+        return report
+
+    def delay_summary(self):
+        """Return queue delay percentiles, or None if no delays were recorded."""
+        with self._lock:
+            return latency_stats(self.delays) if self.delays else None
+
+
+def latency_stats(recorded):
+    """Return the mean, maximum and percentiles of some latencies."""
+    latencies = sorted(recorded)
+    stats = {"mean": sum(latencies) / len(latencies), "max": latencies[-1]}
+    for q in PERCENTILES:
+        stats[f"p{q}"] = percentile(latencies, q)
+    return stats
+
+
+def percentile(ordered, q):
+    """Return the nearest-rank `q`th percentile of sorted values."""
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class LoadTest:
+    """
+    Simulated clients visiting a score server.
+
+    With a `rate`, visits arrive as a Poisson process of that many per second
+    and are served by up to `concurrency` threads. Otherwise each thread
+    starts its next visit as soon as its last one finishes. Usernames are
+    drawn from `users` names, uniformly or following Zipf's law so a few
+    users submit most scores, and games are drawn by the weights in `mix`.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        location,
+        *,
+        concurrency=8,
+        rate=None,
+        users=1000,
+        distribution="uniform",
+        mix=None,
+        seed=None,
+    ):
+        self.location = location
+        self.concurrency = concurrency
+        self.rate = rate
+        self.users = [f"user{i}" for i in range(users)]
+        weights = None
+        if distribution == "zipf":
+            weights = [1 / rank for rank in range(1, users + 1)]
+        self.user_weights = weights
+        self.mix = mix or {game: 1 for game in AUTH_METHODS}
+        self.random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.recorder = Recorder()
+
+    def next_entry(self):
+        """Return a random score entry."""
+        with self._random_lock:
+            [game] = self.random.choices(list(self.mix), list(self.mix.values()))
+            [username] = self.random.choices(self.users, self.user_weights)
+            low, high = SCORE_RANGES[game]
+            if isinstance(low, int):
+                score = self.random.randint(low, high)
+            else:
+                score = round(self.random.uniform(low, high), 3)
+        return {"game": game, "username": username, "score": score}
+
+    def visit(self, arrival=None):
+        """
+        Authenticate and submit one score, timing each endpoint. Given the
+        `time.perf_counter` time the visit was due to arrive, its first
+        request is timed from then and the wait until it started is recorded
+        as queue delay.
+        """
+        entry = self.next_entry()
+        method = AUTH_METHODS[entry["game"]]
+        # basic_digest authenticates without a request
+        endpoint = submission.AUTH_ENDPOINT
+        start = time.perf_counter()
+        if arrival is not None:
+            self.recorder.record_delay(max(0, start - arrival))
+            start = min(start, arrival)
+        try:
+            with submission.AuthedSession(self.location, method) as session:
+                if method == "single_use_challenge_response":
+                    self.recorder.record(endpoint, time.perf_counter() - start, True)
+                    start = time.perf_counter()
+                endpoint = submission.SCORE_ENDPOINT
+                response = session.post(
+                    self.location + endpoint, data=entry, allow_redirects=False
+                )
+                ok = response.status_code == requests.codes.SEE_OTHER
+                self.recorder.record(endpoint, time.perf_counter() - start, ok)
+        except (submission.AuthSetupFail, requests.exceptions.RequestException):
+            logging.debug("visit failed at %s", endpoint, exc_info=True)
+            self.recorder.record(endpoint, time.perf_counter() - start, False)
+
+    def run(self, duration):
+        """Generate load for `duration` seconds and return the JSON summary."""
+        deadline = time.perf_counter() + duration
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            if self.rate:
+                next_arrival = start
+                while next_arrival < deadline:
+                    time.sleep(max(0, next_arrival - time.perf_counter()))
+                    executor.submit(self.visit, next_arrival)
+                    with self._random_lock:
+                        next_arrival += self.random.expovariate(self.rate)
+            else:
+
+                def visit_until_deadline():
+                    while time.perf_counter() < deadline:
+                        self.visit()
+
+                for _ in range(self.concurrency):
+                    executor.submit(visit_until_deadline)
+        elapsed = time.perf_counter() - start
+        return {
+            "location": self.location,
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "elapsed": elapsed,
+            "endpoints": self.recorder.summary(elapsed),
+            "queue_delay": self.recorder.delay_summary(),
+        }
+
+
+def start_server(port, server_args, cwd):
+    """
+    Start `basic-games-server` in a subprocess running in `cwd`, where it
+    keeps its database, and wait until it answers.
+    """
+    command = [sys.executable, "-m", "score_server.wsgi", "--port", str(port)]
+    # the server package sits next to this one, wherever cwd is
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.pathsep.join(filter(None, [package_root, os.environ.get("PYTHONPATH")]))
+    env = dict(os.environ, PYTHONPATH=path)
+    # keep stdout for the report
+    process = subprocess.Popen(
+        [*command, *server_args], cwd=cwd, env=env, stdout=sys.stderr
+    )
+    location = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            requests.get(location + "/scores", timeout=1)
+            return process
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    process.wait()
+    raise RuntimeError("score server didn't start")
+
+
+@contextmanager
+def local_server(port, server_args):
+    """
+    Run `basic-games-server` for the duration of the `with` statement in a
+    temporary directory, so the scores it is sent don't end up in a real
+    database.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        process = start_server(port, server_args, workdir)
+        try:
+            yield process
+        finally:
+            process.terminate()
+            process.wait()
+
+
+PARSER = argparse.ArgumentParser(
+    description="Load test a score server with the client's protocol."
+)
+PARSER.add_argument(
+    "--score-server-addr",
+    type=socket,
+    default="localhost:5000",
+    help="Location of the score server. Format as `ip/hostname:port`. Defaults"
+    " to `localhost:5000`.",
+)
+PARSER.add_argument(
+    "--start-server",
+    nargs=argparse.REMAINDER,
+    help="Start a local basic-games-server on the given port first, passing it "
+    "any following arguments.",
+)
+PARSER.add_argument(
+    "--duration", type=float, default=10, help="Seconds to run. Defaults to 10."
+)
+PARSER.add_argument(
+    "--concurrency",
+    type=int,
+    default=8,
+    help="Simultaneous clients. Defaults to 8.",
+)
+PARSER.add_argument(
+    "--rate",
+    type=float,
+    help="Visits per second arriving at random. Otherwise clients visit back to "
+    "back.",
+)
+PARSER.add_argument(
+    "--users", type=int, default=1000, help="Number of usernames. Defaults to 1000."
+)
+PARSER.add_argument(
+    "--user-distribution",
+    choices=USER_DISTRIBUTIONS,
+    default="uniform",
+    help="How often each username submits. `zipf` makes a few users submit "
+    "most scores.",
+)
+PARSER.add_argument(
+    "--game-mix",
+    type=game_mix,
+    default="button=1,timing=1",
+    help="Relative weights of games as `game=weight,...`. Defaults to equal.",
+)
+PARSER.add_argument("--seed", type=int, help="Seed for repeatable runs.")
+PARSER.add_argument(
+    "--log-level",
+    choices=getLogLevels(),
+    help="Set log level to one of the named levels. Otherwise doesn't log.",
+)
+
+
+def main():
+    """Main routine for the basic-games load tester."""
+    args = PARSER.parse_args()
+
+    if args.log_level is None:
+        logging.disable()
+    else:
+        logging.basicConfig(level=getattr(logging, args.log_level))
+
+    addr, port = args.score_server_addr
+    with ExitStack() as stack:
+        if args.start_server is not None:
+            stack.enter_context(local_server(port, args.start_server))
+        load_test = LoadTest(
+            f"http://{addr}:{port}",
+            concurrency=args.concurrency,
+            rate=args.rate,
+            users=args.users,
+            distribution=args.user_distribution,
+            mix=args.game_mix,
+            seed=args.seed,
+        )
+        print(json.dumps(load_test.run(args.duration), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ RETRIES = 5
 
 AUTH_ENDPOINT = "/auth"
 SCORE_ENDPOINT = "/submit"
+BATCH_SCORE_ENDPOINT = "/submit/batch"
 
 HASH_SECRET = hashlib.sha256(b"LEARNING PURPOSES ONLY").digest()
 
@@ -59,7 +60,7 @@ class AuthedSession:
                 "/auth endpoint did not provide server challenge cookie `_SC`"
             )
         cr = secrets.base64.b64encode(hashlib.sha256(sc + HASH_SECRET).digest())
-        logging.debug(f"Auth: (sc, cr) = {(sc, cr)}")
+        logging.debug("Auth: (sc, cr) = %s", (sc, cr))
         # self.session.headers.update({"_SR": secrets.base64.b64encode(cr)})
         # TODO ideally create cookie as cookie object
         self.session.cookies.set("_CR", cr.decode())
@@ -92,7 +93,7 @@ def attempt_posts_with(dst_socket, auth_method, post_info):
                     )
                 except requests.exceptions.ConnectionError:
                     logging.debug(
-                        f"Failed attempt {attempt} to connect to score server"
+                        "Failed attempt %d to connect to score server", attempt
                     )
                     continue
                 redirected = resp.status_code == requests.codes.SEE_OTHER
@@ -101,14 +102,17 @@ def attempt_posts_with(dst_socket, auth_method, post_info):
                     break
                 else:
                     logging.debug(
-                        f"In attempt {attempt}, submission received response "
-                        f"{resp.status_code}, to location "
-                        f"{resp.headers.get('location')}"
+                        "In attempt %d, submission received response %d, to "
+                        "location %s",
+                        attempt,
+                        resp.status_code,
+                        resp.headers.get("location"),
                     )
         except AuthSetupFail as auth_fail:
             logging.debug(
-                f"Failed attempt {attempt} to authenticate to score server: "
-                f"{auth_fail.args[0]}"
+                "Failed attempt %d to authenticate to score server: %s",
+                attempt,
+                auth_fail.args[0],
             )
         except Exception:
             logging.debug(
@@ -118,3 +122,54 @@ def attempt_posts_with(dst_socket, auth_method, post_info):
         logging.info("Submitted score to server")
     else:
         logging.info("Failed to submit score to server")
+
+
+def attempt_batch_posts_with(dst_socket, auth_method, score_entries):
+    """
+    Send many score entries as one JSON batch to the server after
+    authenticating with the given method. Returns the server's per-entry
+    results, or None if the batch couldn't be submitted.
+    """
+    dst_addr, dst_port = dst_socket
+    game_server = f"http://{dst_addr}:{dst_port}"
+    # every attempt sends the whole batch, even if given a generator
+    score_entries = list(score_entries)
+    results = None
+    for attempt in range(RETRIES):
+        try:
+            with AuthedSession(game_server, auth_method) as s:
+                try:
+                    resp = s.post(
+                        game_server + BATCH_SCORE_ENDPOINT,
+                        json=score_entries,
+                    )
+                except requests.exceptions.ConnectionError:
+                    logging.debug(
+                        "Failed attempt %d to connect to score server", attempt
+                    )
+                    continue
+                if resp.status_code == requests.codes.OK:
+                    results = resp.json()["results"]
+                    break
+                else:
+                    logging.debug(
+                        "In attempt %d, batch submission received response %d",
+                        attempt,
+                        resp.status_code,
+                    )
+        except AuthSetupFail as auth_fail:
+            logging.debug(
+                "Failed attempt %d to authenticate to score server: %s",
+                attempt,
+                auth_fail.args[0],
+            )
+        except Exception:
+            logging.debug(
+                "Failed score server connection for unknown reason", exc_info=True
+            )
+    if results is None:
+        logging.info("Failed to submit score batch to server")
+    else:
+        accepted = sum(result["status"] == "accepted" for result in results)
+        logging.info("Submitted batch to server, %d scores accepted", accepted)
+    return results
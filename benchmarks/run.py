@@ -0,0 +1,293 @@
+"""
+Microbenchmarks for the score server's hot paths.
+
+Run from the repository root with `python -m benchmarks.run`. Results are
+saved as JSON, and a run can be compared against saved results to flag
+benchmarks that got slower:
+
+    python -m benchmarks.run --output baseline.json
+    python -m benchmarks.run --compare baseline.json
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import platform
+import re
+import secrets
+import sqlite3
+import statistics
+import sys
+import tempfile
+import timeit
+from contextlib import ExitStack
+from pathlib import Path
+
+import score_server
+from score_server import auth_manager, score_manager
+from score_server.routes import DEFAULT_SCORES_LIMIT
+from score_server.score_store import SCORE_STORES
+from score_server.token_store import MemoryTokenStore, SqliteTokenStore
+
+SIZES = (1000, 100000, 1000000)
+REPEAT = 5
+THRESHOLD = 0.1  # fraction slower than baseline counted as a regression
+OUTPUT = "benchmark_results.json"
+
+BENCHMARKS = dict()
+
+
+def benchmark(name):
+    """
+    Register a benchmark. The decorated function sets up state in the given
+    directory for a table of `size` rows, if it takes a size, and returns the
+    callable to time. Cleanup is registered with the given exit stack.
+    """
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def fill_scores(conn, game, size):
+    """Insert `size` distinct usernames into a game's scores."""
+    conn.executemany(
+        "INSERT INTO scores (game, username, score, rank_key, date) "
+        "VALUES (?, ?, ?, ?, datetime());",
+        (
+            score_manager.score_row(game, f"filler{i}", i % 1000)
+            for i in range(size)
+        ),
+    )
+    conn.commit()
+
+
+def scores_db(stack, directory):
+    """Return a connection to a new database with the app's tables."""
+    conn = sqlite3.connect(Path(directory) / "bench.db")
+    stack.callback(conn.close)
+    score_server.init_db(conn)
+    return conn
+
+
+def bench_app(stack, directory, **options):
+    """Return an app with a new database, passing `options` to `init_app`."""
+    app = score_server.init_app(str(Path(directory) / "scores.db"), **options)
+    stack.callback(score_server.close_app, app)
+    return app
+
+
+def make_insert_benchmark(game, new_user):
+    """Return setup timing one score submission for a new or existing user."""
+
+    def setup(stack, directory):
+        conn = scores_db(stack, directory)
+        usernames = itertools.count() if new_user else itertools.repeat(0)
+
+        def run():
+            entry = {"game": game, "username": f"user{next(usernames)}", "score": 1}
+            score_manager.insert_or_update_score(conn, entry)
+            conn.commit()
+
+        return run
+
+    return setup
+
+
+for game in score_manager.SCORE_COMPARISONS_BY_GAME:
+    for user in ("new", "existing"):
+        name = f"insert_or_update_score[{game.lower()},{user}]"
+        benchmark(name)(make_insert_benchmark(game, user == "new"))
+
+
+@benchmark("init_auth[sqlite]")
+def init_auth_sqlite(stack, directory):
+    app = bench_app(stack, directory)
+    store = SqliteTokenStore(app.config["POOL"])
+    return lambda: auth_manager.init_auth(store)
+
+
+@benchmark("init_auth[memory]")
+def init_auth_memory(stack, directory):
+    store = MemoryTokenStore()
+    return lambda: auth_manager.init_auth(store)
+
+
+@benchmark("query_token[{size}]")
+def query_token(stack, directory, size):
+    conn = scores_db(stack, directory)
+    conn.executemany(
+        "INSERT INTO tokens (token, created) VALUES (?, CURRENT_TIMESTAMP);",
+        ((f"token{i}",) for i in range(size)),
+    )
+    conn.commit()
+
+    def run():
+        # a miss leaves the table the same size for the next run
+        auth_manager.query_token(conn, "missing")
+        conn.rollback()
+
+    return run
+
+
+@benchmark("check_basic_digest")
+def check_basic_digest(stack, directory):
+    nonce = secrets.token_bytes(32)
+    digest = hashlib.sha256(nonce + auth_manager.HASH_SECRET).digest()
+    nonce, digest = (secrets.base64.b64encode(value) for value in (nonce, digest))
+    return lambda: auth_manager.check_basic_digest(nonce, digest)
+
+
+@benchmark("show_scores[{size}]")
+def show_scores(stack, directory, size):
+    app = bench_app(stack, directory)
+    with app.config["POOL"].connection() as conn:
+        for game in score_manager.SCORE_COMPARISONS_BY_GAME:
+            fill_scores(conn, game, size)
+    client = app.test_client()
+    cache = app.config["PAGE_CACHE"]
+
+    def run():
+        # time rendering, not serving from the page cache
+        cache.clear()
+        client.get("/scores")
+
+    return run
+
+
+def make_store_upsert_benchmark(kind):
+    """Return setup timing score submissions through a kind of score store."""
+
+    def setup(stack, directory):
+        app = bench_app(stack, directory, score_store=kind)
+        store = app.config["SCORE_STORE"]
+        usernames = itertools.count()
+        return lambda: store.upsert(
+            {"game": "BUTTON", "username": f"user{next(usernames)}", "score": 1}
+        )
+
+    return setup
+
+
+def make_store_top_benchmark(kind):
+    """Return setup timing a leaderboard page from a kind of score store."""
+
+    def setup(stack, directory, size):
+        app = bench_app(stack, directory, score_store=kind)
+        store = app.config["SCORE_STORE"]
+        store.upsert_many(("BUTTON", f"filler{i}", i % 1000) for i in range(size))
+        return lambda: store.top("BUTTON", DEFAULT_SCORES_LIMIT)
+
+    return setup
+
+
+for kind in SCORE_STORES:
+    benchmark(f"score_store.upsert[{kind}]")(make_store_upsert_benchmark(kind))
+    benchmark(f"score_store.top[{kind},{{size}}]")(make_store_top_benchmark(kind))
+
+
+def time_benchmark(run, repeat):
+    """Return per-call timings of `run` over `repeat` batches of calls."""
+    timer = timeit.Timer(run)
+    loops, _ = timer.autorange()
+    timings = [total / loops for total in timer.repeat(repeat, loops)]
+    return {
+        "best": min(timings),
+        "median": statistics.median(timings),
+        "loops": loops,
+    }
+
+
+def run_benchmarks(sizes, repeat, pattern=None):
+    """Run every benchmark matching `pattern` and return their results."""
+    results = dict()
+    for name, setup in BENCHMARKS.items():
+        names = [name]
+        if "{size}" in name:
+            names = [name.format(size=size) for size in sizes]
+        for sized_name in names:
+            if pattern and not re.search(pattern, sized_name):
+                continue
+            with ExitStack() as stack:
+                directory = stack.enter_context(tempfile.TemporaryDirectory())
+                if sized_name == name:
+                    run = setup(stack, directory)
+                else:
+                    size = int(re.search(r"\d+", sized_name)[0])
+                    run = setup(stack, directory, size)
+                results[sized_name] = time_benchmark(run, repeat)
+            best = results[sized_name]["best"]
+            print(f"{sized_name}: {best * 1e6:.1f} us", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Return `(name, baseline, current)` best timings for every benchmark more
+    than `threshold` slower than in the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["best"], result["best"]
+        if after > before * (1 + threshold):
+            regressions.append((name, before, after))
+    return regressions
+
+
+PARSER = argparse.ArgumentParser(description="Benchmark score server hot paths.")
+PARSER.add_argument(
+    "--output", default=OUTPUT, help=f"File to save results to. Defaults to {OUTPUT}."
+)
+PARSER.add_argument(
+    "--compare", help="Saved results to compare against, flagging regressions."
+)
+PARSER.add_argument(
+    "--threshold",
+    type=float,
+    default=THRESHOLD,
+    help="Fraction slower than the saved results that counts as a regression. "
+    f"Defaults to {THRESHOLD}.",
+)
+PARSER.add_argument(
+    "--sizes",
+    type=lambda sizes: [int(size) for size in sizes.split(",")],
+    default=SIZES,
+    help="Comma separated table sizes for sized benchmarks. Defaults to "
+    f"{','.join(map(str, SIZES))}.",
+)
+PARSER.add_argument(
+    "--repeat", type=int, default=REPEAT, help=f"Timing repeats. Defaults to {REPEAT}."
+)
+PARSER.add_argument("--filter", help="Only run benchmarks matching this regex.")
+
+
+def main():
+    """Run the benchmarks, save the results and compare with a baseline."""
+    args = PARSER.parse_args()
+    results = run_benchmarks(args.sizes, args.repeat, args.filter)
+    report = {
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.compare is None:
+        return
+    baseline = json.loads(Path(args.compare).read_text())["results"]
+    regressions = compare(results, baseline, args.threshold)
+    for name, before, after in regressions:
+        print(
+            f"REGRESSION {name}: {before * 1e6:.1f} us -> {after * 1e6:.1f} us "
+            f"({after / before - 1:+.0%})"
+        )
+    if regressions:
+        sys.exit(1)
+    print(f"no regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
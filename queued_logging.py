@@ -0,0 +1,102 @@
+"""
+Module for setting up logging that doesn't block the threads that log, shared
+by the game client and the score server.
+
+Records are put on a queue by the threads that log, and formatted and
+written by a listener thread. Only records passing the level check are queued, so
+log calls with %-style arguments cost little when their level is disabled.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+LOG_FORMATS = ("text", "json")
+# matches logging.basicConfig
+TEXT_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+_LISTENER = None
+_SETTINGS = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format each record as a JSON object on one line."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler leaving formatting to the listener. Only the message is
+    merged with its arguments, so later changes to them don't show.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def configure_logging(level, log_format="text", stream=None):
+    """
+    Send records of at least `level` from every logger to `stream`, stderr by
+    default, through a queue and a listener thread. Records are written as
+    text or, with the `json` format, as one JSON object per line.
+    """
+    global _LISTENER, _SETTINGS  # noqa: PLW0603
+    stop_logging()
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(level)
+    _LISTENER = logging.handlers.QueueListener(
+        records, handler, respect_handler_level=True
+    )
+    _LISTENER.start()
+    _SETTINGS = (level, log_format, stream)
+
+
+def stop_logging():
+    """Write any queued records and stop the listener thread."""
+    global _LISTENER  # noqa: PLW0603
+    if _LISTENER is not None:
+        _LISTENER.stop()
+        _LISTENER = None
+
+
+def restart_logging():
+    """
+    Start over with a new queue and listener thread, configured as last time,
+    if logging was configured. For forked children, where the listener thread
+    doesn't survive and the queue's lock may be held.
+    """
+    global _LISTENER  # noqa: PLW0603
+    if _SETTINGS is not None:
+        _LISTENER = None
+        configure_logging(*_SETTINGS)
+
+
+atexit.register(stop_logging)
@@ -1,14 +1,45 @@
 """Provides app factory."""
-import sqlite3
+import atexit
+import logging
 
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-from score_server import routes
+from score_server import routes, score_manager
+from score_server.admission import RATE_BURST, AdmissionControl
+from score_server.connection_manager import (
+    POOL_SIZE,
+    ConnectionPool,
+    release_db,
+    shard_paths,
+)
+from score_server.ingest import WriteBehindQueue
+from score_server.leaderboard import Leaderboards
+from score_server.page_cache import CACHE_TTL, PageCache
+from score_server.profiler import PROFILE_DIR, EndpointProfiler
+from score_server.score_store import make_score_store
+from score_server.snapshot import ReadSnapshot
+from score_server.token_store import make_token_store
 
 
-def init_db(conn):
-    """Create tables with the provided database connection."""
+def init_db(conn, sharded=False):
+    """
+    Create tables with the provided database connection. If `sharded`, each
+    game's score tables are created in the attached database named after the
+    game. Scores in the per-game tables of older databases and shards are
+    moved into the shared score tables.
+    """
+    games = score_manager.SCORE_COMPARISONS_BY_GAME
     cursor = conn.cursor()
+    if sharded:
+        unsharded = [
+            name
+            for name in table_names(cursor)
+            if name in score_manager.SCORE_TABLES or name in legacy_game_tables(games)
+        ]
+        if unsharded:
+            # scores in main would be ignored in favour of the shards
+            raise ValueError(f"database already has unsharded tables {unsharded}")
     cursor.execute(
         """
         CREATE TABLE IF NOT EXISTS tokens (
@@ -19,40 +50,244 @@ def init_db(conn):
     )
     cursor.execute(
         """
-        CREATE TABLE IF NOT EXISTS button (
-            username TEXT UNIQUE,
-            score INTEGER DEFAULT 0, 
-            date DATETIME
+        CREATE TABLE IF NOT EXISTS used_challenges (
+            challenge TEXT PRIMARY KEY,
+            issued INTEGER NOT NULL
         );
         """
     )
     cursor.execute(
+        "CREATE INDEX IF NOT EXISTS used_challenges_issued "
+        "ON used_challenges (issued);"
+    )
+    if sharded:
+        for game in games:
+            create_score_tables(cursor, game.lower())
+            migrate_game_tables(cursor, game.lower(), [game])
+    else:
+        create_score_tables(cursor, "main")
+        migrate_game_tables(cursor, "main", games)
+    conn.commit()
+
+
+def create_score_tables(cursor, schema):
+    """Create the score tables shared by games in the given schema."""
+    # rank_key orders every game's scores best first, see score_manager
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {schema}.scores (
+            game TEXT NOT NULL,
+            username TEXT NOT NULL,
+            score NOT NULL,
+            rank_key NOT NULL,
+            date DATETIME,
+            PRIMARY KEY (game, username)
+        );
         """
-        CREATE TABLE IF NOT EXISTS timing ( 
-            username TEXT UNIQUE, 
-            score FLOAT NOT NULL, 
-            date DATETIME 
+    )
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {schema}.scores_best "
+        "ON scores (game, rank_key, username);"
+    )
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {schema}.score_history (
+            game TEXT NOT NULL,
+            username TEXT NOT NULL,
+            score NOT NULL,
+            date DATETIME
         );
         """
     )
-    conn.commit()
+    # best score per username in the current period of each window
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {schema}.score_rollup (
+            game TEXT NOT NULL,
+            span TEXT NOT NULL,
+            period DATE NOT NULL,
+            username TEXT NOT NULL,
+            score NOT NULL,
+            rank_key NOT NULL,
+            date DATETIME,
+            PRIMARY KEY (game, span, period, username)
+        );
+        """
+    )
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {schema}.score_rollup_best "
+        "ON score_rollup (game, span, period, rank_key, username);"
+    )
+
+
+def table_names(cursor, schema="main"):
+    """Return the lowercase names of the tables in the given schema."""
+    rows = cursor.execute(
+        f"SELECT lower(name) FROM {schema}.sqlite_master WHERE type = 'table';"
+    )
+    return {name for (name,) in rows}
+
+
+def legacy_game_tables(games):
+    """Return the lowercase names of the given games' tables in older databases."""
+    return {
+        f"{game.lower()}{suffix}"
+        for game in games
+        for suffix in ("", "_history", "_rollup")
+    }
+
+
+def migrate_game_tables(cursor, schema, games):
+    """
+    Copy the given games' scores from the per-game tables of older databases
+    or shards in `schema` into the shared score tables there, then drop the
+    per-game tables.
+    """
+    existing = table_names(cursor, schema)
+    for game in games:
+        sign = score_manager.RANK_SIGNS[game]
+        table = f"{schema}.{game.lower()}"
+        if game.lower() in existing:
+            cursor.execute(
+                f"INSERT OR IGNORE INTO {schema}.scores "
+                "(game, username, score, rank_key, date) "
+                f"SELECT ?, username, score, ? * score, date FROM {table};",
+                (game, sign),
+            )
+            logging.info("moved %d `%s` scores", cursor.rowcount, game)
+            cursor.execute(f"DROP TABLE {table};")
+        if f"{game.lower()}_history" in existing:
+            cursor.execute(
+                f"INSERT INTO {schema}.score_history (game, username, score, date) "
+                f"SELECT ?, username, score, date FROM {table}_history;",
+                (game,),
+            )
+            cursor.execute(f"DROP TABLE {table}_history;")
+        if f"{game.lower()}_rollup" in existing:
+            cursor.execute(
+                f"INSERT OR IGNORE INTO {schema}.score_rollup "
+                "(game, span, period, username, score, rank_key, date) "
+                "SELECT ?, span, period, username, score, ? * score, date "
+                f"FROM {table}_rollup;",
+                (game, sign),
+            )
+            cursor.execute(f"DROP TABLE {table}_rollup;")
 
 
 def clear_db(conn):
     """Clear the database of entries"""
-    tables = ["tokens", "timing", "button"]
-    # can't use parameter substituion for table name -> no executemany
-    for table in tables:
-        conn.execute(f"DELETE FROM {table};")
+    conn.execute("DELETE FROM tokens;")
+    conn.execute("DELETE FROM used_challenges;")
+    score_manager.clear_scores(conn)
 
 
-def init_app(database):
-    """Initialize the application."""
+def init_app(  # noqa: PLR0913
+    database,
+    *,
+    db_profile="default",
+    pool_size=POOL_SIZE,
+    cache_ttl=CACHE_TTL,
+    token_store="sqlite",
+    score_store="sqlite",
+    write_behind=False,
+    sharded=False,
+    rank_max_age=None,
+    profile=False,
+    profile_dir=PROFILE_DIR,
+    admin_token=None,
+    snapshot_max_age=None,
+    snapshot_max_writes=None,
+    rate_limit=None,
+    rate_burst=RATE_BURST,
+    max_concurrent=None,
+    trusted_proxies=0,
+):
+    """
+    Initialize the application.
+
+    The app owns a pool of long-lived connections to `database`, each tuned
+    with the named PRAGMA profile `db_profile`, a cache of rendered
+    scoreboard pages kept for at most `cache_ttl` seconds, and the named kinds
+    of store for single use challenge response tokens and for scores. Scores
+    in the memory score store only last as long as the app. With `write_behind`,
+    accepted submissions are queued and written in groups by a background
+    thread. If `sharded`, each game's scores are kept in a database file of
+    their own next to `database`, which then only holds tokens. Leaderboards
+    for rank lookups are loaded into memory and reloaded after `rank_max_age`
+    seconds, if given, to pick up other processes' writes. With `profile`,
+    requests are profiled per endpoint from the start, and stats are written
+    to `profile_dir` when the app is closed. Profiling can also be toggled by
+    requests carrying `admin_token`. With `snapshot_max_age`, scoreboard
+    reads are served from an in-memory copy of the database refreshed once it
+    is that many seconds old or, if given, after `snapshot_max_writes` writes.
+    With `rate_limit`, each client address and username may authenticate and
+    submit that many times per second after a burst of `rate_burst`, and with
+    `max_concurrent` at most that many requests are handled at once. Requests
+    over either limit are refused before touching the database. Behind
+    `trusted_proxies` reverse proxies, client addresses are taken from the
+    `X-Forwarded-For` header they set, otherwise every client behind a proxy
+    shares the proxy's address and rate limit.
+    """
+    if write_behind and score_store != "sqlite":
+        raise ValueError("write-behind needs the sqlite score store")
     app = Flask(__name__)
+    if trusted_proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
     app.config["DB"] = database
+    shards = shard_paths(database) if sharded else None
+    app.config["POOL"] = ConnectionPool(database, db_profile, pool_size, shards)
+    app.config["TOKEN_STORE"] = make_token_store(token_store, app.config["POOL"])
+    app.config["PROFILER"] = EndpointProfiler(profile_dir, profile)
+    app.config["ADMIN_TOKEN"] = admin_token
+    app.config["ADMISSION"] = None
+    if rate_limit is not None or max_concurrent is not None:
+        app.config["ADMISSION"] = AdmissionControl(
+            rate_limit, rate_burst, max_concurrent
+        )
+
+    with app.config["POOL"].connection() as scores:
+        init_db(scores, sharded)
 
-    with sqlite3.connect(database) as scores:
-        init_db(scores)
+    app.config["READ_SNAPSHOT"] = None
+    app.config["PAGE_CACHE"] = PageCache(cache_ttl)
+    if snapshot_max_age is not None:
+        app.config["READ_SNAPSHOT"] = ReadSnapshot(
+            app.config["POOL"], snapshot_max_age, snapshot_max_writes
+        )
+        app.config["READ_SNAPSHOT"].start()
+        app.config["PAGE_CACHE"] = PageCache(
+            cache_ttl, generation=app.config["READ_SNAPSHOT"].generation
+        )
+    read_source = app.config["READ_SNAPSHOT"] or app.config["POOL"]
+    app.config["LEADERBOARDS"] = Leaderboards(read_source, rank_max_age)
+    app.config["LEADERBOARDS"].load()
+    app.config["SCORE_STORE"] = make_score_store(
+        score_store, app.config["POOL"], app.config["LEADERBOARDS"], read_source
+    )
+
+    app.config["WRITE_QUEUE"] = None
+    if write_behind:
+        app.config["WRITE_QUEUE"] = WriteBehindQueue(
+            app.config["POOL"], app.config["LEADERBOARDS"]
+        )
+        app.config["WRITE_QUEUE"].start()
+        atexit.register(app.config["WRITE_QUEUE"].close)
 
+    app.teardown_appcontext(release_db)
     app.register_blueprint(routes.scoreboard)
     return app
+
+
+def close_app(app):
+    """
+    Write any queued submissions and collected profiles, and close the app's
+    database connections.
+    """
+    if app.config["WRITE_QUEUE"] is not None:
+        app.config["WRITE_QUEUE"].close()
+    if app.config["PROFILER"].endpoints():
+        app.config["PROFILER"].dump()
+    app.config["LEADERBOARDS"].close()
+    if app.config["READ_SNAPSHOT"] is not None:
+        app.config["READ_SNAPSHOT"].close()
+    app.config["POOL"].close()
@@ -0,0 +1,104 @@
+"""Module for turning away requests before they do any database work."""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+MAX_CLIENTS = 10000
+RATE_BURST = 10
+
+
+class RateLimiter:
+    """
+    Token bucket per key, e.g. per client address.
+
+    Each key may make `burst` requests at once and then `rate` requests per
+    second. Buckets are kept for at most `max_keys` keys, forgetting the
+    least recently seen key first, so memory stays bounded when requests
+    come from many keys. A forgotten key starts again with a full bucket.
+    """
+
+    def __init__(self, rate, burst=RATE_BURST, max_keys=MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """
+        Take a token from a key's bucket. Returns 0 if allowed, otherwise the
+        seconds until a token is available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class AdmissionControl:
+    """
+    Limits checked at the start of a request.
+
+    Requests that write, e.g. `/auth` and `/submit`, are rate limited per
+    client address, and authenticated submissions also per username, with
+    `rate` requests per second, allowing bursts of `burst`. At most
+    `max_concurrent` requests are handled at once. Either limit is off if
+    None.
+    """
+
+    def __init__(
+        self, rate=None, burst=RATE_BURST, max_concurrent=None, max_keys=MAX_CLIENTS
+    ):
+        self.by_address = None
+        self.by_username = None
+        if rate is not None:
+            self.by_address = RateLimiter(rate, burst, max_keys)
+            self.by_username = RateLimiter(rate, burst, max_keys)
+        self.slots = None
+        if max_concurrent is not None:
+            self.slots = threading.BoundedSemaphore(max_concurrent)
+
+    def check_rate(self, address):
+        """
+        Return `(reason, retry_after)` if a client address is over its rate
+        limit, otherwise None.
+        """
+        if self.by_address is None:
+            return None
+        wait = self.by_address.allow(address)
+        if wait:
+            return "address_rate", math.ceil(wait)
+        return None
+
+    def check_username(self, username):
+        """
+        Return `(reason, retry_after)` if a username is over its rate limit,
+        otherwise None. Only charge usernames a request is authenticated to
+        submit for, so nobody else can use up their bucket.
+        """
+        if self.by_username is None or not username:
+            return None
+        wait = self.by_username.allow(username)
+        if wait:
+            return "username_rate", math.ceil(wait)
+        return None
+
+    def enter(self):
+        """Take a request slot without waiting, returning whether one was free."""
+        return self.slots is None or self.slots.acquire(blocking=False)
+
+    def leave(self):
+        """Give back a request slot taken by `enter`."""
+        if self.slots is not None:
+            self.slots.release()
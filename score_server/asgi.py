@@ -0,0 +1,149 @@
+"""
+Serves the score server app over ASGI.
+
+Connections are handled on an asyncio event loop, so idle keep-alive clients
+cost no threads. Each request is passed to the same Flask app used for WSGI,
+run on a bounded thread pool, so endpoints, cookies and redirects are
+identical and blocking database work never runs on the event loop.
+"""
+import asyncio
+import contextvars
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+THREADS = 8
+MAX_BODY_SIZE = 16 * 1024 * 1024  # bytes
+
+
+class BodyTooLarge(Exception):
+    """Raise if a request body exceeds the size allowed."""
+
+    pass
+
+
+def build_environ(scope, body):
+    """Return a WSGI environ for an ASGI http scope and its request body."""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for raw_name, raw_value in scope["headers"]:
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = f"HTTP_{name}"
+        value = raw_value.decode("latin-1")
+        if name in environ:
+            value = f"{environ[name]},{value}"
+        environ[name] = value
+    # the body is already buffered, so its length is known even for chunked
+    # uploads that sent no Content-Length
+    environ["CONTENT_LENGTH"] = str(len(body))
+    environ["wsgi.input_terminated"] = True
+    return environ
+
+
+class AsgiApp:
+    """ASGI application running a WSGI app on a bounded thread pool."""
+
+    def __init__(self, wsgi_app, threads=THREADS, max_body_size=MAX_BODY_SIZE):
+        self.wsgi_app = wsgi_app
+        self.max_body_size = max_body_size
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        """Handle server startup and shutdown events."""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def read_body(self, receive):
+        """Return the full request body, raising BodyTooLarge if too large."""
+        body = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            body += message.get("body", b"")
+            if len(body) > self.max_body_size:
+                raise BodyTooLarge
+            more_body = message.get("more_body", False)
+        return bytes(body)
+
+    def start(self, environ):
+        """Call the WSGI app, returning its status, headers and body iterable."""
+        started = dict()
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers
+            ]
+
+        chunks = self.wsgi_app(environ, start_response)
+        return started["status"], started["headers"], chunks
+
+    async def http(self, scope, receive, send):
+        """Handle one HTTP request."""
+        loop = asyncio.get_running_loop()
+        try:
+            body = await self.read_body(receive)
+        except BodyTooLarge:
+            await send({"type": "http.response.start", "status": 413, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        environ = build_environ(scope, body)
+        # every step of a response runs in the same context, whichever pool
+        # thread takes it, so streamed responses find the app context they
+        # pushed and can pop it again
+        context = contextvars.copy_context()
+        status, headers, chunks = await loop.run_in_executor(
+            self.executor, context.run, self.start, environ
+        )
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        iterator = iter(chunks)
+        try:
+            while True:
+                # streamed responses may read the database between chunks
+                chunk = await loop.run_in_executor(
+                    self.executor, context.run, next, iterator, None
+                )
+                if chunk is None:
+                    break
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        finally:
+            if hasattr(chunks, "close"):
+                await loop.run_in_executor(self.executor, context.run, chunks.close)
+        await send({"type": "http.response.body", "body": b""})
@@ -1,14 +1,22 @@
 """Module for handling authentication."""
 import hashlib
+import hmac
 import logging
 import secrets
-import sqlite3
+
+from score_server import metrics
 
 HASH_SECRET = hashlib.sha256(b"LEARNING PURPOSES ONLY").digest()
 
 EXPIRE = 10  # seconds
 
+# signed challenges keep the 32 bytes of a random challenge
+ISSUED_BYTES = 8
+NONCE_BYTES = 8
+SIGNATURE_BYTES = 16
+
 
+@metrics.timed_storage
 def insert_token(conn, token):
     """Insert a token into the token table with an associated timestamp of now"""
     cursor = conn.cursor()
@@ -17,20 +25,64 @@ def insert_token(conn, token):
     )
 
 
-def init_auth(database):
+@metrics.timed_storage
+def init_auth(store):
     """
     Creates a paired server challenge and expected client response. The
-    expected client response is stored in the token database and the server
-    challenge is returned.
+    challenge is made by the token store, the expected client response is
+    stored in the token store and the server challenge is returned.
+    """
+    sc = store.challenge()
+    cr = expected_response(sc)
+    store.add(cr)
+    logging.debug("(sc, cr) = %s", (sc, cr))
+    return sc
+
+
+def random_challenge():
+    """Return a random server challenge."""
+    return secrets.base64.b64encode(secrets.token_bytes(32)).decode()
+
+
+def expected_response(sc):
+    """Return the client response expected for a server challenge."""
+    digest = hashlib.sha256(sc.encode() + HASH_SECRET).digest()
+    return secrets.base64.b64encode(digest).decode()
+
+
+def signed_challenge(issued):
+    """
+    Return a server challenge holding the time it was issued, in whole
+    seconds since the epoch, and a random nonce, signed with the shared
+    secret so it can be checked without storing it.
     """
-    sc = secrets.base64.b64encode(secrets.token_bytes(32))
-    cr = secrets.base64.b64encode(hashlib.sha256(sc + HASH_SECRET).digest())
-    with sqlite3.connect(database) as conn:
-        insert_token(conn, cr.decode())
-    logging.debug(f"(sc, cr) = {(sc, cr)}")
-    return sc.decode()
+    body = issued.to_bytes(ISSUED_BYTES, "big") + secrets.token_bytes(NONCE_BYTES)
+    return secrets.base64.b64encode(body + challenge_signature(body)).decode()
 
 
+def challenge_signature(body):
+    """Return the signature of a signed challenge's issue time and nonce."""
+    return hmac.digest(HASH_SECRET, body, "sha256")[:SIGNATURE_BYTES]
+
+
+def signed_challenge_issued(sc):
+    """
+    Return the issue time of a server challenge made by `signed_challenge`,
+    or None if it wasn't made with the shared secret.
+    """
+    try:
+        raw = secrets.base64.b64decode(sc, validate=True)
+    except ValueError:
+        return None
+    if len(raw) != ISSUED_BYTES + NONCE_BYTES + SIGNATURE_BYTES:
+        return None
+    body, signature = raw[:-SIGNATURE_BYTES], raw[-SIGNATURE_BYTES:]
+    if not hmac.compare_digest(signature, challenge_signature(body)):
+        return None
+    return int.from_bytes(body[:ISSUED_BYTES], "big")
+
+
+@metrics.timed_storage
 def query_token(conn, token):
     """
     Remove expired tokens, check for and return given token, and remove from
@@ -53,6 +105,28 @@ def query_token(conn, token):
     return results
 
 
+@metrics.timed_storage
+def use_challenge(conn, challenge, issued, oldest):
+    """
+    Remove used challenges issued before `oldest` and record the given signed
+    server challenge as used. Returns False if it was already used.
+    """
+    cursor = conn.cursor()
+    # at use time, forget challenges too old to be accepted again
+    cursor.execute("DELETE FROM used_challenges WHERE issued < ?;", (oldest,))
+    cursor.execute(
+        "INSERT OR IGNORE INTO used_challenges (challenge, issued) VALUES (?, ?);",
+        (challenge, issued),
+    )
+    return cursor.rowcount == 1
+
+
+@metrics.timed_storage
+def forget_challenge(conn, challenge):
+    """Remove a signed server challenge from the used challenges."""
+    conn.execute("DELETE FROM used_challenges WHERE challenge = ?;", (challenge,))
+
+
 def check_basic_digest(nonce, actual_digest):
     """
     Check simplified basic digest authentication: actual_digest should be the
@@ -64,26 +138,60 @@ def check_basic_digest(nonce, actual_digest):
     return expected_digest == actual_digest
 
 
-def check_single_use_challenge_response(database, cr):
+@metrics.timed_storage
+def check_single_use_challenge_response(store, cr, conn=None, sc=None):
     """
     Check if client has previously authenticated with single use challenge
-    response method and obtained a token that is still current.
+    response method and obtained a token that is still current. Stores that
+    don't keep tokens check the response against the server challenge `sc`.
     """
-    with sqlite3.connect(database) as scores:
-        authed = query_token(scores, cr)
-    return authed
+    return store.consume(cr, conn, sc)
+
 
+def check_auth(store, request, conn=None):
+    """
+    Returns the games for which the request is authorized to submit scores.
 
-def check_auth(database, request):
-    """Returns the games for which the request is authorized to submit scores."""
+    Given a connection, a consumed token is only removed for good once the
+    caller commits.
+    """
     authed = []
     cr = request.cookies.get("_CR")
     nonce = request.cookies.get("NONCE")
     digest = request.cookies.get("DIGEST")
     if cr:
-        if check_single_use_challenge_response(database, cr):
+        sc = request.cookies.get("_SC")
+        if check_single_use_challenge_response(store, cr, conn, sc):
             authed.append("BUTTON")
+        count_auth("challenge_response", "BUTTON" in authed)
     if nonce and digest:
         if check_basic_digest(nonce, digest):
             authed.append("TIMING")
+        count_auth("digest", "TIMING" in authed)
     return authed
+
+
+def count_auth(method, passed):
+    """Count the outcome of checking one authentication method."""
+    outcome = "passed" if passed else "failed"
+    metrics.REGISTRY.inc("auth_total", (("method", method), ("outcome", outcome)))
+
+
+def check_admin(admin_token, request):
+    """
+    Return whether the request carries the admin token in its
+    `X-Admin-Token` header. Always False if there is no admin token.
+    """
+    provided = request.headers.get("X-Admin-Token")
+    if not admin_token or provided is None:
+        return False
+    return hmac.compare_digest(provided.encode(), admin_token.encode())
+
+
+def restore_auth(store, request, authed_for):
+    """
+    Return the single use token consumed by `check_auth` to the store, e.g.
+    after the submission it authenticated failed.
+    """
+    if "BUTTON" in authed_for:
+        store.restore(request.cookies["_CR"], request.cookies.get("_SC"))
@@ -0,0 +1,176 @@
+"""Module for handling pooled database connections."""
+import logging
+import os
+import queue
+import sqlite3
+from contextlib import contextmanager
+
+from flask import current_app, g
+
+from score_server import score_manager
+
+# Named PRAGMA tuning profiles applied to every pooled connection. `default`
+# keeps SQLite's own defaults (rollback journal, full sync).
+PRAGMA_PROFILES = {
+    "default": {},
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -8000,  # negative values are KiB
+        "mmap_size": 0,
+        "busy_timeout": 5000,  # milliseconds
+    },
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "busy_timeout": 5000,
+    },
+}
+
+# PRAGMAs that apply to each database file rather than to the connection
+PER_DATABASE_PRAGMAS = ("journal_mode", "synchronous", "cache_size", "mmap_size")
+
+POOL_SIZE = 8
+
+
+def shard_paths(database):
+    """
+    Return the path of the database file holding each game's scores when
+    sharding `database` by game, keyed by the schema name it is attached as.
+    Sharding doesn't apply to in-memory databases.
+    """
+    root, ext = os.path.splitext(str(database))
+    return {
+        game.lower(): f"{root}.{game.lower()}{ext or '.db'}"
+        for game in score_manager.SCORE_COMPARISONS_BY_GAME
+    }
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Connection opened by a pool, noting the schema names of the shards
+    attached to it so queries can be directed at the shard holding a game.
+    """
+
+    shards = ()
+
+
+class ConnectionPool:
+    """
+    Pool of long-lived connections to a database file.
+
+    Connections are checked out for the duration of a unit of work and
+    returned afterwards, so they can be shared between the short-lived threads
+    of a threaded server. Connections beyond `size` that are returned to a full
+    pool are closed. Because every connection to `:memory:` is a separate
+    database, pools should be given a database file.
+
+    Each of `shards`, a mapping of schema name to database file, is attached
+    to every connection. Every shard holds the same score tables for one
+    game, and `score_manager` qualifies table names with the game's schema.
+    SQLite locks each file separately, so writes for different games don't
+    block each other. With `uri`, the database and shards may be given as
+    SQLite URIs.
+    """
+
+    def __init__(
+        self, database, profile="default", size=POOL_SIZE, shards=None, uri=False
+    ):
+        self.database = database
+        self.uri = uri
+        self.profile = profile
+        self.pragmas = PRAGMA_PROFILES[profile]
+        self.size = size
+        self.shards = shards or dict()
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._pid = os.getpid()
+
+    def connect(self):
+        """Open a new connection with the pool's PRAGMA profile applied."""
+        conn = sqlite3.connect(
+            self.database,
+            check_same_thread=False,
+            uri=self.uri,
+            factory=PooledConnection,
+        )
+        for schema, path in self.shards.items():
+            conn.execute("ATTACH DATABASE ? AS ?;", (str(path), schema))
+        conn.shards = tuple(self.shards)
+        for pragma, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {pragma} = {value};")
+            if pragma in PER_DATABASE_PRAGMAS:
+                for schema in self.shards:
+                    conn.execute(f"PRAGMA {schema}.{pragma} = {value};")
+        logging.debug("opened connection to %s (%s)", self.database, self.profile)
+        return conn
+
+    def acquire(self):
+        """Check out an idle connection, opening a new one if none are idle."""
+        if os.getpid() != self._pid:
+            # connections must not be shared with a parent process after fork
+            self._idle = queue.LifoQueue(maxsize=self.size)
+            self._pid = os.getpid()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, conn):
+        """Return a connection to the pool, closing it if the pool is full."""
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def begin(self, conn):
+        """
+        Begin a transaction on a connection that will write. Without shards,
+        the write lock is taken immediately. With shards, `BEGIN IMMEDIATE`
+        would lock every attached file, so locks are taken as each file is
+        first written instead.
+        """
+        conn.execute("BEGIN;" if self.shards else "BEGIN IMMEDIATE;")
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for a unit of work. Like using a
+        `sqlite3.Connection` as a context manager, the transaction is
+        committed on success and rolled back on an exception.
+        """
+        conn = self.acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close all idle connections."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+
+
+def get_db():
+    """
+    Return the current request's connection, checking one out of the app's
+    pool on first use. It is returned to the pool when the request ends.
+    """
+    if "db" not in g:
+        g.db = current_app.config["POOL"].acquire()
+    return g.db
+
+
+def release_db(exception=None):
+    """Return the request's connection to the pool, rolling back any open work."""
+    conn = g.pop("db", None)
+    if conn is not None:
+        current_app.config["POOL"].release(conn)
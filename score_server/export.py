@@ -0,0 +1,69 @@
+"""Module for serializing scores to machine-readable formats."""
+import csv
+import io
+import json
+
+FIELDS = ("game", "username", "score", "date")
+
+CHUNK_SIZE = 64 * 1024  # characters
+
+
+def ndjson_lines(game, rows):
+    """Yield one JSON object per line for each `(username, score, date)`."""
+    for username, score, date in rows:
+        entry = {"game": game, "username": username, "score": score, "date": date}
+        yield json.dumps(entry) + "\n"
+
+
+def csv_lines(game, rows, header=True):
+    """
+    Yield a CSV header line, unless `header` is false, and then one line per
+    `(username, score, date)`.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(FIELDS)
+    for username, score, date in rows:
+        writer.writerow((game, username, score, date))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def read_ndjson(lines):
+    """Yield the entry on each non-blank line of newline-delimited JSON."""
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_csv(lines):
+    """Yield an entry for each row of CSV lines with a header line."""
+    yield from csv.DictReader(lines)
+
+
+FORMATS = {
+    "ndjson": {
+        "lines": ndjson_lines,
+        "read": read_ndjson,
+        "mimetype": "application/x-ndjson",
+    },
+    "csv": {"lines": csv_lines, "read": read_csv, "mimetype": "text/csv"},
+}
+
+
+def chunked(lines, size=CHUNK_SIZE):
+    """Join lines into chunks of about `size` characters to limit writes."""
+    chunk = []
+    length = 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= size:
+            yield "".join(chunk)
+            chunk = []
+            length = 0
+    if chunk:
+        yield "".join(chunk)
@@ -0,0 +1,118 @@
+"""Module for writing accepted scores in the background."""
+import logging
+import queue
+import threading
+import time
+
+from score_server import score_manager
+
+QUEUE_SIZE = 10000
+GROUP_SIZE = 500
+GROUP_LATENCY = 0.005  # seconds
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    Bounded queue of parsed score entries drained by one writer thread.
+
+    The writer collects entries into a group until it holds `group_size`
+    entries or `group_latency` seconds have passed since the first, keeps only
+    the best score for each `(game, username)` in the group, and commits the
+    group in one transaction. Submitting to a full queue fails immediately so
+    callers can shed load. Written scores are offered to `leaderboards`, if
+    given.
+    """
+
+    def __init__(
+        self,
+        pool,
+        leaderboards=None,
+        maxsize=QUEUE_SIZE,
+        group_size=GROUP_SIZE,
+        group_latency=GROUP_LATENCY,
+    ):
+        self.pool = pool
+        self.leaderboards = leaderboards
+        self.group_size = group_size
+        self.group_latency = group_latency
+        self._queue = queue.Queue(maxsize)
+        self._writer = threading.Thread(
+            target=self.write_groups, name="write-behind", daemon=True
+        )
+
+    def start(self):
+        """Start the writer thread."""
+        self._writer.start()
+
+    def submit(self, parsed_entry):
+        """Queue a `(game, username, score)` entry, returning False if full."""
+        try:
+            self._queue.put_nowait(parsed_entry)
+        except queue.Full:
+            return False
+        return True
+
+    def next_group(self):
+        """Return the next group of entries and whether the queue is stopping."""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        group = [first]
+        deadline = time.monotonic() + self.group_latency
+        while len(group) < self.group_size:
+            try:
+                entry = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                return group, True
+            group.append(entry)
+        return group, False
+
+    def write_groups(self):
+        """Write groups of entries until the queue is stopped."""
+        stopping = False
+        while not stopping:
+            group, stopping = self.next_group()
+            if group:
+                self.write(group)
+            for _ in range(len(group) + stopping):
+                self._queue.task_done()
+
+    def write(self, group):
+        """
+        Coalesce a group of entries into one best score per username and
+        commit them, with every entry in the score history, in one
+        transaction.
+        """
+        best = dict()
+        for game, username, score in group:
+            select = score_manager.SCORE_COMPARISONS_BY_GAME[game]["select"]
+            key = (game, username)
+            best[key] = select(best[key], score) if key in best else score
+        try:
+            with self.pool.connection() as scores:
+                # the history keeps every submission, not just the best
+                score_manager.insert_or_update_scores(
+                    scores,
+                    [(*key, score) for key, score in best.items()],
+                    self.leaderboards,
+                    history=group,
+                )
+        except Exception:
+            logging.exception("lost a group of %d score entries", len(group))
+        else:
+            score_manager.note_write()
+            logging.debug("wrote %d entries as %d updates", len(group), len(best))
+
+    def flush(self):
+        """Block until every queued entry has been written."""
+        self._queue.join()
+
+    def close(self):
+        """Write any queued entries and stop the writer thread."""
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
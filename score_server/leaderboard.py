@@ -0,0 +1,165 @@
+"""Module for ranking usernames by their best scores in memory."""
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+
+from score_server import score_manager
+
+
+class Leaderboard:
+    """
+    Sorted index of the best score of every username for one game.
+
+    Entries are kept in a sorted list of `(key, username)` where the key
+    orders scores best first, so ranks and neighbours are found by bisection
+    in O(log n). Updating an entry moves it within the list. Scores offered
+    while the index is being loaded are applied to the loaded index too.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.select = score_manager.SCORE_COMPARISONS_BY_GAME[game]["select"]
+        self.sign = score_manager.RANK_SIGNS[game]
+        self._entries = []
+        self._scores = dict()
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def load(self, rows):
+        """Replace the index with the given `(username, score, ...)` rows."""
+        with self._lock:
+            self._pending = []
+        try:
+            scores = {username: score for username, score, *_ in rows}
+            entries = sorted(
+                (self.sign * score, username) for username, score in scores.items()
+            )
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            # the rows may have been read before these scores were written
+            pending, self._pending = self._pending, None
+            self._scores = scores
+            self._entries = entries
+            for username, score in pending:
+                self._offer(username, score)
+
+    def offer(self, username, score):
+        """Record a score for a username, keeping the best one."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((username, score))
+            self._offer(username, score)
+
+    def _offer(self, username, score):
+        old_score = self._scores.get(username)
+        if old_score is not None:
+            best = self.select(old_score, score)
+            if best == old_score:
+                return
+            del self._entries[
+                bisect_left(self._entries, (self.sign * old_score, username))
+            ]
+        self._scores[username] = score
+        insort(self._entries, (self.sign * score, username))
+
+    def rank(self, username):
+        """
+        Return the rank of a username, 1 being best, or None if they have no
+        score. Usernames with equal scores share a rank.
+        """
+        with self._lock:
+            score = self._scores.get(username)
+            if score is None:
+                return None
+            return bisect_left(self._entries, (self.sign * score,)) + 1
+
+    def around(self, username, radius):
+        """
+        Return `(rank, username, score)` for a username and up to `radius`
+        entries either side of it in leaderboard order.
+        """
+        with self._lock:
+            score = self._scores.get(username)
+            if score is None:
+                return []
+            position = bisect_left(self._entries, (self.sign * score, username))
+            start = max(0, position - radius)
+            neighbours = self._entries[start : position + radius + 1]
+            return [
+                (
+                    bisect_left(self._entries, (key,)) + 1,
+                    neighbour,
+                    self._scores[neighbour],
+                )
+                for key, neighbour in neighbours
+            ]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Leaderboards:
+    """
+    In-memory leaderboards for every game, loaded from the database.
+
+    Scores written by this process are offered as they are written. Writes
+    by other processes are picked up by reloading once the index is older
+    than `max_age` seconds, if given. Stale indexes are reloaded by one
+    background thread at a time while the old ones keep being served.
+    """
+
+    def __init__(self, pool, max_age=None):
+        self.pool = pool
+        self.max_age = max_age
+        self.boards = {
+            game: Leaderboard(game) for game in score_manager.SCORE_COMPARISONS_BY_GAME
+        }
+        self.loaded = None
+        self._loading = threading.Lock()
+
+    def load(self):
+        """Load every game's leaderboard from the database."""
+        with self._loading:
+            self._load()
+
+    def _load(self):
+        with self.pool.connection() as scores:
+            for game, board in self.boards.items():
+                board.load(score_manager.iter_scores(scores, game, "username"))
+        self.loaded = time.monotonic()
+
+    def stale(self):
+        """Return whether the leaderboards are due to be reloaded."""
+        return self.max_age is not None and time.monotonic() - self.loaded > self.max_age
+
+    def board(self, game):
+        """
+        Return a game's leaderboard, starting a reload in the background if
+        it is too old and none is running already.
+        """
+        if self.stale() and self._loading.acquire(blocking=False):
+            threading.Thread(
+                target=self.reload, name="leaderboard-reload", daemon=True
+            ).start()
+        return self.boards[game]
+
+    def reload(self):
+        """Reload the leaderboards with the load lock already held."""
+        try:
+            self._load()
+        except Exception:
+            logging.exception("failed to reload leaderboards")
+        finally:
+            self._loading.release()
+
+    def close(self):
+        """Wait for any reload to finish and stop starting new ones."""
+        self._loading.acquire()
+
+    def offer(self, game, username, score):
+        """Record a score for a username in a game's leaderboard."""
+        self.boards[game].offer(username, score)
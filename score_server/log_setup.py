@@ -0,0 +1,18 @@
+"""
+Module for setting up the server's logging.
+
+Logging is set up as for the client, see `queued_logging`. Forked workers
+start over with a queue and listener thread of their own.
+"""
+import os
+
+from queued_logging import (
+    LOG_FORMATS,
+    configure_logging,
+    restart_logging,
+    stop_logging,
+)
+
+__all__ = ["LOG_FORMATS", "configure_logging", "stop_logging"]
+
+os.register_at_fork(after_in_child=restart_logging)
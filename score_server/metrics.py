@@ -0,0 +1,190 @@
+"""
+Module for collecting server metrics and exposing them in the Prometheus
+text format.
+
+Each thread counts into a shard of its own, so recording a value takes no
+lock. Shards are only summed when the metrics are scraped, and a thread's
+shard is folded into a shared total when the thread ends. Every process
+keeps its own counts, so with pre-forked workers each scrape reports on the
+worker that served it.
+"""
+import functools
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# seconds
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+PREFIX = "score_server"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# name -> (type, help)
+METRICS = {
+    "requests_total": ("counter", "Requests handled by endpoint and status."),
+    "request_seconds": ("histogram", "Time to handle requests by endpoint."),
+    "storage_seconds": ("histogram", "Time spent in storage calls by call site."),
+    "auth_total": ("counter", "Authentication checks by method and outcome."),
+    "token_store_size": ("gauge", "Challenge response tokens currently stored."),
+    "snapshot_age_seconds": ("gauge", "Age of the read snapshot of scores."),
+    "shed_total": ("counter", "Requests turned away by admission control."),
+}
+
+
+class ShardOwner:
+    """Held in a thread's local storage, collected when the thread ends."""
+
+    pass
+
+
+def new_shard():
+    """Return an empty shard of counters and histograms."""
+    return {"counters": dict(), "histograms": dict()}
+
+
+def merge_shard(total, shard):
+    """Add the counts of `shard` to `total`."""
+    # copy first, the owning thread may be adding keys
+    for key, value in list(shard["counters"].items()):
+        total["counters"][key] = total["counters"].get(key, 0) + value
+    for key, values in list(shard["histograms"].items()):
+        summed = total["histograms"].setdefault(key, [0] * len(values))
+        for i, value in enumerate(list(values)):
+            summed[i] += value
+
+
+class Registry:
+    """
+    Counters and latency histograms sharded per thread.
+
+    When a thread ends its shard is merged into a shared total, so short-lived
+    request threads don't leave a shard each behind.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards = dict()
+        self._retired = new_shard()
+        # reentrant, as a thread's owner may be collected while it holds the lock
+        self._lock = threading.RLock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            owner = self._local.owner = ShardOwner()
+            shard = self._local.shard = new_shard()
+            with self._lock:
+                self._shards[id(owner)] = shard
+            weakref.finalize(owner, self._retire, id(owner))
+            return shard
+
+    def _retire(self, key):
+        """Merge the shard of a thread that has ended into the shared total."""
+        with self._lock:
+            merge_shard(self._retired, self._shards.pop(key))
+
+    def inc(self, name, labels=(), amount=1):
+        """Add to the counter `name` with the given `(label, value)` pairs."""
+        counters = self._shard()["counters"]
+        key = (name, tuple(labels))
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        """Record a value in the histogram `name` with the given labels."""
+        histograms = self._shard()["histograms"]
+        key = (name, tuple(labels))
+        histogram = histograms.get(key)
+        if histogram is None:
+            # one count per bucket plus +Inf, then the sum of values
+            histogram = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    @contextmanager
+    def timer(self, name, labels):
+        """Observe the time taken by the body of the `with` statement."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, labels, time.perf_counter() - start)
+
+    def collect(self):
+        """Return summed `(counters, histograms)` across every thread."""
+        total = new_shard()
+        with self._lock:
+            merge_shard(total, self._retired)
+            shards = list(self._shards.values())
+        for shard in shards:
+            merge_shard(total, shard)
+        return total["counters"], total["histograms"]
+
+    def render(self, gauges=None):
+        """
+        Return every metric in the Prometheus text format, along with the
+        given `{name: value}` gauges.
+        """
+        counters, histograms = self.collect()
+        samples = {name: [] for name in METRICS}
+        for (name, labels), value in sorted(counters.items()):
+            samples[name].append(f"{PREFIX}_{name}{format_labels(labels)} {value}")
+        for (name, labels), values in sorted(histograms.items()):
+            metric = f"{PREFIX}_{name}"
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), values[:-1]):
+                cumulative += count
+                bucket = format_labels((*labels, ("le", bound)))
+                samples[name].append(f"{metric}_bucket{bucket} {cumulative}")
+            samples[name].append(f"{metric}_sum{format_labels(labels)} {values[-1]}")
+            samples[name].append(f"{metric}_count{format_labels(labels)} {cumulative}")
+        for name, value in (gauges or dict()).items():
+            samples[name].append(f"{PREFIX}_{name} {value}")
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            lines.append(f"# HELP {PREFIX}_{name} {description}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            lines.extend(samples[name])
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    """Return `(label, value)` pairs in the Prometheus label syntax."""
+    if not labels:
+        return ""
+    pairs = []
+    for label, value in labels:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{label}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+REGISTRY = Registry()
+
+
+def timed_storage(func):
+    """Decorate a storage call to record its time under its name."""
+    labels = (("site", func.__name__),)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with REGISTRY.timer("storage_seconds", labels):
+            return func(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,97 @@
+"""Module for caching rendered pages between score writes."""
+import gzip
+import hashlib
+import threading
+import time
+from collections import namedtuple
+
+from flask import make_response
+
+from score_server import score_manager
+
+CACHE_TTL = 5  # seconds
+MAX_CACHED_PAGES = 256
+
+CachedPage = namedtuple(
+    "CachedPage", ["body", "gzipped", "etag", "generation", "expires"]
+)
+
+
+class PageCache:
+    """
+    In-process cache of rendered pages.
+
+    Each page is tagged with the score write generation read before the page
+    was rendered, so any write through `score_manager` makes it stale. Writes
+    made by other processes are only noticed once a page's `ttl` runs out.
+    Pages rendered from another source of scores can be tagged by that
+    source's own `generation` instead.
+    """
+
+    def __init__(
+        self,
+        ttl=CACHE_TTL,
+        max_pages=MAX_CACHED_PAGES,
+        compress=True,
+        generation=score_manager.write_generation,
+    ):
+        self.ttl = ttl
+        self.generation = generation
+        self.max_pages = max_pages
+        self.compress = compress
+        self._pages = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached page for `key` if it is still current."""
+        page = self._pages.get(key)
+        if page is None:
+            return None
+        if page.generation != self.generation():
+            return None
+        if time.monotonic() > page.expires:
+            return None
+        return page
+
+    def put(self, key, generation, body):
+        """Cache and return a page rendered as of the given generation."""
+        data = body.encode()
+        page = CachedPage(
+            body=data,
+            gzipped=gzip.compress(data) if self.compress else None,
+            etag=hashlib.sha256(data).hexdigest(),
+            generation=generation,
+            expires=time.monotonic() + self.ttl,
+        )
+        if self.ttl <= 0:
+            return page
+        with self._lock:
+            self._pages.pop(key, None)
+            while len(self._pages) >= self.max_pages:
+                # dicts keep insertion order so this drops the oldest page
+                del self._pages[next(iter(self._pages))]
+            self._pages[key] = page
+        return page
+
+    def clear(self):
+        """Drop all cached pages."""
+        with self._lock:
+            self._pages.clear()
+
+
+def page_response(request, page):
+    """
+    Return a response for a cached page, gzip-encoded if the client accepts
+    it. The response carries a strong ETag so clients revalidating with
+    `If-None-Match` get `304 Not Modified` while the page is unchanged.
+    """
+    if page.gzipped is not None and "gzip" in request.accept_encodings:
+        response = make_response(page.gzipped)
+        response.headers["Content-Encoding"] = "gzip"
+        response.set_etag(f"{page.etag}-gzip")
+    else:
+        response = make_response(page.body)
+        response.set_etag(page.etag)
+    response.vary.add("Accept-Encoding")
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
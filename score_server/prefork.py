@@ -0,0 +1,189 @@
+"""
+Pre-forking production server.
+
+A master process binds the listening socket once and forks worker processes
+that all accept connections from it. Each worker serves requests on a
+bounded pool of threads. The master restarts workers that die, replaces all
+workers on SIGHUP and shuts workers down gracefully on SIGTERM or SIGINT.
+"""
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+from score_server import close_app
+from score_server.log_setup import stop_logging
+
+THREADS = 8
+BACKLOG = 1024
+GRACEFUL_TIMEOUT = 30  # seconds
+POLL_INTERVAL = 0.5  # seconds
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server handling each connection on a bounded pool of threads."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads=THREADS, fd=None):
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="worker")
+        super().__init__(host, port, app, fd=fd)
+
+    def process_request(self, request, client_address):
+        """Hand the connection to the thread pool."""
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        """Serve one connection, as `socketserver.ThreadingMixIn` does."""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def run_worker(app_factory, listener, threads):
+    """Serve requests from the shared listening socket until SIGTERM."""
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    app = app_factory()
+    host, port = listener.getsockname()[:2]
+    server = PooledWSGIServer(host, port, app, threads, fd=listener.fileno())
+    # workers race to accept each connection, losers must not block
+    server.socket.setblocking(False)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() so can't run on this thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    logging.info("worker %d serving", os.getpid())
+    server.serve_forever()
+    # finish in-flight requests
+    server.executor.shutdown(wait=True)
+    close_app(app)
+    logging.info("worker %d stopped", os.getpid())
+
+
+class PreforkServer:
+    """Master process managing pre-forked worker processes."""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        app_factory,
+        *,
+        host="127.0.0.1",
+        port=5000,
+        workers=2,
+        threads=THREADS,
+        backlog=BACKLOG,
+        graceful_timeout=GRACEFUL_TIMEOUT,
+    ):
+        self.app_factory = app_factory
+        self.address = (host, port)
+        self.num_workers = workers
+        self.threads = threads
+        self.backlog = backlog
+        self.graceful_timeout = graceful_timeout
+        self.workers = set()
+        self.listener = None
+        self._stopping = False
+        self._reload = False
+
+    def spawn_worker(self):
+        """Fork a worker process serving from the listening socket."""
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                run_worker(self.app_factory, self.listener, self.threads)
+            except BaseException:
+                logging.exception("worker failed")
+                status = 1
+            finally:
+                # os._exit skips atexit, write queued log records first
+                stop_logging()
+                os._exit(status)
+        self.workers.add(pid)
+        return pid
+
+    def reap_workers(self):
+        """Collect exited workers, returning how many exited."""
+        exited = 0
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid in self.workers:
+                self.workers.discard(pid)
+                exited += 1
+                logging.info("worker %d exited with status %d", pid, status)
+        return exited
+
+    def stop_workers(self, workers):
+        """
+        Ask workers to finish in-flight requests and exit, killing them if
+        they take longer than the graceful timeout.
+        """
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.workers & workers and time.monotonic() < deadline:
+            self.reap_workers()
+            time.sleep(POLL_INTERVAL / 10)
+        for pid in self.workers & workers:
+            logging.warning("killing worker %d after graceful timeout", pid)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.workers.discard(pid)
+
+    def handle_stop(self, signum, frame):
+        """Signal handler to stop the server."""
+        self._stopping = True
+
+    def handle_reload(self, signum, frame):
+        """Signal handler to replace all workers."""
+        self._reload = True
+
+    def run(self):
+        """Bind, fork workers and supervise them until told to stop."""
+        self.listener = socket.create_server(self.address, backlog=self.backlog)
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+        logging.info(
+            "master %d listening on %s with %d workers of %d threads",
+            os.getpid(),
+            self.address,
+            self.num_workers,
+            self.threads,
+        )
+        for _ in range(self.num_workers):
+            self.spawn_worker()
+        try:
+            while not self._stopping:
+                if self._reload:
+                    self._reload = False
+                    old_workers = set(self.workers)
+                    logging.info("reloading workers")
+                    for _ in range(self.num_workers):
+                        self.spawn_worker()
+                    self.stop_workers(old_workers)
+                self.reap_workers()
+                while len(self.workers) < self.num_workers and not self._stopping:
+                    self.spawn_worker()
+                time.sleep(POLL_INTERVAL)
+        finally:
+            self.stop_workers(set(self.workers))
+            self.listener.close()
+            logging.info("master stopped")
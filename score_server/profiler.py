@@ -0,0 +1,69 @@
+"""Module for profiling request handling per endpoint."""
+import cProfile
+import logging
+import os
+import pstats
+import threading
+from pathlib import Path
+
+PROFILE_DIR = "profiles"
+
+
+class EndpointProfiler:
+    """
+    Deterministic profiles of request handling aggregated by endpoint.
+
+    While enabled, each request is profiled with its own `cProfile.Profile`
+    and the result is added to the stats of the request's endpoint. Stats are
+    written to `directory` as one pstats file per endpoint and process, which
+    `pstats`, snakeviz or flameprof can read and combine.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, enabled=False):
+        self.directory = Path(directory)
+        self.enabled = enabled
+        self._stats = dict()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Return a started profile for a request, or None if disabled."""
+        if not self.enabled:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python >= 3.12 allows one active profiler per process
+            logging.debug("profiler busy, request not profiled")
+            return None
+        return profile
+
+    def stop(self, profile, endpoint):
+        """Stop a request's profile and add it to the endpoint's stats."""
+        profile.disable()
+        with self._lock:
+            if endpoint in self._stats:
+                self._stats[endpoint].add(profile)
+            else:
+                self._stats[endpoint] = pstats.Stats(profile)
+
+    def endpoints(self):
+        """Return the endpoints with collected stats."""
+        with self._lock:
+            return sorted(self._stats)
+
+    def dump(self):
+        """Write each endpoint's stats to a pstats file and return the paths."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        paths = []
+        with self._lock:
+            for endpoint, stats in self._stats.items():
+                path = self.directory / f"{endpoint}.{os.getpid()}.pstats"
+                stats.dump_stats(path)
+                paths.append(str(path))
+        return paths
+
+    def reset(self):
+        """Discard collected stats."""
+        with self._lock:
+            self._stats = dict()
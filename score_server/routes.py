@@ -2,22 +2,198 @@
 Score server that includes an authentication process and a score submission
 process.
 """
-import sqlite3
+import json
+import time
 
 from flask import (
     Blueprint,
+    abort,
     current_app,
+    g,
     make_response,
     redirect,
     render_template,
     request,
+    stream_with_context,
     url_for,
 )
 
-from score_server import auth_manager, score_manager
+from score_server import (
+    auth_manager,
+    connection_manager,
+    export,
+    metrics,
+    page_cache,
+    score_manager,
+)
 
 scoreboard = Blueprint("scoreboard", __name__)
 
+MAX_BATCH_ENTRIES = 10000
+DEFAULT_SCORES_LIMIT = 100
+MAX_SCORES_LIMIT = 1000
+MAX_RANK_RADIUS = 50
+# endpoints reading scores from the read snapshot, if enabled
+SNAPSHOT_ENDPOINTS = (
+    "scoreboard.show_scores",
+    "scoreboard.export_scores",
+    "scoreboard.show_rank",
+)
+# endpoints rate limited per client by admission control, if enabled
+RATE_LIMITED_ENDPOINTS = (
+    "scoreboard.do_auth",
+    "scoreboard.submit",
+    "scoreboard.submit_batch",
+)
+# endpoints exempt from the concurrency limit so overload can be observed
+UNLIMITED_ENDPOINTS = ("scoreboard.show_metrics", "scoreboard.admin_profile")
+
+
+@scoreboard.before_request
+def start_timer():
+    """Note when the request started for `record_request`."""
+    g.request_start = time.perf_counter()
+    g.profile = current_app.config["PROFILER"].start()
+
+
+@scoreboard.before_request
+def admit():
+    """
+    Turn away requests over the admission limits before any database work.
+    Clients over their rate limit get a 429, and requests beyond the
+    concurrency limit a 503, both with a Retry-After header.
+    """
+    admission = current_app.config["ADMISSION"]
+    if admission is None:
+        return None
+    if request.endpoint in RATE_LIMITED_ENDPOINTS:
+        over_limit = admission.check_rate(request.remote_addr)
+    else:
+        over_limit = None
+    if over_limit is not None:
+        reason, retry_after = over_limit
+        return shed(reason, 429, retry_after)
+    if request.endpoint not in UNLIMITED_ENDPOINTS:
+        if not admission.enter():
+            return shed("concurrency", 503, 1)
+        g.admitted = True
+    return None
+
+
+def charge_username(username):
+    """
+    Charge an authenticated submission to its username's rate limit, returning
+    `(reason, retry_after)` if it is over the limit, otherwise None.
+    """
+    admission = current_app.config["ADMISSION"]
+    if admission is None:
+        return None
+    return admission.check_username(username)
+
+
+def limit_username(username):
+    """
+    Charge an authenticated submission to its username's rate limit, returning
+    a 429 response if it is over the limit, otherwise None.
+    """
+    over_limit = charge_username(username)
+    if over_limit is None:
+        return None
+    reason, retry_after = over_limit
+    return shed(reason, 429, retry_after)
+
+
+def count_shed(reason):
+    """Count a request, or an entry of one, turned away for `reason`."""
+    metrics.REGISTRY.inc("shed_total", (("reason", reason),))
+    current_app.logger.debug("shed request to %s: %s", request.endpoint, reason)
+
+
+def shed(reason, status, retry_after):
+    """Count a request turned away for `reason` and return its response."""
+    count_shed(reason)
+    response = current_app.response_class(status=status)
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+@scoreboard.after_request
+def record_request(response):
+    """Count the request and record its latency by endpoint."""
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = ("endpoint", request.endpoint)
+    status = ("status", response.status_code)
+    metrics.REGISTRY.inc("requests_total", (endpoint, status))
+    metrics.REGISTRY.observe("request_seconds", (endpoint,), elapsed)
+    return response
+
+
+@scoreboard.after_request
+def report_snapshot_age(response):
+    """Tell clients how stale scores read from the read snapshot may be."""
+    snapshot = current_app.config["READ_SNAPSHOT"]
+    if snapshot is not None and request.endpoint in SNAPSHOT_ENDPOINTS:
+        response.headers["X-Snapshot-Age"] = f"{snapshot.age():.3f}"
+    return response
+
+
+@scoreboard.teardown_request
+def stop_profile(exception=None):
+    """Add the request's profile, if any, to its endpoint's stats."""
+    profile = g.pop("profile", None)
+    if profile is not None:
+        current_app.config["PROFILER"].stop(profile, request.endpoint)
+
+
+@scoreboard.teardown_request
+def release_admission(exception=None):
+    """Give back the request's slot under the concurrency limit, if it took one."""
+    if g.pop("admitted", False):
+        current_app.config["ADMISSION"].leave()
+
+
+@scoreboard.route("/admin/profile", methods=["GET", "POST"])
+def admin_profile():
+    """
+    Control per-endpoint profiling at runtime. Requests must carry the app's
+    admin token in an `X-Admin-Token` header, and the endpoint is disabled
+    without one. A POST with `action` set to `start` or `stop` toggles
+    profiling, `dump` writes the collected stats and `reset` discards them.
+    """
+    if not auth_manager.check_admin(current_app.config["ADMIN_TOKEN"], request):
+        abort(404)
+    profiler = current_app.config["PROFILER"]
+    dumped = []
+    if request.method == "POST":
+        action = request.form.get("action")
+        if action == "start":
+            profiler.enabled = True
+        elif action == "stop":
+            profiler.enabled = False
+        elif action == "dump":
+            dumped = profiler.dump()
+        elif action == "reset":
+            profiler.reset()
+        else:
+            abort(400)
+        current_app.logger.info("profiler action `%s`", action)
+    return {
+        "enabled": profiler.enabled,
+        "endpoints": profiler.endpoints(),
+        "dumped": dumped,
+    }
+
+
+@scoreboard.route("/metrics", methods=["GET"])
+def show_metrics():
+    """Return this process's metrics in the Prometheus text format."""
+    gauges = {"token_store_size": len(current_app.config["TOKEN_STORE"])}
+    if current_app.config["READ_SNAPSHOT"] is not None:
+        gauges["snapshot_age_seconds"] = current_app.config["READ_SNAPSHOT"].age()
+    return current_app.response_class(
+        metrics.REGISTRY.render(gauges), content_type=metrics.CONTENT_TYPE
+    )
+
 
 @scoreboard.route("/")
 @scoreboard.route("/index")
@@ -28,19 +204,125 @@ def index():
 
 @scoreboard.route("/scores", methods=["GET"])
 def show_scores():
-    """Return page with score tables for each game."""
-    game_data = dict()
-    with sqlite3.connect(current_app.config["DB"]) as scores:
-        cursor = scores.cursor()
-        for game in score_manager.SCORE_COMPARISONS_BY_GAME:
-            cursor.execute(f"SELECT * FROM {game}")
-            game_data[game] = cursor.fetchall()
-            current_app.logger.debug(f"game `{game}` scores: {game_data[game]}")
+    """
+    Return page with score tables for each game.
+
+    Each table shows at most `limit` entries, best first. A single game's
+    table can be selected with `game`, and paged through with `after` set to
+    the `<score>,<username>` of the last entry on the previous page. With
+    `window` set to `day` or `week`, tables show the best scores of the
+    current day or week instead of all time. Rendered pages are cached until
+    the next score write.
+    """
+    limit = request.args.get("limit", DEFAULT_SCORES_LIMIT, type=int)
+    limit = max(1, min(limit, MAX_SCORES_LIMIT))
+    games = score_manager.SCORE_COMPARISONS_BY_GAME
+    selected = request.args.get("game", "").upper() or None
+    if selected is not None and selected not in games:
+        abort(404)
+    window = request.args.get("window", "all")
+    if window not in score_manager.LEADERBOARD_WINDOWS:
+        abort(400)
+    position = None
+    if selected is not None and request.args.get("after"):
+        try:
+            position = score_manager.parse_after(selected, request.args["after"])
+        except ValueError:
+            abort(400)
+
+    cache = current_app.config["PAGE_CACHE"]
+    key = ("scores", selected, limit, position, window)
+    page = cache.get(key)
+    if page is None:
+        generation = cache.generation()
+        body = render_scores(selected, limit, position, window)
+        page = cache.put(key, generation, body)
+    return page_cache.page_response(request, page)
+
+
+def render_scores(selected, limit, position, window):
+    """Query and render the score tables for `show_scores`."""
+    game_data = dict.fromkeys(score_manager.SCORE_COMPARISONS_BY_GAME)
+    next_after = dict()
+    store = current_app.config["SCORE_STORE"]
+    for game in game_data:
+        if selected not in (None, game):
+            continue
+        after = position if game == selected else None
+        game_data[game] = store.top(game, limit, after, window)
+        if len(game_data[game]) == limit:
+            username, score = game_data[game][-1][:2]
+            next_after[game] = f"{score},{username}"
+        current_app.logger.debug("game `%s` scores: %s", game, game_data[game])
     return render_template(
-        "highscores.html", button=game_data["BUTTON"], timing=game_data["TIMING"]
+        "highscores.html",
+        button=game_data["BUTTON"],
+        timing=game_data["TIMING"],
+        next_after=next_after,
+        limit=limit,
+        window=window,
     )
 
 
+@scoreboard.route("/api/scores/<game>", methods=["GET"])
+def export_scores(game):
+    """
+    Stream all entries for a game as NDJSON or CSV, chosen with `format`.
+
+    Entries are ordered best first unless `order=username` is given and can
+    be cut off with `limit`. Rows are read from the score store as the
+    response is sent, so memory use doesn't grow with the table.
+    """
+    game = game.upper()
+    if game not in score_manager.SCORE_COMPARISONS_BY_GAME:
+        abort(404)
+    fmt = request.args.get("format", "ndjson")
+    order = request.args.get("order", "best")
+    limit = request.args.get("limit", type=int)
+    if fmt not in export.FORMATS or order not in score_manager.EXPORT_ORDERS:
+        abort(400)
+    if limit is not None and limit < 0:
+        abort(400)
+
+    rows = current_app.config["SCORE_STORE"].iterate(game, order, limit)
+
+    def generate():
+        yield from export.chunked(export.FORMATS[fmt]["lines"](game, rows))
+
+    return current_app.response_class(
+        stream_with_context(generate()), mimetype=export.FORMATS[fmt]["mimetype"]
+    )
+
+
+@scoreboard.route("/rank/<game>/<username>", methods=["GET"])
+def show_rank(game, username):
+    """
+    Return a username's rank in a game as JSON. With `around`, also return
+    that many neighbouring entries either side of the username.
+    """
+    game = game.upper()
+    if game not in score_manager.SCORE_COMPARISONS_BY_GAME:
+        abort(404)
+    radius = request.args.get("around", 0, type=int)
+    radius = max(0, min(radius, MAX_RANK_RADIUS))
+    store = current_app.config["SCORE_STORE"]
+    neighbours = store.around(game, username, radius)
+    if not neighbours:
+        abort(404)
+    [(rank, _, score)] = [entry for entry in neighbours if entry[1] == username]
+    return {
+        "game": game,
+        "username": username,
+        "score": score,
+        "rank": rank,
+        "of": store.count(game),
+        "around": [
+            {"rank": rank, "username": neighbour, "score": score}
+            for rank, neighbour, score in neighbours
+        ],
+    }
+
+
 @scoreboard.route("/auth", methods=["GET"])
 def do_auth():
     """
@@ -51,15 +333,15 @@ def do_auth():
     such that cr is the hash of sc with a secret key. Because this server is
     for exercises, the key is hardcoded into the app. The sc value is sent
     as a cookie in the response to the client. The cr value is stored in the
-    tokens database for reference by the submit endpoint.
+    token store for reference by the submit endpoint.
     """
     current_app.logger.debug("Received request to initiate auth")
     response = make_response(redirect(url_for("scoreboard.index")))
     good_ua = request.headers["user-agent"] == "basic-games"
     if request.method == "GET" and good_ua:
-        sc = auth_manager.init_auth(current_app.config["DB"])
+        sc = auth_manager.init_auth(current_app.config["TOKEN_STORE"])
         response.set_cookie("_SC", sc)
-    current_app.logger.debug(response)
+    current_app.logger.debug("%s", response)
     return response
 
 
@@ -74,28 +356,156 @@ def submit():
     """
     Provide form for submitting scores.
 
-    GET returns the form. A POST of the form is checked for authentication
-    and then the data is inserted into the database.
+    GET returns the form without touching the database. A POST of the form
+    is checked for authentication, charged to the username's rate limit, and
+    then the data is inserted into the database. With the sqlite score store,
+    consuming the authentication token and writing the score share one
+    transaction, so a failed write leaves the token usable. In write-behind
+    mode the score is queued instead, and a full queue is reported with a 503.
     """
     response = render_template("submit.html")
+    if request.method != "POST":
+        return response
     # PRG pattern
 
-    authed_for = auth_manager.check_auth(current_app.config["DB"], request)
-    current_app.logger.info(f"request is authenticated for {authed_for}")
+    scores, authed_for = begin_submission()
+    current_app.logger.info("request is authenticated for %s", authed_for)
 
-    sub_for = request.form.get("game") if request.method == "POST" else None
-    current_app.logger.debug(f"request is submitting for {sub_for}")
+    sub_for = request.form.get("game")
+    current_app.logger.debug("request is submitting for %s", sub_for)
+    written = False
     if sub_for is not None and sub_for.upper() in authed_for:
+        over_limit = limit_username(request.form.get("username"))
+        if over_limit is not None:
+            abandon_submission(scores, authed_for)
+            return over_limit
         try:
-            with sqlite3.connect(current_app.config["DB"]) as scores:
-                score_manager.insert_or_update_score(scores, request.form)
-                scores.commit()
+            if current_app.config["WRITE_QUEUE"] is not None:
+                queue_score(request.form)
+                improved = None  # not known until written
+            else:
+                improved = current_app.config["SCORE_STORE"].upsert(
+                    request.form, scores
+                )
+                written = True
+        except QueueFull:
+            current_app.logger.info("score queue full, shedding submission")
+            abandon_submission(scores, authed_for)
+            response = make_response(response, 503)
         except Exception as e:
             # leave default response
-            current_app.logger.info(f"failed score update with {type(e)}: {e.args[0]}")
-            pass
+            current_app.logger.info(
+                "failed score update with %s: %s", type(e), e.args[0]
+            )
+            abandon_submission(scores, authed_for)
         else:
             # submission success
             response = redirect(url_for("scoreboard.sub_ok"), code=303)
-            current_app.logger.info("successful score update")
+            current_app.logger.info("successful score update, improved: %s", improved)
+    if scores.in_transaction:
+        scores.commit()
+    if written:
+        score_manager.note_write()
     return response
+
+
+class QueueFull(Exception):
+    """Raise if the write-behind queue can't take another submission."""
+
+    pass
+
+
+def queue_score(score_entry):
+    """Validate a score entry and queue it for the background writer."""
+    parsed_entry = score_manager.parse_score_entry(score_entry)
+    if not current_app.config["WRITE_QUEUE"].submit(parsed_entry):
+        raise QueueFull
+
+
+def begin_submission():
+    """
+    Begin a write transaction on the request's connection and authenticate
+    the request within it. Returns the connection and the games the request
+    is authenticated for.
+    """
+    scores = connection_manager.get_db()
+    current_app.config["POOL"].begin(scores)
+    token_store = current_app.config["TOKEN_STORE"]
+    return scores, auth_manager.check_auth(token_store, request, scores)
+
+
+def abandon_submission(scores, authed_for):
+    """Roll back a failed submission and return any token it consumed."""
+    scores.rollback()
+    token_store = current_app.config["TOKEN_STORE"]
+    auth_manager.restore_auth(token_store, request, authed_for)
+
+
+def read_batch_entries(request):
+    """
+    Return the list of score entries in a batch request body. The body is
+    either a JSON array or newline-delimited JSON with one entry per line.
+    Raises ValueError if the body can't be read as either.
+    """
+    body = request.get_data(as_text=True)
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    entries = json.loads(body)
+    if not isinstance(entries, list):
+        raise ValueError("batch body must be a JSON array")
+    return entries
+
+
+@scoreboard.route("/submit/batch", methods=["POST"])
+def submit_batch():
+    """
+    Accept many score entries in one request.
+
+    The request is authenticated once, as for the submit endpoint, and each
+    entry for an authenticated game is charged to its username's rate limit.
+    Every usable entry within its limit is written in a single transaction.
+    The response lists a result for each entry in order.
+    """
+    try:
+        entries = read_batch_entries(request)
+    except ValueError as e:
+        return {"error": f"unreadable batch: {e.args[0]}"}, 400
+    if len(entries) > MAX_BATCH_ENTRIES:
+        return {"error": f"batch exceeds {MAX_BATCH_ENTRIES} entries"}, 413
+    scores, authed_for = begin_submission()
+    current_app.logger.info("batch request is authenticated for %s", authed_for)
+
+    results = []
+    accepted = []
+    for entry in entries:
+        try:
+            game, username, score = score_manager.parse_score_entry(entry)
+            if game not in authed_for:
+                raise ValueError(f"not authenticated for `{game}`")
+            over_limit = charge_username(username)
+            if over_limit is not None:
+                count_shed(over_limit[0])
+                raise ValueError(f"username `{username}` is over its rate limit")
+        except ValueError as e:
+            results.append({"status": "rejected", "reason": e.args[0]})
+        else:
+            results.append({"status": "accepted"})
+            accepted.append((game, username, score))
+
+    status = 200
+    try:
+        if accepted:
+            current_app.config["SCORE_STORE"].upsert_many(accepted, scores)
+    except Exception as e:
+        current_app.logger.info("failed batch update with %s: %s", type(e), e)
+        abandon_submission(scores, authed_for)
+        for result in results:
+            if result["status"] == "accepted":
+                result.update(status="failed", reason="database error")
+        status = 500
+    else:
+        scores.commit()
+        if accepted:
+            score_manager.note_write()
+        current_app.logger.info("batch update of %d scores", len(accepted))
+    return {"results": results}, status
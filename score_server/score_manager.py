@@ -1,44 +1,410 @@
 """Module for handling score submissions."""
+import itertools
 import logging
 
+from score_server import metrics
+
 SCORE_COMPARISONS_BY_GAME = {
-    "BUTTON": {"select": max, "cast": int},
-    "TIMING": {"select": min, "cast": float},
+    "BUTTON": {"select": max, "cast": int, "order": "DESC"},
+    "TIMING": {"select": min, "cast": float, "order": "ASC"},
+}
+
+# Scores of every game share tables, so each entry also stores a rank key that
+# sorts ascending from best to worst whatever the game's order. One index on
+# (game, rank_key, username) then serves every game's leaderboard, and lower
+# keys are better in every game.
+RANK_SIGNS = {
+    game: -1 if comparison["order"] == "DESC" else 1
+    for game, comparison in SCORE_COMPARISONS_BY_GAME.items()
 }
 
+# SQL for the period each windowed leaderboard is currently collecting, weeks
+# starting on Monday
+WINDOWS = {
+    "day": "date('now')",
+    "week": "date('now', 'weekday 0', '-6 days')",
+}
+LEADERBOARD_WINDOWS = ("all", *WINDOWS)
+
+SCORE_TABLES = ("scores", "score_history", "score_rollup")
+# Sharded databases keep each game's score tables in a database file of its
+# own, attached under the game's lowercase name. Otherwise they are in main.
+SCORE_SCHEMAS = ("main", *(game.lower() for game in SCORE_COMPARISONS_BY_GAME))
+
+_WRITE_COUNTER = itertools.count(1)
+_write_generation = 0
+
+
+def write_generation():
+    """Return a value that changes whenever scores are written or cleared."""
+    return _write_generation
+
+
+def note_write():
+    """
+    Record that scores changed so pages rendered from them are stale. Call it
+    once the write is committed: a page rendered between the write and its
+    commit would otherwise be cached as current.
+    """
+    global _write_generation  # noqa: PLW0603
+    _write_generation = next(_WRITE_COUNTER)
+
+
+def rank_key(game, score):
+    """Return the key ordering a game's score among all scores, best first."""
+    return RANK_SIGNS[game] * score
+
+
+def score_schema(conn, game):
+    """
+    Return the schema holding a game's score tables on a connection: the
+    game's shard if the connection has it attached, otherwise main.
+    """
+    schema = game.lower()
+    return schema if schema in getattr(conn, "shards", ()) else "main"
+
+
+def score_schemas(conn):
+    """Return every schema holding score tables on a connection."""
+    return tuple(getattr(conn, "shards", ())) or ("main",)
+
+
+def per_schema(template, **fields):
+    """Return a statement for each schema that may hold score tables."""
+    return {
+        schema: template.format(schema=schema, **fields) for schema in SCORE_SCHEMAS
+    }
+
+
+# Every statement below is the same text for every game in a schema, so SQLite
+# compiles each once per connection and reuses it from the statement cache.
+
+# Inserts a score or keeps the best of the new and existing score for a
+# username, comparing rank keys. The date is always refreshed. Assignments
+# all read the existing row, so `score` is chosen before `rank_key` changes.
+UPSERT_SQL = per_schema(
+    """
+    INSERT INTO {schema}.scores (game, username, score, rank_key, date)
+    VALUES (?, ?, ?, ?, datetime())
+    ON CONFLICT(game, username) DO UPDATE SET
+        score = iif(excluded.rank_key < rank_key, excluded.score, score),
+        rank_key = min(rank_key, excluded.rank_key),
+        date = excluded.date
+"""
+)
+
+HISTORY_SQL = per_schema(
+    """
+    INSERT INTO {schema}.score_history (game, username, score, date)
+    VALUES (?, ?, ?, datetime())
+"""
+)
+
+# One row for each window's current period
+ROLLUP_SQL = per_schema(
+    """
+    INSERT INTO {schema}.score_rollup
+        (game, span, period, username, score, rank_key, date)
+    VALUES {periods}
+    ON CONFLICT(game, span, period, username) DO UPDATE SET
+        score = iif(excluded.rank_key < rank_key, excluded.score, score),
+        rank_key = min(rank_key, excluded.rank_key),
+        date = excluded.date
+""",
+    periods=", ".join(
+        f"(?, '{window}', {period}, ?, ?, ?, datetime())"
+        for window, period in WINDOWS.items()
+    ),
+)
+
+
+def score_row(game, username, score):
+    """Return the parameters of `UPSERT_SQL` for an entry."""
+    return game, username, score, rank_key(game, score)
+
+
+def append_history(cursor, schema, parsed_entries):
+    """Append `(game, username, score)` entries to the score history in `schema`."""
+    cursor.executemany(HISTORY_SQL[schema], [tuple(entry) for entry in parsed_entries])
+
+
+def update_rollups(cursor, schema, parsed_entries):
+    """
+    Fold `(game, username, score)` entries into the rollup of best scores in
+    `schema` for each window's current period.
+    """
+    rows = [score_row(*entry) for entry in parsed_entries]
+    cursor.executemany(ROLLUP_SQL[schema], [row * len(WINDOWS) for row in rows])
+
+
+def record_history(cursor, schema, parsed_entries):
+    """Append entries to the score history and fold them into the rollups."""
+    append_history(cursor, schema, parsed_entries)
+    update_rollups(cursor, schema, parsed_entries)
+
+
+def group_by_schema(conn, entries):
+    """Return entries, each starting with a game, grouped by the game's schema."""
+    groups = dict()
+    for entry in entries:
+        groups.setdefault(score_schema(conn, entry[0]), []).append(entry)
+    return groups
+
+
+def parse_score_entry(score_entry):
+    """
+    Return `(game, username, score)` for a submitted entry, with the game
+    normalized and the score cast to the game's score type. The entry may be a
+    mapping with `game`, `username` and `score` keys or a 3-item sequence.
+    Raises ValueError describing why an entry is unusable.
+    """
+    try:
+        if hasattr(score_entry, "keys"):
+            game = score_entry["game"]
+            username = score_entry["username"]
+            score = score_entry["score"]
+        else:
+            game, username, score = score_entry
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("entry needs a game, username and score")
+    game = str(game).upper()
+    if game not in SCORE_COMPARISONS_BY_GAME:
+        raise ValueError(f"unknown game `{game}`")
+    if not isinstance(username, str) or not username:
+        raise ValueError("username must be a non-empty string")
+    try:
+        score = SCORE_COMPARISONS_BY_GAME[game]["cast"](score)
+    except (TypeError, ValueError):
+        raise ValueError(f"score `{score}` is not valid for `{game}`")
+    return game, username, score
+
 
-def insert_or_update_score(conn, score_entry):
+@metrics.timed_storage
+def insert_or_update_score(conn, score_entry, leaderboards=None):
     """
     Update the given database with the given score.
 
     If given score is 'better' than the one in the database, update the entry
     with the new score. Either way, update the time played. Determining if an
-    entry is better requires a game-specific score selection function and a
-    game-specific type function for scores that come in as strings.
+    entry is better requires a game-specific SQL aggregate and a game-specific
+    type function for scores that come in as strings. The comparison happens
+    in a single statement so concurrent submissions can't race.
+
+    Returns whether the given score is now the recorded best for the username.
+    The recorded best is also offered to `leaderboards`, if given. Committing
+    and then calling `note_write` are left to the caller.
     """
-    logging.debug(f"score update info: {score_entry}")
-    game = score_entry["game"].upper()
-    select = SCORE_COMPARISONS_BY_GAME[game]["select"]
+    logging.debug("score update info: %s", score_entry)
+    game, username, score = parse_score_entry(score_entry)
     cast = SCORE_COMPARISONS_BY_GAME[game]["cast"]
-    username = score_entry["username"]
-    score = score_entry["score"]
 
+    schema = score_schema(conn, game)
     cursor = conn.cursor()
+    [best_score] = cursor.execute(
+        UPSERT_SQL[schema] + " RETURNING score;", score_row(game, username, score)
+    ).fetchone()
+    record_history(cursor, schema, [(game, username, score)])
+    if leaderboards is not None:
+        leaderboards.offer(game, username, cast(best_score))
+    improved = cast(best_score) == score
+    logging.debug("recorded best for username: %s", best_score)
+    return improved
 
-    try:
-        [old_score] = cursor.execute(
-            f"SELECT score FROM {game} WHERE username = ?;", (username,)
-        ).fetchone()
-        logging.debug(f"found existing entry for username: {old_score}")
-    except TypeError:
-        # queries with no results return `None` instead of `[]`
-        replace_score = score
+
+@metrics.timed_storage
+def insert_or_update_scores(conn, parsed_entries, leaderboards=None, history=None):
+    """
+    Update the given database with many `(game, username, score)` entries, as
+    returned by `parse_score_entry`, using one `executemany`. The same
+    keep-best rule as `insert_or_update_score` applies, including between
+    entries for the same username. Committing, and then calling `note_write`,
+    is left to the caller so a whole batch lands in one transaction. Entries
+    are also offered to `leaderboards`, if given.
+
+    The entries are appended to the score history unless `history` is given,
+    in which case those entries are appended instead, e.g. every submission
+    that `parsed_entries` were coalesced from.
+    """
+    parsed_entries = list(parsed_entries)
+    history = parsed_entries if history is None else list(history)
+    logging.debug("batch update of %d scores", len(parsed_entries))
+    cursor = conn.cursor()
+    for schema, entries in group_by_schema(conn, parsed_entries).items():
+        cursor.executemany(UPSERT_SQL[schema], [score_row(*entry) for entry in entries])
+        update_rollups(cursor, schema, entries)
+    for schema, entries in group_by_schema(conn, history).items():
+        append_history(cursor, schema, entries)
+    if leaderboards is not None:
+        for game, username, score in parsed_entries:
+            leaderboards.offer(game, username, score)
+
+
+# Merges an imported score and date, keeping the best score and the latest
+# date for each username
+IMPORT_SQL = per_schema(
+    """
+    INSERT INTO {schema}.scores (game, username, score, rank_key, date)
+    VALUES (?, ?, ?, ?, ifnull(?, datetime()))
+    ON CONFLICT(game, username) DO UPDATE SET
+        score = iif(excluded.rank_key < rank_key, excluded.score, score),
+        rank_key = min(rank_key, excluded.rank_key),
+        date = max(ifnull(date, excluded.date), excluded.date)
+"""
+)
+
+
+def parse_import_entry(entry):
+    """
+    Return `(game, username, score, date)` from an exported entry, as for
+    `parse_score_entry`. A missing date is None. Raises ValueError if the
+    entry is malformed.
+    """
+    if not hasattr(entry, "keys"):
+        raise ValueError("entry must have named fields")
+    game, username, score = parse_score_entry(entry)
+    date = entry.get("date") or None
+    if date is not None and not isinstance(date, str):
+        raise ValueError("date must be a string")
+    return game, username, score, date
+
+
+def import_scores(conn, parsed_entries):
+    """
+    Merge many `(game, username, score, date)` entries, as returned by
+    `parse_import_entry`, into the given database with one `executemany`.
+    Imported scores aren't added to the score history. Committing, and then
+    calling `note_write`, is left to the caller.
+    """
+    for schema, entries in group_by_schema(conn, parsed_entries).items():
+        conn.executemany(
+            IMPORT_SQL[schema],
+            (
+                (*score_row(game, username, score), date)
+                for game, username, score, date in entries
+            ),
+        )
+
+
+def clear_scores(conn):
+    """Delete every game's scores, score history and rollups."""
+    for schema in score_schemas(conn):
+        for table in SCORE_TABLES:
+            conn.execute(f"DELETE FROM {schema}.{table};")
+    note_write()
+
+
+def parse_after(game, after):
+    """
+    Return the `(score, username)` keyset position from an `after` value of
+    the form `<score>,<username>`. Raises ValueError if it is malformed.
+    """
+    score, sep, username = after.partition(",")
+    if not sep:
+        raise ValueError(f"position `{after}` should be `<score>,<username>`")
+    return SCORE_COMPARISONS_BY_GAME[game]["cast"](score), username
+
+
+def top_scores_sql(schema, windowed, paged):
+    """Return the statement selecting a page of a leaderboard in a schema."""
+    table = f"{schema}.score_rollup" if windowed else f"{schema}.scores"
+    conditions = ["game = ?"]
+    if windowed:
+        periods = " ".join(
+            f"WHEN '{window}' THEN {period}" for window, period in WINDOWS.items()
+        )
+        conditions.append(f"span = ? AND period = CASE ? {periods} END")
+    if paged:
+        conditions.append("(rank_key, username) > (?, ?)")
+    return (
+        f"SELECT username, score, date FROM {table} "
+        f"WHERE {' AND '.join(conditions)} "
+        "ORDER BY rank_key, username LIMIT ?;"
+    )
+
+
+TOP_SCORES_SQL = {
+    (schema, windowed, paged): top_scores_sql(schema, windowed, paged)
+    for schema in SCORE_SCHEMAS
+    for windowed in (False, True)
+    for paged in (False, True)
+}
+
+
+@metrics.timed_storage
+def top_scores(conn, game, limit, after=None, window="all"):
+    """
+    Return up to `limit` `(username, score, date)` entries for a game, best
+    first, with ties ordered by username. Pages after the first are selected
+    by passing the `(score, username)` of the last entry of the previous page
+    as `after`, so each page is read straight off the rank index.
+
+    For a `window` other than `all`, entries are the best scores of the
+    window's current period, read from the rollup table.
+    """
+    params = [game]
+    windowed = window != "all"
+    if windowed:
+        params.extend([window, window])
+    if after is not None:
+        score, username = after
+        params.extend([rank_key(game, score), username])
+    sql = TOP_SCORES_SQL[(score_schema(conn, game), windowed, after is not None)]
+    return conn.execute(sql, (*params, limit)).fetchall()
+
+
+EXPORT_ORDERS = ("best", "username")
+
+
+def iter_scores_sql(schema, order, paged):
+    """Return the statement selecting a game's scores in an export order."""
+    if order == "best":
+        columns, position = "rank_key, username", "(rank_key, username) > (?, ?)"
     else:
-        replace_score = select(cast(old_score), cast(score))
+        columns, position = "username", "username > ?"
+    conditions = ["game = ?", position] if paged else ["game = ?"]
+    return (
+        f"SELECT username, score, date FROM {schema}.scores "
+        f"WHERE {' AND '.join(conditions)} ORDER BY {columns} LIMIT ?;"
+    )
+
+
+ITER_SCORES_SQL = {
+    (schema, order, paged): iter_scores_sql(schema, order, paged)
+    for schema in SCORE_SCHEMAS
+    for order in EXPORT_ORDERS
+    for paged in (False, True)
+}
+
 
-    insert_sql = f"""
-        INSERT OR REPLACE INTO {game} 
-        (username, score, date)
-        VALUES (?, ?, datetime())
+def iter_scores(conn, game, order="best", limit=None):
+    """
+    Yield `(username, score, date)` entries for a game without loading them
+    all into memory. Entries are ordered best first or by username.
+    """
+    if order not in EXPORT_ORDERS:
+        raise ValueError(f"order must be one of {EXPORT_ORDERS}")
+    cursor = conn.cursor()
+    cursor.arraysize = 1000
+    sql = ITER_SCORES_SQL[(score_schema(conn, game), order, False)]
+    cursor.execute(sql, (game, -1 if limit is None else limit))
+    while rows := cursor.fetchmany():
+        yield from rows
+
+
+def scores_page(conn, game, limit, order="best", after=None):
+    """
+    Return up to `limit` `(username, score, date)` entries for a game ordered
+    best first or by username. Pages after the first are selected by passing
+    the last entry of the previous page as `after`, so each page is read
+    straight off an index and needn't share a transaction with the others.
     """
-    cursor.execute(insert_sql, (username, replace_score))
+    if order not in EXPORT_ORDERS:
+        raise ValueError(f"order must be one of {EXPORT_ORDERS}")
+    params = [game]
+    if after is not None:
+        username, score = after[:2]
+        if order == "best":
+            params.append(rank_key(game, score))
+        params.append(username)
+    sql = ITER_SCORES_SQL[(score_schema(conn, game), order, after is not None)]
+    return conn.execute(sql, (*params, limit)).fetchall()
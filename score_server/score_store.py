@@ -0,0 +1,342 @@
+"""Module for storing the best score of every username for each game."""
+import heapq
+import itertools
+import threading
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta, timezone
+
+from score_server import metrics, score_manager
+
+STRIPES = 16
+EXPORT_PAGE_SIZE = 1000
+# matches SQLite's datetime()
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class SqliteScoreStore:
+    """
+    Scores kept in the app's database.
+
+    Writes use the connection given by the caller, so they can share a
+    transaction with consuming an authentication token, and the caller then
+    commits and calls `score_manager.note_write`. Otherwise writes use and
+    commit a connection from `pool`. Reads use connections from
+    `read_source`, the pool or a read snapshot, and ranks come from the
+    in-memory `leaderboards`.
+    """
+
+    def __init__(self, pool, leaderboards, read_source=None):
+        self.pool = pool
+        self.leaderboards = leaderboards
+        self.read_source = read_source or pool
+
+    def upsert(self, score_entry, conn=None):
+        """
+        Record a submitted score entry, keeping the best score for each
+        username. Returns whether the entry's score is now the best.
+        """
+        if conn is None:
+            with self.pool.connection() as pooled:
+                improved = self.upsert(score_entry, pooled)
+            score_manager.note_write()
+            return improved
+        return score_manager.insert_or_update_score(
+            conn, score_entry, self.leaderboards
+        )
+
+    def upsert_many(self, parsed_entries, conn=None):
+        """Record many `(game, username, score)` entries."""
+        if conn is None:
+            parsed_entries = list(parsed_entries)
+            if parsed_entries:
+                with self.pool.connection() as pooled:
+                    self.upsert_many(parsed_entries, pooled)
+                score_manager.note_write()
+            return
+        score_manager.insert_or_update_scores(
+            conn, parsed_entries, self.leaderboards
+        )
+
+    def top(self, game, limit, after=None, window="all"):
+        """Return a page of `(username, score, date)` entries, best first."""
+        with self.read_source.connection() as conn:
+            return score_manager.top_scores(conn, game, limit, after, window)
+
+    def around(self, game, username, radius):
+        """
+        Return `(rank, username, score)` for a username and up to `radius`
+        entries either side of it, or an empty list if it has no score.
+        """
+        return self.leaderboards.board(game).around(username, radius)
+
+    def count(self, game):
+        """Return the number of usernames with a score in a game."""
+        return len(self.leaderboards.board(game))
+
+    def iterate(self, game, order="best", limit=None):
+        """
+        Yield `(username, score, date)` entries ordered best first or by
+        username. Entries are read a page at a time, each in a short read
+        transaction of its own, so a slow download doesn't keep writers
+        waiting under the rollback journal. Scores written meanwhile may
+        move an entry to a page already read, or one still to come.
+        """
+        after = None
+        while limit is None or limit > 0:
+            size = EXPORT_PAGE_SIZE if limit is None else min(limit, EXPORT_PAGE_SIZE)
+            with self.read_source.connection() as conn:
+                page = score_manager.scores_page(conn, game, size, order, after)
+            yield from page
+            if len(page) < size:
+                return
+            after = page[-1]
+            if limit is not None:
+                limit -= size
+
+    def clear(self):
+        """Remove every score."""
+        with self.pool.connection() as conn:
+            score_manager.clear_scores(conn)
+        self.leaderboards.load()
+
+
+class Stripe:
+    """Some usernames' best scores with entries sorted best first."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.scores = dict()
+        self.entries = []
+
+
+class StripedBoard:
+    """
+    Best score and its date for every username in one game.
+
+    Usernames are split between stripes by hash. Each stripe keeps
+    `(key, username)` entries sorted, where the key orders scores best first,
+    under a lock of its own, so writes for usernames in different stripes
+    don't wait on each other. Reads merge the stripes taking each lock in
+    turn, so they may see a write to one stripe and not a later one to
+    another.
+    """
+
+    def __init__(self, game, stripes=STRIPES):
+        self.select = score_manager.SCORE_COMPARISONS_BY_GAME[game]["select"]
+        self.sign = score_manager.RANK_SIGNS[game]
+        self.stripes = [Stripe() for _ in range(stripes)]
+
+    def stripe(self, username):
+        """Return the stripe holding a username."""
+        return self.stripes[hash(username) % len(self.stripes)]
+
+    def offer(self, username, score, date):
+        """
+        Record a score for a username, keeping the best one. The date is
+        always refreshed. Returns the best score.
+        """
+        stripe = self.stripe(username)
+        with stripe.lock:
+            old = stripe.scores.get(username)
+            if old is not None:
+                best = self.select(old[0], score)
+                if best == old[0]:
+                    stripe.scores[username] = (best, date)
+                    return best
+                old_entry = (self.sign * old[0], username)
+                del stripe.entries[bisect_left(stripe.entries, old_entry)]
+            stripe.scores[username] = (score, date)
+            insort(stripe.entries, (self.sign * score, username))
+        return score
+
+    def top(self, limit, after=None):
+        """
+        Return up to `limit` `(username, score, date)` entries best first,
+        starting after the `(score, username)` position `after`, if given.
+        """
+        pages = []
+        for stripe in self.stripes:
+            with stripe.lock:
+                start = 0
+                if after is not None:
+                    score, username = after
+                    start = bisect_right(stripe.entries, (self.sign * score, username))
+                pages.append(stripe.entries[start : start + limit])
+        # dates are looked up once the page is known rather than copied for
+        # every candidate, and may be newer than the page's scores
+        return [
+            (username, self.sign * key, self.stripe(username).scores[username][1])
+            for key, username in itertools.islice(heapq.merge(*pages), limit)
+        ]
+
+    def rank(self, key):
+        """Return the rank of an entry key, 1 being best, ties sharing a rank."""
+        rank = 1
+        for stripe in self.stripes:
+            with stripe.lock:
+                rank += bisect_left(stripe.entries, (key,))
+        return rank
+
+    def around(self, username, radius):
+        """
+        Return `(rank, username, score)` for a username and up to `radius`
+        entries either side of it in leaderboard order.
+        """
+        stripe = self.stripe(username)
+        with stripe.lock:
+            found = stripe.scores.get(username)
+        if found is None:
+            return []
+        entry = (self.sign * found[0], username)
+        before, after = [], []
+        for stripe in self.stripes:
+            with stripe.lock:
+                position = bisect_left(stripe.entries, entry)
+                before.append(stripe.entries[max(0, position - radius) : position])
+                after.append(stripe.entries[position : position + radius + 1])
+        preceding = list(heapq.merge(*before))[-radius:] if radius else []
+        following = list(itertools.islice(heapq.merge(*after), radius + 1))
+        if not following or following[0][1] != username:
+            # moved by a concurrent write
+            return []
+        return [
+            (self.rank(key), neighbour, self.sign * key)
+            for key, neighbour in preceding + following
+        ]
+
+    def entries(self):
+        """Return a copy of every `(key, username, score, date)` entry by stripe."""
+        copies = []
+        for stripe in self.stripes:
+            with stripe.lock:
+                copies.append(
+                    [
+                        (key, username, *stripe.scores[username])
+                        for key, username in stripe.entries
+                    ]
+                )
+        return copies
+
+    def __len__(self):
+        return sum(len(stripe.entries) for stripe in self.stripes)
+
+
+def current_periods(now):
+    """Return the period each windowed leaderboard is collecting at `now`."""
+    today = now.date()
+    return {
+        "day": today.isoformat(),
+        "week": (today - timedelta(days=today.weekday())).isoformat(),
+    }
+
+
+class MemoryScoreStore:
+    """
+    Scores kept in process memory, for servers whose scores needn't outlive
+    them.
+
+    Each game's best scores, and those of the current day and week, are kept
+    in a `StripedBoard` split into `stripes` stripes. Boards of windows are
+    replaced when a new period starts. Scores are only visible to the process
+    that recorded them, and connections given to writes are ignored.
+    """
+
+    def __init__(self, stripes=STRIPES):
+        self.stripes = stripes
+        self.boards = dict()
+        self._windows = dict()
+        self._lock = threading.Lock()
+        self.clear()
+
+    def window_board(self, game, window, period):
+        """Return a game's board for a window's period, starting a new one if needed."""
+        with self._lock:
+            current = self._windows.get((game, window))
+            if current is None or current[0] != period:
+                current = (period, StripedBoard(game, self.stripes))
+                self._windows[(game, window)] = current
+            return current[1]
+
+    def record(self, game, username, score, now):
+        """Offer a score to a game's boards and return its best score."""
+        date = now.strftime(DATE_FORMAT)
+        for window, period in current_periods(now).items():
+            self.window_board(game, window, period).offer(username, score, date)
+        return self.boards[game].offer(username, score, date)
+
+    @metrics.timed_storage
+    def upsert(self, score_entry, conn=None):
+        """
+        Record a submitted score entry, keeping the best score for each
+        username. Returns whether the entry's score is now the best.
+        """
+        game, username, score = score_manager.parse_score_entry(score_entry)
+        best = self.record(game, username, score, datetime.now(timezone.utc))
+        score_manager.note_write()
+        return best == score
+
+    @metrics.timed_storage
+    def upsert_many(self, parsed_entries, conn=None):
+        """Record many `(game, username, score)` entries."""
+        now = datetime.now(timezone.utc)
+        written = 0
+        for game, username, score in parsed_entries:
+            self.record(game, username, score, now)
+            written += 1
+        if written:
+            score_manager.note_write()
+
+    @metrics.timed_storage
+    def top(self, game, limit, after=None, window="all"):
+        """Return a page of `(username, score, date)` entries, best first."""
+        if window == "all":
+            board = self.boards[game]
+        else:
+            period = current_periods(datetime.now(timezone.utc))[window]
+            board = self.window_board(game, window, period)
+        return board.top(limit, after)
+
+    def around(self, game, username, radius):
+        """
+        Return `(rank, username, score)` for a username and up to `radius`
+        entries either side of it, or an empty list if it has no score.
+        """
+        return self.boards[game].around(username, radius)
+
+    def count(self, game):
+        """Return the number of usernames with a score in a game."""
+        return len(self.boards[game])
+
+    def iterate(self, game, order="best", limit=None):
+        """Yield `(username, score, date)` entries ordered best first or by username."""
+        if order not in score_manager.EXPORT_ORDERS:
+            raise ValueError(f"order must be one of {score_manager.EXPORT_ORDERS}")
+        stripes = self.boards[game].entries()
+        if order == "best":
+            entries = heapq.merge(*stripes)
+        else:
+            entries = sorted(itertools.chain(*stripes), key=lambda entry: entry[1])
+        for _, username, score, date in itertools.islice(entries, limit):
+            yield username, score, date
+
+    def clear(self):
+        """Remove every score."""
+        with self._lock:
+            self.boards = {
+                game: StripedBoard(game, self.stripes)
+                for game in score_manager.SCORE_COMPARISONS_BY_GAME
+            }
+            self._windows = dict()
+        score_manager.note_write()
+
+
+SCORE_STORES = ("sqlite", "memory")
+
+
+def make_score_store(kind, pool, leaderboards, read_source=None):
+    """Return a score store of the named kind for an app with the given pool."""
+    if kind == "sqlite":
+        return SqliteScoreStore(pool, leaderboards, read_source)
+    if kind == "memory":
+        return MemoryScoreStore()
+    raise ValueError(f"score store must be one of {SCORE_STORES}")
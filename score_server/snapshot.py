@@ -0,0 +1,179 @@
+"""Module for serving scoreboard reads from a copy of the database."""
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from score_server import score_manager
+from score_server.connection_manager import ConnectionPool
+
+SNAPSHOT_MAX_AGE = 5  # seconds
+POLL_INTERVAL = 0.1  # seconds
+
+
+class Snapshot:
+    """
+    One copy of the database, with a pool of readers and a count of the
+    connections checked out of it.
+    """
+
+    def __init__(self, readers, copies, taken, writes):
+        self.readers = readers
+        self.copies = copies
+        self.taken = taken
+        self.writes = writes
+        self.checkouts = 0
+        self.retired = False
+
+
+class ReadSnapshot:
+    """
+    Read-only copy of the database kept in memory and refreshed periodically.
+
+    A background thread copies every database of the pool, including game
+    shards, with the SQLite online backup API once the copy is `max_age`
+    seconds old or, if given, once `max_writes` score writes have been made
+    by this process since. Readers check out connections to the current copy,
+    so reads never wait on the write path's locks. Connections to a replaced
+    copy keep working until they are returned, when they are closed, and the
+    replaced copy is freed once the last one is returned.
+    """
+
+    def __init__(
+        self,
+        pool,
+        max_age=SNAPSHOT_MAX_AGE,
+        max_writes=None,
+        poll_interval=POLL_INTERVAL,
+    ):
+        self.pool = pool
+        self.max_age = max_age
+        self.max_writes = max_writes
+        self.poll_interval = poll_interval
+        self.refreshes = 0
+        self._current = None
+        self._lock = threading.Lock()
+        self._names = itertools.count()
+        self._stop = threading.Event()
+        self._refresher = threading.Thread(
+            target=self.refresh_periodically, name="read-snapshot", daemon=True
+        )
+
+    def start(self):
+        """Take the first copy and start refreshing it in the background."""
+        self.refresh()
+        self._refresher.start()
+
+    def refresh(self):
+        """Copy the database and switch readers over to the copy."""
+        name = f"snapshot-{os.getpid()}-{id(self)}-{next(self._names)}"
+        uris = {
+            schema: f"file:{name}-{schema}?mode=memory&cache=shared"
+            for schema in ["main", *self.pool.shards]
+        }
+        writes = score_manager.write_generation()
+        copies = []
+        with self.pool.connection() as source:
+            for schema, uri in uris.items():
+                # in-memory databases last while any connection to them is open
+                copy = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                source.backup(copy, name=schema)
+                copies.append(copy)
+        main = uris.pop("main")
+        readers = ConnectionPool(main, shards=uris, uri=True)
+        with self._lock:
+            old = self._current
+            self._current = Snapshot(readers, copies, time.monotonic(), writes)
+            self.refreshes += 1
+        if old is not None:
+            self.retire(old)
+        logging.debug("refreshed read snapshot %d", self.refreshes)
+
+    def stale(self):
+        """Return whether the copy is due to be refreshed."""
+        if self.age() >= self.max_age:
+            return True
+        writes = score_manager.write_generation() - self._current.writes
+        return self.max_writes is not None and writes >= self.max_writes
+
+    def age(self):
+        """Return the age of the current copy in seconds."""
+        return time.monotonic() - self._current.taken
+
+    def refresh_periodically(self):
+        """Refresh the copy whenever it is stale until closed."""
+        while not self._stop.wait(self.poll_interval):
+            if self.stale():
+                try:
+                    self.refresh()
+                except sqlite3.Error:
+                    logging.exception("failed to refresh read snapshot")
+
+    def generation(self):
+        """Return a number that changes whenever the copy is refreshed."""
+        return self.refreshes
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection to the current copy. The copy is kept open
+        until the connection is returned, even if it is replaced meanwhile.
+        """
+        with self._lock:
+            snapshot = self._current
+            snapshot.checkouts += 1
+        try:
+            conn = snapshot.readers.acquire()
+        except BaseException:
+            self.check_in(snapshot, None)
+            raise
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.check_in(snapshot, conn)
+
+    def check_in(self, snapshot, conn):
+        """
+        Return a connection checked out of a copy, closing it if the copy has
+        been replaced, and the copy too if no other connections to it remain.
+        """
+        with self._lock:
+            snapshot.checkouts -= 1
+            if conn is not None and not snapshot.retired:
+                snapshot.readers.release(conn)
+                return
+            if conn is not None:
+                conn.close()
+            if not snapshot.retired or snapshot.checkouts:
+                return
+        close_copies(snapshot)
+
+    def retire(self, snapshot):
+        """
+        Stop a replaced copy from taking back connections, closing its idle
+        ones, and close it once no connections to it are checked out.
+        """
+        with self._lock:
+            snapshot.retired = True
+            snapshot.readers.close()
+            if snapshot.checkouts:
+                return
+        close_copies(snapshot)
+
+    def close(self):
+        """Stop refreshing and release the current copy."""
+        self._stop.set()
+        if self._refresher.is_alive():
+            self._refresher.join()
+        if self._current is not None:
+            self.retire(self._current)
+
+
+def close_copies(snapshot):
+    """Close the in-memory databases of a copy so their memory can be freed."""
+    for copy in snapshot.copies:
+        copy.close()
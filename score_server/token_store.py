@@ -0,0 +1,177 @@
+"""Module for storing single use challenge response tokens."""
+import hmac
+import threading
+import time
+from collections import deque
+
+from score_server import auth_manager
+
+MAX_TOKENS = 100000
+
+
+class SqliteTokenStore:
+    """Tokens kept in the tokens table of the app's database."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def challenge(self):
+        """Return a new random server challenge."""
+        return auth_manager.random_challenge()
+
+    def add(self, token):
+        """Store a token that expires after `auth_manager.EXPIRE` seconds."""
+        with self.pool.connection() as conn:
+            auth_manager.insert_token(conn, token)
+
+    def consume(self, token, conn=None, challenge=None):
+        """
+        Return whether the token was present and unexpired, removing it. Given
+        a connection, the removal is left for the caller to commit.
+        """
+        if conn is None:
+            with self.pool.connection() as pooled:
+                return self.consume(token, pooled)
+        return bool(auth_manager.query_token(conn, token))
+
+    def restore(self, token, challenge=None):
+        """
+        Nothing to do: a token consumed in a transaction is restored by
+        rolling the transaction back.
+        """
+
+    def __len__(self):
+        with self.pool.connection() as conn:
+            [count] = conn.execute("SELECT COUNT(*) FROM tokens;").fetchone()
+        return count
+
+
+class MemoryTokenStore:
+    """
+    Tokens kept in process memory.
+
+    Every token lives for the same amount of time, so tokens expire in the
+    order they were added and a queue of expiry times is enough to drop them
+    in amortised O(1). At most `max_tokens` are kept, dropping the oldest
+    first. Tokens are only visible to the process that issued them.
+    """
+
+    def __init__(self, expire=auth_manager.EXPIRE, max_tokens=MAX_TOKENS):
+        self.expire = expire
+        self.max_tokens = max_tokens
+        self._tokens = dict()
+        self._expiries = deque()
+        self._lock = threading.Lock()
+
+    def challenge(self):
+        """Return a new random server challenge."""
+        return auth_manager.random_challenge()
+
+    def _drop_expired(self, now):
+        while self._expiries and (
+            self._expiries[0][0] < now or len(self._tokens) > self.max_tokens
+        ):
+            expiry, token = self._expiries.popleft()
+            # a token added again since has a later expiry queued
+            if self._tokens.get(token) == expiry:
+                del self._tokens[token]
+
+    def add(self, token):
+        """Store a token that expires after `expire` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            self._tokens[token] = now + self.expire
+            self._expiries.append((now + self.expire, token))
+            self._drop_expired(now)
+
+    def consume(self, token, conn=None, challenge=None):
+        """
+        Return whether the token was present and unexpired, removing it. Any
+        connection is ignored since the tokens are not in the database.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._drop_expired(now)
+            return self._tokens.pop(token, None) is not None
+
+    def restore(self, token, challenge=None):
+        """Return a consumed token to the store with a fresh expiry."""
+        self.add(token)
+
+    def __len__(self):
+        return len(self._tokens)
+
+
+class SignedChallengeStore:
+    """
+    Signed server challenges, checked without storing tokens.
+
+    Server challenges hold their issue time and are signed with the shared
+    secret, so a client response is checked against the `_SC` challenge the
+    client sends back, in any process. To keep challenges single use, used
+    challenges are recorded in the used_challenges table of the app's
+    database, shared by every process, until they expire.
+    """
+
+    def __init__(self, pool, expire=auth_manager.EXPIRE):
+        self.pool = pool
+        self.expire = expire
+
+    def challenge(self):
+        """Return a new signed server challenge."""
+        return auth_manager.signed_challenge(int(time.time()))
+
+    def add(self, token):
+        """Nothing to do: the response is checked against its challenge."""
+
+    def consume(self, token, conn=None, challenge=None):
+        """
+        Return whether the token is the response to an unexpired challenge
+        made by this kind of store that hasn't been used yet, recording the
+        challenge as used. Given a connection, the record is left for the
+        caller to commit.
+        """
+        if token is None or challenge is None:
+            return False
+        issued = auth_manager.signed_challenge_issued(challenge)
+        now = int(time.time())
+        if issued is None or abs(now - issued) > self.expire:
+            return False
+        expected = auth_manager.expected_response(challenge)
+        if not hmac.compare_digest(token.encode(), expected.encode()):
+            return False
+        if conn is None:
+            with self.pool.connection() as pooled:
+                return auth_manager.use_challenge(
+                    pooled, challenge, issued, now - self.expire
+                )
+        return auth_manager.use_challenge(conn, challenge, issued, now - self.expire)
+
+    def restore(self, token, challenge=None):
+        """
+        Forget that a challenge was used so its response works again. A
+        challenge used in a transaction is already forgotten by rolling the
+        transaction back.
+        """
+        if challenge is not None:
+            with self.pool.connection() as conn:
+                auth_manager.forget_challenge(conn, challenge)
+
+    def __len__(self):
+        with self.pool.connection() as conn:
+            [count] = conn.execute("SELECT COUNT(*) FROM used_challenges;").fetchone()
+        return count
+
+
+TOKEN_STORES = ("sqlite", "memory", "signed")
+
+
+def make_token_store(kind, pool):
+    """Return a token store of the named kind for an app with the given pool."""
+    if kind == "sqlite":
+        return SqliteTokenStore(pool)
+    if kind == "memory":
+        return MemoryTokenStore()
+    if kind == "signed":
+        return SignedChallengeStore(pool)
+    raise ValueError(f"token store must be one of {TOKEN_STORES}")
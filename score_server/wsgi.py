@@ -1,16 +1,203 @@
 """Main entrypoint for score server."""
 import argparse
+import functools
+import itertools
 import logging
+import os
+import sys
 
-from score_server import clear_db, init_app
+from score_server import (
+    clear_db,
+    close_app,
+    export,
+    init_app,
+    init_db,
+    score_manager,
+)
+from score_server.admission import RATE_BURST
+from score_server.asgi import THREADS, AsgiApp
+from score_server.connection_manager import (
+    POOL_SIZE,
+    PRAGMA_PROFILES,
+    ConnectionPool,
+    shard_paths,
+)
+from score_server.log_setup import LOG_FORMATS, configure_logging
+from score_server.page_cache import CACHE_TTL
+from score_server.prefork import BACKLOG, GRACEFUL_TIMEOUT, PreforkServer
+from score_server.profiler import PROFILE_DIR
+from score_server.score_store import SCORE_STORES
+from score_server.token_store import TOKEN_STORES
 
 DATABASE = "scores.db"
 
-app = init_app(DATABASE)
+
+def __getattr__(name):
+    """
+    Create the module's default `app` for WSGI servers on first access, so
+    importing this module for other entrypoints doesn't create a database.
+    """
+    if name == "app":
+        globals()["app"] = init_app(DATABASE)
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+IMPORT_BATCH_SIZE = 10000
+IMPORT_TRANSACTION_SIZE = 500000
+WORKER_RANK_MAX_AGE = 5  # seconds
+
+
+def database_pool():
+    """Return a connection pool for the database, including any game shards."""
+    shards = shard_paths(DATABASE)
+    if not any(os.path.exists(path) for path in shards.values()):
+        shards = None
+    return ConnectionPool(DATABASE, shards=shards)
 
 
 def clear_database():
-    clear_db(DATABASE)
+    """Clear scores and tokens from the database, including any game shards."""
+    pool = database_pool()
+    with pool.connection() as conn:
+        clear_db(conn)
+    pool.close()
+
+
+def export_format(path, fmt):
+    """Return the named format, or the one suggested by a file's extension."""
+    if fmt is not None:
+        return fmt
+    return "csv" if path.endswith(".csv") else "ndjson"
+
+
+EXPORT_PARSER = argparse.ArgumentParser(description="Export scores")
+EXPORT_PARSER.add_argument(
+    "--game",
+    action="append",
+    type=str.upper,
+    choices=score_manager.SCORE_COMPARISONS_BY_GAME.keys(),
+    help="Game to export. Repeat for several games. Defaults to all games.",
+)
+EXPORT_PARSER.add_argument(
+    "--format",
+    choices=export.FORMATS.keys(),
+    help="Output format. Defaults to csv for a `.csv` output, otherwise ndjson.",
+)
+EXPORT_PARSER.add_argument(
+    "--order",
+    choices=score_manager.EXPORT_ORDERS,
+    default="username",
+    help="Order of each game's scores. Defaults to username.",
+)
+EXPORT_PARSER.add_argument(
+    "--output", default="-", help="File to write to. Defaults to stdout."
+)
+
+
+def export_database():
+    """Stream scores from the database to a CSV or NDJSON file."""
+    args = EXPORT_PARSER.parse_args()
+    fmt = export_format(args.output, args.format)
+    games = args.game or list(score_manager.SCORE_COMPARISONS_BY_GAME)
+    pool = database_pool()
+    output = sys.stdout
+    if args.output != "-":
+        output = open(args.output, "w", newline="")
+    try:
+        with pool.connection() as conn:
+            for i, game in enumerate(games):
+                rows = score_manager.iter_scores(conn, game, args.order)
+                if fmt == "csv":
+                    lines = export.csv_lines(game, rows, header=i == 0)
+                else:
+                    lines = export.ndjson_lines(game, rows)
+                for chunk in export.chunked(lines):
+                    output.write(chunk)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        pool.close()
+
+
+IMPORT_PARSER = argparse.ArgumentParser(
+    description="Import scores, keeping the best score for each username"
+)
+IMPORT_PARSER.add_argument(
+    "files", nargs="*", default=["-"], help="Files to import. Defaults to stdin."
+)
+IMPORT_PARSER.add_argument(
+    "--format",
+    choices=export.FORMATS.keys(),
+    help="Input format. Defaults to csv for `.csv` files, otherwise ndjson.",
+)
+IMPORT_PARSER.add_argument(
+    "--batch-size",
+    type=int,
+    default=IMPORT_BATCH_SIZE,
+    help=f"Entries written per executemany. Defaults to {IMPORT_BATCH_SIZE}.",
+)
+IMPORT_PARSER.add_argument(
+    "--transaction-size",
+    type=int,
+    default=IMPORT_TRANSACTION_SIZE,
+    help=f"Entries committed per transaction. Defaults to {IMPORT_TRANSACTION_SIZE}.",
+)
+
+
+def import_file(conn, lines, fmt, args):
+    """
+    Import the entries in an open file in batches, committing every
+    transaction-size entries. Returns the numbers of entries imported and
+    rejected.
+    """
+    imported = rejected = uncommitted = 0
+    entries = export.FORMATS[fmt]["read"](lines)
+    while True:
+        batch = []
+        try:
+            for entry in itertools.islice(entries, args.batch_size):
+                try:
+                    batch.append(score_manager.parse_import_entry(entry))
+                except ValueError as e:
+                    rejected += 1
+                    logging.debug("rejected entry %s: %s", entry, e.args[0])
+        except ValueError as e:
+            # unreadable line, nothing after it can be read reliably
+            logging.error("stopped reading at an unreadable entry: %s", e)
+            rejected += 1
+            entries = iter(())
+        if not batch:
+            break
+        score_manager.import_scores(conn, batch)
+        imported += len(batch)
+        uncommitted += len(batch)
+        if uncommitted >= args.transaction_size:
+            conn.commit()
+            uncommitted = 0
+            logging.info("imported %d entries", imported)
+    conn.commit()
+    return imported, rejected
+
+
+def import_database():
+    """Merge scores from CSV or NDJSON files into the database."""
+    args = IMPORT_PARSER.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    pool = database_pool()
+    try:
+        with pool.connection() as conn:
+            init_db(conn, sharded=bool(pool.shards))
+            for path in args.files:
+                fmt = export_format(path, args.format)
+                if path == "-":
+                    imported, rejected = import_file(conn, sys.stdin, fmt, args)
+                else:
+                    with open(path, newline="") as lines:
+                        imported, rejected = import_file(conn, lines, fmt, args)
+                logging.info("%s: imported %d, rejected %d", path, imported, rejected)
+    finally:
+        pool.close()
 
 
 def getLogLevels():
@@ -28,13 +215,166 @@ def getLogLevels():
 
 
 PARSER = argparse.ArgumentParser(description="Server for logging scores")
-PARSER.add_argument("--port", help="Port to use. Defaults to 5000.")
+PARSER.add_argument(
+    "--port", type=int, default=5000, help="Port to use. Defaults to 5000."
+)
 PARSER.add_argument(
     "--log-level",
     choices=getLogLevels(),
     default="INFO",
     help="Set log level to one of the named levels.",
 )
+PARSER.add_argument(
+    "--log-format",
+    choices=LOG_FORMATS,
+    default="text",
+    help="Write log records as text or as one JSON object per line.",
+)
+PARSER.add_argument(
+    "--db-profile",
+    choices=PRAGMA_PROFILES.keys(),
+    default="default",
+    help="Set the SQLite PRAGMA tuning profile. `wal` enables write-ahead "
+    "logging so readers don't block writers.",
+)
+PARSER.add_argument(
+    "--pool-size",
+    type=int,
+    default=POOL_SIZE,
+    help=f"Number of idle database connections to keep. Defaults to {POOL_SIZE}.",
+)
+PARSER.add_argument(
+    "--cache-ttl",
+    type=float,
+    default=CACHE_TTL,
+    help="Longest time in seconds to serve a cached scoreboard page. Pages are "
+    f"also refreshed after every score write. Defaults to {CACHE_TTL}.",
+)
+PARSER.add_argument(
+    "--token-store",
+    choices=TOKEN_STORES,
+    default="sqlite",
+    help="Where to keep challenge response tokens. `memory` avoids database "
+    "writes but only suits a single server process. `signed` stores nothing "
+    "until a challenge is used and works in any process, recording used "
+    "challenges in the database so every worker refuses replays.",
+)
+PARSER.add_argument(
+    "--score-store",
+    choices=SCORE_STORES,
+    default="sqlite",
+    help="Where to keep scores. `memory` keeps them in the server process only "
+    "and loses them on shutdown, for short-lived event servers. Best with "
+    "--token-store memory and without --workers.",
+)
+PARSER.add_argument(
+    "--write-behind",
+    action="store_true",
+    help="Queue accepted submissions for a background thread that writes them "
+    "in groups. Submissions are refused with 503 while the queue is full.",
+)
+PARSER.add_argument(
+    "--shard-by-game",
+    action="store_true",
+    help="Keep each game's scores in a database file of its own so writes for "
+    "different games don't wait on each other. Best with --token-store memory.",
+)
+PARSER.add_argument(
+    "--rank-max-age",
+    type=float,
+    help="Reload the in-memory rank index after this many seconds to pick up "
+    "scores written by other processes, e.g. other --workers. Defaults to "
+    f"{WORKER_RANK_MAX_AGE} with more than one of --workers, otherwise never.",
+)
+PARSER.add_argument(
+    "--read-snapshot",
+    type=float,
+    metavar="MAX_AGE",
+    help="Serve scoreboard, rank and export reads from an in-memory copy of "
+    "the database refreshed once it is this many seconds old, so reads don't "
+    "compete with writes. Responses report the copy's age in X-Snapshot-Age.",
+)
+PARSER.add_argument(
+    "--snapshot-writes",
+    type=int,
+    help="Also refresh the --read-snapshot copy after this many score writes.",
+)
+PARSER.add_argument(
+    "--rate-limit",
+    type=float,
+    help="Requests per second each client address and username may make to "
+    "/auth and /submit. Requests over the limit get a 429.",
+)
+PARSER.add_argument(
+    "--rate-burst",
+    type=int,
+    default=RATE_BURST,
+    help=f"Requests allowed at once under --rate-limit. Defaults to {RATE_BURST}.",
+)
+PARSER.add_argument(
+    "--trusted-proxies",
+    type=int,
+    default=0,
+    help="Reverse proxies in front of the server whose X-Forwarded-For header "
+    "is trusted for client addresses. Without it, --rate-limit sees every "
+    "client behind a proxy as the proxy. Defaults to 0.",
+)
+PARSER.add_argument(
+    "--max-concurrent",
+    type=int,
+    help="Requests handled at once in each process. Requests beyond it get a 503.",
+)
+PARSER.add_argument(
+    "--profile",
+    action="store_true",
+    help="Profile every request from the start. Stats per endpoint are "
+    "written to --profile-dir on shutdown.",
+)
+PARSER.add_argument(
+    "--profile-dir",
+    default=PROFILE_DIR,
+    help=f"Directory for profile stats. Defaults to `{PROFILE_DIR}`.",
+)
+PARSER.add_argument(
+    "--admin-token",
+    default=os.environ.get("SCORE_SERVER_ADMIN_TOKEN"),
+    help="Token for admin requests, such as toggling and dumping profiles at "
+    "/admin/profile. Defaults to $SCORE_SERVER_ADMIN_TOKEN. Admin requests are "
+    "refused without one.",
+)
+PARSER.add_argument(
+    "--asgi",
+    action="store_true",
+    help="Serve over ASGI with an asyncio event loop (requires uvicorn), so "
+    "idle keep-alive connections don't hold threads.",
+)
+PARSER.add_argument(
+    "--threads",
+    type=int,
+    default=THREADS,
+    help="Threads handling requests with --asgi or in each of --workers. "
+    f"Defaults to {THREADS}.",
+)
+PARSER.add_argument(
+    "--workers",
+    type=int,
+    help="Serve with this many pre-forked worker processes sharing one "
+    "listening socket instead of the development server. SIGHUP replaces "
+    "workers and SIGTERM stops them gracefully.",
+)
+PARSER.add_argument(
+    "--backlog",
+    type=int,
+    default=BACKLOG,
+    help=f"Listen backlog with --workers. Defaults to {BACKLOG}.",
+)
+PARSER.add_argument(
+    "--graceful-timeout",
+    type=float,
+    default=GRACEFUL_TIMEOUT,
+    help="Seconds workers get to finish requests when stopping. Defaults to "
+    f"{GRACEFUL_TIMEOUT}.",
+)
 
 
 def main():
@@ -42,10 +382,101 @@ def main():
     args = PARSER.parse_args()
 
     numeric_level = getattr(logging, args.log_level)
-    logging.basicConfig(level=numeric_level)
-    logging.info(f"Log level set to {args.log_level}[{numeric_level}]")
+    configure_logging(numeric_level, args.log_format)
+    logging.info("Log level set to %s[%d]", args.log_level, numeric_level)
 
-    app.run(port=args.port)
+    app_factory = functools.partial(
+        init_app,
+        DATABASE,
+        db_profile=args.db_profile,
+        pool_size=args.pool_size,
+        cache_ttl=args.cache_ttl,
+        token_store=args.token_store,
+        score_store=args.score_store,
+        write_behind=args.write_behind,
+        sharded=args.shard_by_game,
+        rank_max_age=rank_max_age(args),
+        profile=args.profile,
+        profile_dir=args.profile_dir,
+        admin_token=args.admin_token,
+        snapshot_max_age=args.read_snapshot,
+        snapshot_max_writes=args.snapshot_writes,
+        rate_limit=args.rate_limit,
+        rate_burst=args.rate_burst,
+        max_concurrent=args.max_concurrent,
+        trusted_proxies=args.trusted_proxies,
+    )
+    if args.workers:
+        serve_prefork(app_factory, args)
+        return
+    server_app = app_factory()
+    try:
+        if args.asgi:
+            serve_asgi(AsgiApp(server_app, args.threads), args.port)
+        else:
+            server_app.run(port=args.port)
+    finally:
+        close_app(server_app)
+
+
+def create_database(db_profile="default", sharded=False):
+    """
+    Create the database's tables, and any game shards, through a short-lived
+    pool rather than a whole app.
+    """
+    shards = shard_paths(DATABASE) if sharded else None
+    pool = ConnectionPool(DATABASE, db_profile, shards=shards)
+    try:
+        with pool.connection() as conn:
+            init_db(conn, sharded)
+    finally:
+        pool.close()
+
+
+def rank_max_age(args):
+    """
+    Return the seconds after which the rank index is reloaded. Several
+    workers default to `WORKER_RANK_MAX_AGE`, as each worker's index only
+    sees its own writes until reloaded.
+    """
+    if args.rank_max_age is None and args.workers and args.workers > 1:
+        return WORKER_RANK_MAX_AGE
+    return args.rank_max_age
+
+
+def serve_prefork(app_factory, args):
+    """
+    Serve with pre-forked worker processes. The master only creates the
+    database, and each worker builds its own app with `app_factory`.
+    """
+    if args.asgi:
+        PARSER.error("--workers can't be combined with --asgi")
+    if args.workers > 1 and args.token_store == "memory":
+        PARSER.error("--token-store memory can't be shared between --workers")
+    if args.workers > 1 and args.score_store == "memory":
+        PARSER.error("--score-store memory can't be shared between --workers")
+    if args.workers > 1 and args.db_profile == "default":
+        logging.warning("use --db-profile wal so workers' reads don't block writes")
+    # before any workers start, so they don't race to create tables
+    create_database(args.db_profile, args.shard_by_game)
+    server = PreforkServer(
+        app_factory,
+        port=args.port,
+        workers=args.workers,
+        threads=args.threads,
+        backlog=args.backlog,
+        graceful_timeout=args.graceful_timeout,
+    )
+    server.run()
+
+
+def serve_asgi(asgi_app, port):
+    """Serve an ASGI app with uvicorn, an optional dependency."""
+    try:
+        import uvicorn  # noqa: PLC0415
+    except ImportError:
+        PARSER.error("--asgi requires uvicorn: install basic-games[asgi]")
+    uvicorn.run(asgi_app, port=port, lifespan="on")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+"""Test basic_games/loadtest routines."""
+
+import os
+import socket
+import time
+
+import pytest
+import requests
+
+from basic_games import loadtest
+
+LATENCIES = [0.4, 0.1, 0.3, 0.2]
+ELAPSED = 2.0
+QUEUED = 1.0  # seconds
+
+
+def free_port():
+    """Return a port that is currently free on localhost."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_game_mix():
+    """Test game weights are parsed and unknown games refused."""
+    assert loadtest.game_mix("button=3, timing=0.5") == {"BUTTON": 3, "TIMING": 0.5}
+    with pytest.raises(ValueError):
+        loadtest.game_mix("chess=1")
+
+
+def test_percentile():
+    """Test the nearest-rank percentile of sorted values."""
+    ordered = sorted(LATENCIES)
+    assert loadtest.percentile(ordered, 50) == ordered[1]
+    assert loadtest.percentile(ordered, 99) == ordered[-1]
+    assert loadtest.percentile([1], 0) == 1
+
+
+def test_recorder_summary():
+    """Test latencies and failures are summarised per endpoint."""
+    recorder = loadtest.Recorder()
+    for seconds in LATENCIES:
+        recorder.record("/submit", seconds, seconds < max(LATENCIES))
+    recorder.record("/auth", 0.1, True)
+    summary = recorder.summary(ELAPSED)
+    assert list(summary) == ["/auth", "/submit"]
+    submit = summary["/submit"]
+    assert submit["requests"] == len(LATENCIES)
+    assert submit["failures"] == 1
+    assert submit["throughput"] == len(LATENCIES) / ELAPSED
+    assert submit["mean"] == pytest.approx(sum(LATENCIES) / len(LATENCIES))
+    assert submit["max"] == max(LATENCIES)
+    assert submit["p50"] == sorted(LATENCIES)[1]
+    assert summary["/auth"]["failures"] == 0
+
+
+class FakeSession:
+    """Session accepting every submission without a server."""
+
+    def __init__(self, location, method):
+        self.method = method
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def post(self, url, **kwargs):
+        response = requests.Response()
+        response.status_code = requests.codes.SEE_OTHER
+        return response
+
+
+def test_visit_timed_from_arrival(monkeypatch):
+    """Test a late visit is timed from its arrival and its wait recorded."""
+    monkeypatch.setattr(loadtest.submission, "AuthedSession", FakeSession)
+    load_test = loadtest.LoadTest("http://localhost", mix={"TIMING": 1})
+    load_test.visit(time.perf_counter() - QUEUED)
+    submit = load_test.recorder.summary(ELAPSED)[loadtest.submission.SCORE_ENDPOINT]
+    assert submit["failures"] == 0
+    assert submit["max"] >= QUEUED
+    assert load_test.recorder.delay_summary()["max"] >= QUEUED
+    load_test.visit()
+    assert len(load_test.recorder.delays) == 1
+
+
+def test_local_server_keeps_scores_away(tmp_path, monkeypatch):
+    """Test a started server keeps its database out of the working directory."""
+    monkeypatch.chdir(tmp_path)
+    port = free_port()
+    with loadtest.local_server(port, []) as process:
+        response = requests.get(f"http://127.0.0.1:{port}/scores", timeout=5)
+        assert response.status_code == requests.codes.OK
+    assert process.poll() is not None
+    assert not os.listdir(tmp_path)
@@ -0,0 +1,40 @@
+"""Test basic_games/submission routines."""
+
+import requests
+
+from basic_games import submission
+
+ENTRIES = [{"game": "button", "username": "user", "score": score} for score in (1, 2)]
+
+
+def test_batch_retry_resends_entries(monkeypatch):
+    """Test a retried batch sends every entry again when given a generator."""
+    posted = []
+
+    class FlakySession:
+        """Session whose first post is refused, recording each batch posted."""
+
+        def __init__(self, location, method):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            pass
+
+        def post(self, url, json):
+            posted.append(json)
+            response = requests.Response()
+            response.status_code = requests.codes.SERVICE_UNAVAILABLE
+            if len(posted) > 1:
+                response.status_code = requests.codes.OK
+                response._content = b'{"results": [{"status": "accepted"}]}'
+            return response
+
+    monkeypatch.setattr(submission, "AuthedSession", FlakySession)
+    results = submission.attempt_batch_posts_with(
+        ("localhost", 5000), "basic_digest", (entry for entry in ENTRIES)
+    )
+    assert results == [{"status": "accepted"}]
+    assert posted == [ENTRIES, ENTRIES]
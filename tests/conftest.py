@@ -22,21 +22,23 @@ def db_entries():
     """Sample entries for each table in the database."""
     date = "2024-01-12 12:46:45"
     token = ("1vppX8i17HcMTkAjTColXbCxaBStyknHeKpqRI3O9hc=", date)
-    button_score = ("user", "10", date)
-    timing_score = ("user", "15.976295709609985", date)
+    score = ("BUTTON", "user", 10, -10, date)
+    history = ("TIMING", "user", 15.976295709609985, date)
     return {
         "tokens": token,
-        "button": button_score,
-        "timing": timing_score,
+        "scores": score,
+        "score_history": history,
     }
 
 
-@pytest.fixture
-def app():
-    """Sample app for flask testing."""
-    yield score_server.init_app(TEST_DB)
-    with sqlite3.connect(TEST_DB) as conn:
+@pytest.fixture(params=["sqlite", "memory", "signed"])
+def app(request):
+    """Sample app for flask testing with each kind of token store."""
+    app = score_server.init_app(TEST_DB, token_store=request.param)
+    yield app
+    with app.config["POOL"].connection() as conn:
         score_server.clear_db(conn)
+    score_server.close_app(app)
 
 
 @pytest.fixture
@@ -0,0 +1,137 @@
+"""Test score_server/admission routines."""
+
+import pytest
+import requests
+
+import score_server
+from score_server import auth_manager
+from score_server.admission import AdmissionControl, RateLimiter
+
+BURST = 3
+MAX_KEYS = 2
+
+
+@pytest.fixture
+def limited_app(tmp_path):
+    """App allowing a small burst per client and no refill to speak of."""
+    app = score_server.init_app(
+        str(tmp_path / "scores.db"), rate_limit=0.001, rate_burst=BURST
+    )
+    yield app
+    score_server.close_app(app)
+
+
+def test_rate_limiter_burst():
+    """Test a key is refused once its burst is used, other keys aren't."""
+    limiter = RateLimiter(0.5, BURST)
+    assert [limiter.allow("a") for _ in range(BURST)] == [0] * BURST
+    assert limiter.allow("a") == pytest.approx(2, rel=0.01)
+    assert limiter.allow("b") == 0
+
+
+def test_rate_limiter_evicts_least_recent():
+    """Test buckets are kept for a bounded number of keys."""
+    limiter = RateLimiter(0.001, 1, MAX_KEYS)
+    limiter.allow("a")
+    limiter.allow("b")
+    limiter.allow("a")
+    limiter.allow("c")
+    assert len(limiter) == MAX_KEYS
+    # b was forgotten so starts with a full bucket again, a wasn't
+    assert limiter.allow("b") == 0
+    assert limiter.allow("c") > 0
+
+
+def test_admission_concurrency():
+    """Test slots are refused without waiting once all are taken."""
+    admission = AdmissionControl(max_concurrent=1)
+    assert admission.enter()
+    assert not admission.enter()
+    admission.leave()
+    assert admission.enter()
+    assert admission.check_rate("127.0.0.1") is None
+
+
+def test_auth_rate_limited(limited_app):
+    """Test a client over its rate limit gets a 429 and the shed is counted."""
+    client = limited_app.test_client()
+    client.environ_base["HTTP_USER_AGENT"] = "basic-games"
+    for _ in range(BURST):
+        assert client.get("/auth").status_code == requests.codes.FOUND
+    response = client.get("/auth")
+    assert response.status_code == requests.codes.TOO_MANY_REQUESTS
+    assert int(response.headers["Retry-After"]) > 0
+    # reads aren't rate limited
+    assert client.get("/scores").status_code == requests.codes.OK
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'score_server_shed_total{reason="address_rate"}' in text
+
+
+def authed_client(app, address):
+    """Return a client at `address` authenticated to submit scores."""
+    client = app.test_client()
+    client.environ_base.update(
+        {"HTTP_USER_AGENT": "basic-games", "REMOTE_ADDR": address}
+    )
+    client.get("/auth")
+    sc = client.get_cookie("_SC").value
+    client.set_cookie("_CR", auth_manager.expected_response(sc))
+    return client
+
+
+def test_submit_rate_limited_by_username(limited_app):
+    """Test authenticated submissions for one username are limited across addresses."""
+    form = {"game": "button", "username": "spammer", "score": 1}
+    for address in range(BURST):
+        client = authed_client(limited_app, f"10.0.0.{address}")
+        response = client.post("/submit", data=form)
+        assert response.status_code == requests.codes.SEE_OTHER
+    client = authed_client(limited_app, "10.0.1.0")
+    response = client.post("/submit", data=form)
+    assert response.status_code == requests.codes.TOO_MANY_REQUESTS
+
+
+def test_batch_rate_limited_by_username(limited_app):
+    """Test each authenticated batch entry is charged to its username."""
+    client = authed_client(limited_app, "10.0.0.0")
+    entries = [{"game": "button", "username": "spammer", "score": 1}] * (BURST + 1)
+    entries.append({"game": "button", "username": "someone", "score": 1})
+    response = client.post("/submit/batch", json=entries)
+    assert response.status_code == requests.codes.OK
+    statuses = [result["status"] for result in response.get_json()["results"]]
+    assert statuses == ["accepted"] * BURST + ["rejected", "accepted"]
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'score_server_shed_total{reason="username_rate"}' in text
+
+
+def test_unauthenticated_submit_spares_username(limited_app):
+    """Test submissions that fail authentication don't use up a username's limit."""
+    client = limited_app.test_client()
+    form = {"game": "button", "username": "victim", "score": 1}
+    for address in range(BURST + 1):
+        environ = {"REMOTE_ADDR": f"10.0.0.{address}"}
+        for _ in range(BURST):
+            response = client.post("/submit", data=form, environ_base=environ)
+            assert response.status_code == requests.codes.OK
+    client = authed_client(limited_app, "10.0.1.0")
+    response = client.post("/submit", data=form)
+    assert response.status_code == requests.codes.SEE_OTHER
+
+
+def test_trusted_proxy_addresses(tmp_path):
+    """Test clients behind a trusted proxy are limited by their own address."""
+    app = score_server.init_app(
+        str(tmp_path / "scores.db"),
+        rate_limit=0.001,
+        rate_burst=1,
+        trusted_proxies=1,
+    )
+    client = app.test_client()
+    client.environ_base["HTTP_USER_AGENT"] = "basic-games"
+    for address in ("192.0.2.1", "192.0.2.2"):
+        headers = {"X-Forwarded-For": address}
+        assert client.get("/auth", headers=headers).status_code == requests.codes.FOUND
+    headers = {"X-Forwarded-For": "192.0.2.1"}
+    response = client.get("/auth", headers=headers)
+    assert response.status_code == requests.codes.TOO_MANY_REQUESTS
+    score_server.close_app(app)
@@ -0,0 +1,110 @@
+"""Test score_server/asgi routines."""
+
+import asyncio
+import json
+
+import pytest
+import requests
+
+from score_server import auth_manager
+from score_server.asgi import AsgiApp
+
+STREAMED_ROWS = 20000
+STREAMS = 5
+
+
+@pytest.fixture
+def asgi_app(app):
+    """Sample ASGI app wrapping the flask testing app."""
+    asgi_app = AsgiApp(app, threads=4)
+    yield asgi_app
+    asgi_app.executor.shutdown()
+
+
+def call(asgi_app, method, path, headers=(), body=b""):
+    """Return the status, headers and body of a request to an ASGI app."""
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "path": path,
+        "query_string": b"",
+        "headers": [
+            (name.encode(), value.encode())
+            for name, value in headers
+        ],
+    }
+    messages = [{"type": "http.request", "body": body}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+    start, *bodies = sent
+    headers = [(name.decode(), value.decode()) for name, value in start["headers"]]
+    return start["status"], headers, b"".join(body["body"] for body in bodies)
+
+
+def test_scores(asgi_app):
+    """Test pages are served through the ASGI app."""
+    status, _, body = call(asgi_app, "GET", "/scores")
+    assert status == requests.codes.OK
+    assert b"<title>High Scores</title>" in body
+
+
+def test_auth_and_submit(asgi_app):
+    """Test cookies and redirects match the WSGI app."""
+    status, headers, _ = call(
+        asgi_app, "GET", "/auth", headers=[("user-agent", "basic-games")]
+    )
+    assert status == requests.codes.FOUND
+    assert ("location", "/index") in headers
+    [sc] = [
+        value.split(";")[0].removeprefix("_SC=")
+        for name, value in headers
+        if name == "set-cookie" and value.startswith("_SC=")
+    ]
+
+    form = [("content-type", "application/x-www-form-urlencoded")]
+    entry = b"game=button&username=user&score=10"
+    status, _, _ = call(asgi_app, "POST", "/submit", headers=form, body=entry)
+    assert status == requests.codes.OK
+
+    cookies = f"_SC={sc}; _CR={auth_manager.expected_response(sc)}"
+    status, headers, _ = call(
+        asgi_app, "POST", "/submit", headers=[*form, ("cookie", cookies)], body=entry
+    )
+    assert status == requests.codes.SEE_OTHER
+    assert ("location", "/submissionOK") in headers
+
+
+def test_chunked_upload(asgi_app):
+    """Test request bodies sent without a Content-Length reach the app."""
+    headers = [
+        ("content-type", "application/json"),
+        ("transfer-encoding", "chunked"),
+    ]
+    body = json.dumps([{"game": "button", "username": "user", "score": 1}])
+    status, _, response = call(
+        asgi_app, "POST", "/submit/batch", headers=headers, body=body.encode()
+    )
+    assert status == requests.codes.OK
+    [result] = json.loads(response)["results"]
+    assert result == {"status": "rejected", "reason": "not authenticated for `BUTTON`"}
+
+
+def test_streamed_export(asgi_app, app):
+    """Test streamed responses survive their chunks running on other threads."""
+    app.config["SCORE_STORE"].upsert_many(
+        ("BUTTON", f"user{i}", i) for i in range(STREAMED_ROWS)
+    )
+    for _ in range(STREAMS):
+        status, _, body = call(asgi_app, "GET", "/api/scores/button")
+        assert status == requests.codes.OK
+        lines = body.decode().splitlines()
+        assert len(lines) == STREAMED_ROWS
+        assert json.loads(lines[0])["username"] == f"user{STREAMED_ROWS - 1}"
@@ -0,0 +1,53 @@
+"""Test score_server/connection_manager routines."""
+
+import pytest
+
+from score_server.connection_manager import PRAGMA_PROFILES, ConnectionPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    """Sample pool backed by a temporary database file."""
+    pool = ConnectionPool(tmp_path / "pool.db", "wal", size=2)
+    yield pool
+    pool.close()
+
+
+def test_connection_reused(pool):
+    """Test connections are returned to and reused from the pool."""
+    with pool.connection() as conn:
+        first = conn
+    with pool.connection() as conn:
+        assert conn is first
+
+
+def test_pool_size_bounded(pool):
+    """Test connections returned to a full pool are closed."""
+    conns = [pool.acquire() for _ in range(pool.size + 1)]
+    for conn in conns:
+        pool.release(conn)
+    reused = {id(pool.acquire()) for _ in range(pool.size)}
+    assert reused <= {id(conn) for conn in conns}
+    assert pool._idle.empty()
+
+
+def test_profile_applied(pool):
+    """Test PRAGMA profile settings are applied to new connections."""
+    expected = PRAGMA_PROFILES["wal"]
+    with pool.connection() as conn:
+        [journal_mode] = conn.execute("PRAGMA journal_mode;").fetchone()
+        [busy_timeout] = conn.execute("PRAGMA busy_timeout;").fetchone()
+    assert journal_mode.upper() == expected["journal_mode"]
+    assert busy_timeout == expected["busy_timeout"]
+
+
+def test_rollback_on_error(pool):
+    """Test a failed unit of work is rolled back before release."""
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER);")
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO t VALUES (1);")
+            raise RuntimeError
+    with pool.connection() as conn:
+        assert conn.execute("SELECT * FROM t;").fetchall() == []
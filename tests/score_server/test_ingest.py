@@ -0,0 +1,94 @@
+"""Test score_server/ingest routines."""
+
+import hashlib
+import secrets
+
+import pytest
+import requests
+
+import score_server
+from score_server.auth_manager import HASH_SECRET
+from score_server.connection_manager import ConnectionPool
+from score_server.ingest import WriteBehindQueue
+
+
+@pytest.fixture
+def pool(tmp_path):
+    """Sample pool for a temporary database with the score tables."""
+    pool = ConnectionPool(tmp_path / "ingest.db")
+    with pool.connection() as conn:
+        score_server.init_db(conn)
+    yield pool
+    pool.close()
+
+
+def test_write_behind_coalesces(pool):
+    """Test queued entries are written keeping the best score per user."""
+    write_queue = WriteBehindQueue(pool, group_latency=0.05)
+    entries = [
+        ("BUTTON", "a", 3),
+        ("BUTTON", "a", 8),
+        ("TIMING", "a", 2.5),
+        ("TIMING", "a", 1.5),
+        ("BUTTON", "b", 1),
+    ]
+    for entry in entries:
+        assert write_queue.submit(entry)
+    write_queue.start()
+    write_queue.flush()
+    with pool.connection() as conn:
+        button = conn.execute(
+            "SELECT username, score FROM scores WHERE game = 'BUTTON';"
+        ).fetchall()
+        timing = conn.execute(
+            "SELECT username, score FROM scores WHERE game = 'TIMING';"
+        ).fetchall()
+    assert sorted(button) == [("a", 8), ("b", 1)]
+    assert timing == [("a", 1.5)]
+    write_queue.close()
+
+
+def test_write_behind_keeps_history(pool):
+    """Test every queued entry is kept in the history, not just the best."""
+    write_queue = WriteBehindQueue(pool, group_latency=0.05)
+    entries = [("BUTTON", "a", 3), ("BUTTON", "a", 8), ("BUTTON", "a", 5)]
+    for entry in entries:
+        assert write_queue.submit(entry)
+    write_queue.start()
+    write_queue.flush()
+    with pool.connection() as conn:
+        history = conn.execute(
+            "SELECT game, username, score FROM score_history ORDER BY rowid;"
+        ).fetchall()
+        best = conn.execute("SELECT score FROM score_rollup;").fetchall()
+    assert history == entries
+    assert set(best) == {(8,)}
+    write_queue.close()
+
+
+def test_write_behind_backpressure(pool):
+    """Test a full queue refuses entries and close writes what was queued."""
+    write_queue = WriteBehindQueue(pool, maxsize=1)
+    assert write_queue.submit(("BUTTON", "a", 1))
+    assert not write_queue.submit(("BUTTON", "b", 1))
+    write_queue.start()
+    write_queue.close()
+    with pool.connection() as conn:
+        assert conn.execute("SELECT username FROM scores;").fetchall() == [("a",)]
+
+
+def test_write_behind_submit(tmp_path):
+    """Test the submit endpoint queues scores in write-behind mode."""
+    app = score_server.init_app(tmp_path / "app.db", write_behind=True)
+    with app.test_client() as client:
+        nonce = secrets.token_bytes(32)
+        digest = hashlib.sha256(nonce + HASH_SECRET).digest()
+        client.set_cookie("DIGEST", secrets.base64.b64encode(digest).decode())
+        client.set_cookie("NONCE", secrets.base64.b64encode(nonce).decode())
+        entry = {"game": "timing", "username": "user", "score": "1.5"}
+        response = client.post("/submit", data=entry)
+        assert response.status_code == requests.codes.SEE_OTHER
+    app.config["WRITE_QUEUE"].flush()
+    with app.config["POOL"].connection() as conn:
+        assert conn.execute("SELECT score FROM scores;").fetchall() == [(1.5,)]
+    score_server.close_app(app)
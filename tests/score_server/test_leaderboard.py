@@ -0,0 +1,73 @@
+"""Test score_server/leaderboard routines."""
+
+import threading
+
+import score_server
+from score_server.connection_manager import ConnectionPool
+from score_server.leaderboard import Leaderboard, Leaderboards
+
+RELOAD_TIMEOUT = 5  # seconds
+
+
+def test_leaderboard_ranks_descending():
+    """Test higher scores rank first in a game where higher is better."""
+    board = Leaderboard("BUTTON")
+    board.load([("a", 5, "date"), ("b", 9, "date"), ("c", 5, "date")])
+    assert [board.rank(name) for name in "abc"] == [2, 1, 2]
+    assert board.rank("missing") is None
+
+    board.offer("c", 3)
+    assert board.rank("c") == board.rank("a")  # worse scores don't replace the best
+    board.offer("c", 10)
+    board.offer("d", 1)
+    assert [board.rank(name) for name in "abcd"] == [3, 2, 1, 4]
+    assert len(board) == len("abcd")
+
+
+def test_leaderboard_around_ascending():
+    """Test neighbours in a game where lower is better."""
+    board = Leaderboard("TIMING")
+    for name, score in zip("abcde", [3.0, 1.0, 2.0, 5.0, 4.0]):
+        board.offer(name, score)
+    assert board.around("a", 1) == [(2, "c", 2.0), (3, "a", 3.0), (4, "e", 4.0)]
+    assert board.around("b", 1) == [(1, "b", 1.0), (2, "c", 2.0)]
+    assert board.around("missing", 1) == []
+
+
+def test_leaderboard_offer_during_load():
+    """Test scores offered while rows are read aren't lost when loaded."""
+    board = Leaderboard("BUTTON")
+
+    def rows():
+        yield ("a", 5, "date")
+        board.offer("b", 7)  # written after its row would have been read
+
+    board.load(rows())
+    assert [board.rank(name) for name in "ab"] == [2, 1]
+
+
+def test_leaderboards_reload_in_background(tmp_path, monkeypatch):
+    """Test a stale index is served while one thread reloads it."""
+    pool = ConnectionPool(tmp_path / "ranks.db")
+    with pool.connection() as conn:
+        score_server.init_db(conn)
+    leaderboards = Leaderboards(pool, max_age=0)
+    leaderboards.load()
+    started, release = threading.Event(), threading.Event()
+    loads = []
+
+    def slow_load():
+        loads.append(threading.current_thread())
+        started.set()
+        release.wait(RELOAD_TIMEOUT)
+
+    monkeypatch.setattr(leaderboards, "_load", slow_load)
+    leaderboards.offer("BUTTON", "a", 3)
+    assert leaderboards.board("BUTTON").rank("a") == 1
+    assert started.wait(RELOAD_TIMEOUT)
+    assert leaderboards.board("BUTTON").rank("a") == 1
+    release.set()
+    leaderboards.close()
+    assert len(loads) == 1
+    assert loads[0] is not threading.current_thread()
+    pool.close()
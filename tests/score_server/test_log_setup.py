@@ -0,0 +1,85 @@
+"""Test score_server/log_setup routines."""
+
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from queued_logging import restart_logging
+from score_server import log_setup
+
+PACKAGE_ROOT = Path(__file__).parents[2]
+
+
+@pytest.fixture
+def restore_logging():
+    """Put back the root logger's handlers and level after a test."""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    log_setup.stop_logging()
+    root.handlers = handlers
+    root.setLevel(level)
+
+
+@pytest.mark.usefixtures("restore_logging")
+def test_json_logging():
+    """Test records are written as JSON by the listener at or above the level."""
+    stream = io.StringIO()
+    log_setup.configure_logging(logging.INFO, "json", stream)
+    scores = ["a", "b"]
+    logging.getLogger("test").info("scores: %s", scores)
+    scores.append("c")
+    logging.getLogger("test").debug("hidden %s", scores)
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        logging.getLogger("test").exception("failed")
+    log_setup.stop_logging()
+
+    first, second = (json.loads(line) for line in stream.getvalue().splitlines())
+    assert first["message"] == "scores: ['a', 'b']"
+    assert first["level"] == "INFO"
+    assert first["logger"] == "test"
+    assert second["message"] == "failed"
+    assert "ValueError: bad" in second["exc_info"]
+
+
+@pytest.mark.usefixtures("restore_logging")
+def test_text_logging():
+    """Test records are written as text like basicConfig's default."""
+    stream = io.StringIO()
+    log_setup.configure_logging(logging.DEBUG, "text", stream)
+    logging.getLogger("test").debug("hello %s", "there")
+    log_setup.stop_logging()
+    assert stream.getvalue() == "DEBUG:test:hello there\n"
+
+
+@pytest.mark.usefixtures("restore_logging")
+def test_restart_logging():
+    """Test logging started over, as in forked workers, keeps its settings."""
+    stream = io.StringIO()
+    log_setup.configure_logging(logging.INFO, "text", stream)
+    restart_logging()
+    logging.getLogger("test").debug("hidden")
+    logging.getLogger("test").info("restarted")
+    log_setup.stop_logging()
+    assert stream.getvalue() == "INFO:test:restarted\n"
+
+
+def test_server_leaves_out_game_dependencies():
+    """Test the server's logging doesn't import the game client's dependencies."""
+    env = dict(os.environ, PYTHONPATH=str(PACKAGE_ROOT))
+    code = (
+        "import sys, score_server.wsgi; "
+        "print(*(name in sys.modules for name in ('pygame', 'numpy')))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, text=True
+    )
+    assert result.stdout.split() == ["False", "False"]
@@ -0,0 +1,70 @@
+"""Test score_server/metrics routines."""
+
+import threading
+
+import requests
+
+from score_server import metrics
+
+BUCKETS = (0.1, 1.0)
+THREADS = 4
+SHORT_LIVED_THREADS = 200
+
+
+def test_registry_sums_threads():
+    """Test counts recorded on several threads are summed when collected."""
+    registry = metrics.Registry(BUCKETS)
+
+    def record():
+        registry.inc("requests_total", (("endpoint", "x"),))
+        registry.observe("request_seconds", (("endpoint", "x"),), 0.5)
+
+    threads = [threading.Thread(target=record) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    text = registry.render({"token_store_size": 3})
+    assert f'score_server_requests_total{{endpoint="x"}} {THREADS}' in text
+    assert 'score_server_request_seconds_bucket{endpoint="x",le="0.1"} 0' in text
+    bucket = 'score_server_request_seconds_bucket{endpoint="x",le="1.0"}'
+    assert f"{bucket} {THREADS}" in text
+    assert f'score_server_request_seconds_count{{endpoint="x"}} {THREADS}' in text
+    assert "score_server_token_store_size 3" in text
+
+
+def test_registry_retires_finished_threads():
+    """Test threads that end leave their counts but not their shards."""
+    registry = metrics.Registry(BUCKETS)
+
+    def record():
+        registry.inc("requests_total", (("endpoint", "x"),))
+
+    for _ in range(SHORT_LIVED_THREADS):
+        thread = threading.Thread(target=record)
+        thread.start()
+        thread.join()
+    registry.inc("requests_total", (("endpoint", "x"),))
+    assert len(registry._shards) <= THREADS
+    counters, _ = registry.collect()
+    assert counters[("requests_total", (("endpoint", "x"),))] == SHORT_LIVED_THREADS + 1
+
+
+def test_format_labels_escapes():
+    """Test label values are escaped."""
+    assert metrics.format_labels([("a", 'say "hi"\\')]) == '{a="say \\"hi\\"\\\\"}'
+
+
+def test_show_metrics(client):
+    """Test the metrics endpoint reports requests, storage calls and auth."""
+    client.get("/scores")
+    client.set_cookie("_CR", "unknown")
+    client.post("/submit", data={"game": "button", "username": "u", "score": "1"})
+    response = client.get("/metrics")
+    assert response.status_code == requests.codes.OK
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert 'endpoint="scoreboard.show_scores",status="200"' in text
+    assert 'score_server_storage_seconds_count{site="top_scores"}' in text
+    assert 'method="challenge_response",outcome="failed"' in text
+    assert "# TYPE score_server_token_store_size gauge" in text
@@ -0,0 +1,71 @@
+"""Test score_server/prefork routines."""
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import requests
+
+PACKAGE_ROOT = Path(__file__).parents[2]
+STARTUP_TIMEOUT = 10  # seconds
+
+
+def free_port():
+    """Return a port that is currently free on localhost."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Start a pre-forking server in a subprocess and return its address."""
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=str(PACKAGE_ROOT))
+    command = [
+        sys.executable,
+        "-m",
+        "score_server.wsgi",
+        "--port",
+        str(port),
+        "--workers",
+        "2",
+        "--threads",
+        "2",
+        "--db-profile",
+        "wal",
+        "--graceful-timeout",
+        "5",
+    ]
+    process = subprocess.Popen(command, cwd=tmp_path, env=env)
+    location = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            requests.get(location + "/scores", timeout=1)
+            break
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    yield process, location
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+def test_prefork_serves_reloads_and_stops(server):
+    """Test workers serve requests across a reload and stop gracefully."""
+    process, location = server
+    for _ in range(10):
+        assert requests.get(location + "/scores").status_code == requests.codes.OK
+
+    process.send_signal(signal.SIGHUP)
+    for _ in range(10):
+        assert requests.get(location + "/scores").status_code == requests.codes.OK
+
+    process.send_signal(signal.SIGTERM)
+    assert process.wait(timeout=STARTUP_TIMEOUT) == 0
@@ -1,12 +1,19 @@
 """Test score_server/routes routines."""
 
+import csv
+import gzip
 import hashlib
+import io
+import json
+import pstats
 import secrets
+import sqlite3
 
 import pytest
 import requests
 from bs4 import BeautifulSoup
 
+from score_server import score_manager
 from score_server.auth_manager import HASH_SECRET
 
 
@@ -49,6 +56,140 @@ def test_do_auth(client):
     assert client.get_cookie("_SC") is None
 
 
+def test_show_scores_pages(client):
+    """Test show_scores pages through one game's scores best first."""
+    with client.application.config["POOL"].connection() as conn:
+        conn.executemany(
+            "INSERT INTO scores VALUES ('TIMING', ?, ?, ?, datetime());",
+            [(f"user{i}", float(i % 4), float(i % 4)) for i in range(10)],
+        )
+    page_size = 4
+    seen = []
+    url = f"/scores?game=timing&limit={page_size}"
+    while url:
+        response = client.get(url)
+        assert response.status_code == requests.codes.OK
+        soup = BeautifulSoup(response.data, "html.parser")
+        [table] = soup.find_all("table")
+        rows = [
+            (row.find_all("td")[1].string, row.find_all("td")[0].string)
+            for row in table.find_all("tr")[1:]
+        ]
+        assert len(rows) <= page_size
+        seen.extend(rows)
+        link = soup.find("a", string=lambda text: text.startswith("More"))
+        url = link.get("href") if link else None
+    expected = sorted((str(float(i % 4)), f"user{i}") for i in range(10))
+    assert seen == expected
+
+    response = client.get("/scores?game=timing&after=nonsense")
+    assert response.status_code == requests.codes.BAD_REQUEST
+    response = client.get("/scores?game=FAKE")
+    assert response.status_code == requests.codes.NOT_FOUND
+
+
+def test_show_scores_windows(client):
+    """Test show_scores windows only count scores from the current period."""
+    with client.application.config["POOL"].connection() as conn:
+        conn.execute(
+            "INSERT INTO score_rollup VALUES ('TIMING', 'day', "
+            "date('now', '-1 day'), 'yesterday', 0.5, 0.5, datetime());"
+        )
+        conn.execute(
+            "INSERT INTO scores VALUES "
+            "('TIMING', 'yesterday', 0.5, 0.5, datetime('now', '-1 day'));"
+        )
+    client.application.config["PAGE_CACHE"].clear()
+    nonce = secrets.token_bytes(32)
+    digest = hashlib.sha256(nonce + HASH_SECRET).digest()
+    client.set_cookie("DIGEST", secrets.base64.b64encode(digest).decode())
+    client.set_cookie("NONCE", secrets.base64.b64encode(nonce).decode())
+    entry = {"game": "timing", "username": "today", "score": "5.0"}
+    assert client.post("/submit", data=entry).status_code == requests.codes.SEE_OTHER
+
+    for window, expected in [
+        ("day", ["today"]),
+        ("week", ["today"]),
+        ("all", ["yesterday", "today"]),
+    ]:
+        response = client.get(f"/scores?game=timing&window={window}")
+        soup = BeautifulSoup(response.data, "html.parser")
+        [table] = soup.find_all("table")
+        usernames = [row.find("td").string for row in table.find_all("tr")[1:]]
+        assert usernames == expected
+
+    response = client.get("/scores?window=month")
+    assert response.status_code == requests.codes.BAD_REQUEST
+
+
+def test_show_scores_cached(client):
+    """Test show_scores revalidation, compression and invalidation."""
+    response = client.get("/scores")
+    etag = response.headers["ETag"]
+    response = client.get("/scores", headers={"If-None-Match": etag})
+    assert response.status_code == requests.codes.NOT_MODIFIED
+
+    response = client.get("/scores", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] != etag
+    assert gzip.decompress(response.data).startswith(b"<!DOCTYPE html>")
+
+    nonce = secrets.token_bytes(32)
+    digest = hashlib.sha256(nonce + HASH_SECRET).digest()
+    client.set_cookie("DIGEST", secrets.base64.b64encode(digest).decode())
+    client.set_cookie("NONCE", secrets.base64.b64encode(nonce).decode())
+    entry = {"game": "timing", "username": "user", "score": "1.5"}
+    client.post("/submit", data=entry)
+    response = client.get("/scores", headers={"If-None-Match": etag})
+    assert response.status_code == requests.codes.OK
+    assert b"user" in response.data
+
+
+class TestExportScores:
+    """Test score export endpoint."""
+
+    @pytest.fixture(autouse=True)
+    def scores(self, client):
+        with client.application.config["POOL"].connection() as conn:
+            conn.executemany(
+                "INSERT INTO scores "
+                "VALUES ('BUTTON', ?, ?, -?2, '2024-01-12 12:46:45');",
+                [("b", 3), ("a", 1), ("c", 2)],
+            )
+
+    def test_ndjson(self, client):
+        """Test NDJSON export ordered best first."""
+        response = client.get("/api/scores/button")
+        assert response.status_code == requests.codes.OK
+        assert response.mimetype == "application/x-ndjson"
+        entries = [json.loads(line) for line in response.text.splitlines()]
+        assert [entry["username"] for entry in entries] == ["b", "c", "a"]
+        assert entries[0] == {
+            "game": "BUTTON",
+            "username": "b",
+            "score": 3,
+            "date": "2024-01-12 12:46:45",
+        }
+
+    def test_csv(self, client):
+        """Test CSV export ordered by username with a limit."""
+        response = client.get("/api/scores/button?format=csv&order=username&limit=2")
+        assert response.status_code == requests.codes.OK
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [row["username"] for row in rows] == ["a", "b"]
+
+    def test_bad_request(self, client):
+        """Test unknown games and options are refused."""
+        response = client.get("/api/scores/FAKE")
+        assert response.status_code == requests.codes.NOT_FOUND
+        response = client.get("/api/scores/button?format=xml")
+        assert response.status_code == requests.codes.BAD_REQUEST
+        response = client.get("/api/scores/button?order=date")
+        assert response.status_code == requests.codes.BAD_REQUEST
+        response = client.get("/api/scores/button?limit=-1")
+        assert response.status_code == requests.codes.BAD_REQUEST
+
+
 def test_sub_ok(client):
     """Test sub_ok endpoint."""
     response = client.get("/submissionOK")
@@ -75,6 +216,14 @@ class TestSubmit:
     def assert_submit_failure(self, response):
         assert response.status_code == requests.codes.OK
 
+    def test_get_while_locked(self, client):
+        """Test the form is served while another writer holds the lock."""
+        with sqlite3.connect(client.application.config["DB"]) as writer:
+            writer.execute("BEGIN IMMEDIATE;")
+            response = client.get("/submit")
+            writer.rollback()
+        assert response.status_code == requests.codes.OK
+
     def test_get(self, client):
         """Test get to submit endpoint."""
         response = client.get("/submit")
@@ -120,6 +269,21 @@ class TestSubmit:
         response = client.post("/submit", data=fail_entry, follow_redirects=False)
         self.assert_submit_failure(response)
 
+    def test_failed_write_keeps_token(self, client, score_data):
+        """Test a failed score write doesn't use up the auth token."""
+        button_entry, timing_entry, fail_entry = score_data
+
+        client.get("/auth")
+        sc = client.get_cookie("_SC").value.encode()
+        cr = secrets.base64.b64encode(hashlib.sha256(sc + HASH_SECRET).digest())
+        client.set_cookie("_CR", cr.decode())
+        bad_score_entry = dict(button_entry, score="many")
+        response = client.post("/submit", data=bad_score_entry, follow_redirects=False)
+        self.assert_submit_failure(response)
+
+        response = client.post("/submit", data=button_entry, follow_redirects=False)
+        self.assert_submit_success(response)
+
     def test_timing_submit(self, client, score_data):
         """Test POST of timing game scores."""
         button_entry, timing_entry, fail_entry = score_data
@@ -148,3 +312,123 @@ class TestSubmit:
         digest = hashlib.sha256(nonce + HASH_SECRET).digest()
         response = client.post("/submit", data=fail_entry, follow_redirects=False)
         self.assert_submit_failure(response)
+
+
+@pytest.fixture
+def batch_data():
+    """Sample batch submission data for use by a client."""
+    return [
+        {"game": "button", "username": "a", "score": "10"},
+        ["button", "b", 12],
+        {"game": "button", "username": "a", "score": "7"},
+        {"game": "timing", "username": "a", "score": "1.5"},
+        {"game": "FAKE", "username": "a", "score": "6"},
+    ]
+
+
+class TestSubmitBatch:
+    """Test batch submit endpoint."""
+
+    def auth_button(self, client):
+        client.get("/auth")
+        sc = client.get_cookie("_SC").value.encode()
+        cr = secrets.base64.b64encode(hashlib.sha256(sc + HASH_SECRET).digest())
+        client.set_cookie("_CR", cr.decode())
+
+    def statuses(self, response):
+        return [result["status"] for result in response.get_json()["results"]]
+
+    def test_json_batch(self, client, batch_data):
+        """Test a JSON array batch authenticated for one game."""
+        self.auth_button(client)
+        response = client.post("/submit/batch", json=batch_data)
+        assert response.status_code == requests.codes.OK
+        assert self.statuses(response) == 3 * ["accepted"] + 2 * ["rejected"]
+
+        response = client.get("/scores")
+        soup = BeautifulSoup(response.data, "html.parser")
+        button_table, timing_table = soup.find_all("table")
+        button_rows = [
+            [cell.string for cell in row.find_all("td")[:2]]
+            for row in button_table.find_all("tr")[1:]
+        ]
+        assert sorted(button_rows) == [["a", "10"], ["b", "12"]]
+        assert len(timing_table.find_all("tr")) == 1
+
+    def test_rank_after_batch(self, client, batch_data):
+        """Test ranks reflect scores as they are written."""
+        self.auth_button(client)
+        client.post("/submit/batch", json=batch_data)
+        response = client.get("/rank/button/a?around=1")
+        assert response.status_code == requests.codes.OK
+        assert response.get_json() == {
+            "game": "BUTTON",
+            "username": "a",
+            "score": 10,
+            "rank": 2,
+            "of": 2,
+            "around": [
+                {"rank": 1, "username": "b", "score": 12},
+                {"rank": 2, "username": "a", "score": 10},
+            ],
+        }
+        response = client.get("/rank/timing/a")
+        assert response.status_code == requests.codes.NOT_FOUND
+
+    def test_ndjson_batch(self, client, batch_data):
+        """Test a newline-delimited JSON batch."""
+        self.auth_button(client)
+        body = "\n".join(json.dumps(entry) for entry in batch_data[:2])
+        response = client.post(
+            "/submit/batch", data=body, content_type="application/x-ndjson"
+        )
+        assert response.status_code == requests.codes.OK
+        assert self.statuses(response) == ["accepted", "accepted"]
+
+    def test_unauthenticated_batch(self, client, batch_data):
+        """Test every entry is rejected without authentication."""
+        generation = score_manager.write_generation()
+        response = client.post("/submit/batch", json=batch_data)
+        assert response.status_code == requests.codes.OK
+        assert set(self.statuses(response)) == {"rejected"}
+        # nothing written, so cached pages stay valid
+        assert score_manager.write_generation() == generation
+
+    def test_bad_batch(self, client):
+        """Test unreadable batches are refused."""
+        response = client.post(
+            "/submit/batch", data="{", content_type="application/json"
+        )
+        assert response.status_code == requests.codes.BAD_REQUEST
+        response = client.post("/submit/batch", json={"game": "button"})
+        assert response.status_code == requests.codes.BAD_REQUEST
+
+
+def test_admin_profile(client, tmp_path):
+    """Test profiling is toggled and dumped only with the admin token."""
+    assert client.get("/admin/profile").status_code == requests.codes.NOT_FOUND
+    client.application.config["ADMIN_TOKEN"] = "secret"
+    profiler = client.application.config["PROFILER"]
+    profiler.directory = tmp_path
+    headers = {"X-Admin-Token": "wrong"}
+    response = client.post("/admin/profile", data={"action": "start"}, headers=headers)
+    assert response.status_code == requests.codes.NOT_FOUND
+    assert not profiler.enabled
+
+    headers = {"X-Admin-Token": "secret"}
+    response = client.post("/admin/profile", data={"action": "start"}, headers=headers)
+    assert response.json["enabled"]
+    client.get("/scores")
+    client.post("/admin/profile", data={"action": "stop"}, headers=headers)
+    client.get("/index")
+    response = client.post("/admin/profile", data={"action": "dump"}, headers=headers)
+    assert "scoreboard.show_scores" in response.json["endpoints"]
+    assert "scoreboard.index" not in response.json["endpoints"]
+    [dumped] = [path for path in response.json["dumped"] if "show_scores" in path]
+    stats = pstats.Stats(dumped)
+    assert any(name == "render_scores" for _, _, name in stats.stats)
+
+    response = client.post("/admin/profile", data={"action": "fly"}, headers=headers)
+    assert response.status_code == requests.codes.BAD_REQUEST
+    client.post("/admin/profile", data={"action": "reset"}, headers=headers)
+    assert profiler.endpoints() == []
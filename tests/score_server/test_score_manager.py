@@ -0,0 +1,128 @@
+"""Test score_server/score_manager routines."""
+
+import pytest
+
+from score_server import score_manager
+
+
+@pytest.mark.parametrize(
+    "game, scores, best",
+    [
+        ("button", ["10", "25", "5"], 25),
+        ("timing", ["15.5", "12.25", "20.0"], 12.25),
+    ],
+)
+def test_insert_or_update_score(db, game, scores, best):
+    """Test insert_or_update_score keeps the best score and refreshes date."""
+    cursor = db.cursor()
+    improvements = []
+    for score in scores:
+        entry = {"game": game, "username": "user", "score": score}
+        improvements.append(score_manager.insert_or_update_score(db, entry))
+        cursor.execute("UPDATE scores SET date = '2000-01-01 00:00:00';")
+    assert improvements == [True, True, False]
+
+    entry = {"game": game, "username": "user", "score": scores[-1]}
+    score_manager.insert_or_update_score(db, entry)
+    [(username, score, date)] = cursor.execute(
+        "SELECT username, score, date FROM scores WHERE game = ?;", (game.upper(),)
+    ).fetchall()
+    assert username == "user"
+    assert score == best
+    assert date != "2000-01-01 00:00:00"
+
+
+def test_insert_or_update_score_bad_game(db):
+    """Test insert_or_update_score rejects unknown games."""
+    entry = {"game": "FAKE", "username": "user", "score": "6"}
+    with pytest.raises(ValueError):
+        score_manager.insert_or_update_score(db, entry)
+
+
+@pytest.mark.parametrize(
+    "entry",
+    [
+        {"game": "button", "username": "user"},
+        {"game": "button", "username": "", "score": "1"},
+        {"game": "button", "username": "user", "score": "fast"},
+        ["timing", "user"],
+        "button,user,1",
+    ],
+)
+def test_parse_score_entry_invalid(entry):
+    """Test parse_score_entry rejects malformed entries."""
+    with pytest.raises(ValueError):
+        score_manager.parse_score_entry(entry)
+
+
+def test_insert_or_update_scores(db):
+    """Test insert_or_update_scores applies keep-best rules across a batch."""
+    entries = [
+        ("BUTTON", "a", 3),
+        ("BUTTON", "a", 9),
+        ("BUTTON", "a", 4),
+        ("TIMING", "a", 2.5),
+        ("TIMING", "b", 1.5),
+        ("TIMING", "a", 3.5),
+    ]
+    score_manager.insert_or_update_scores(db, entries)
+    cursor = db.cursor()
+    select = "SELECT username, score FROM scores WHERE game = ? ORDER BY username;"
+    button = cursor.execute(select, ("BUTTON",)).fetchall()
+    timing = cursor.execute(select, ("TIMING",)).fetchall()
+    assert button == [("a", 9)]
+    assert timing == [("a", 2.5), ("b", 1.5)]
+
+
+def test_writes_leave_generation_to_caller(db):
+    """Test uncommitted writes don't mark cached pages stale."""
+    generation = score_manager.write_generation()
+    score_manager.insert_or_update_score(
+        db, {"game": "button", "username": "a", "score": "1"}
+    )
+    score_manager.insert_or_update_scores(db, [("TIMING", "a", 1.5)])
+    assert score_manager.write_generation() == generation
+
+
+def test_top_scores(db):
+    """Test top_scores pages best first with ties broken by username."""
+    entries = [("BUTTON", name, score) for name, score in zip("abcde", [5, 9, 5, 1, 9])]
+    score_manager.insert_or_update_scores(db, entries)
+    first = score_manager.top_scores(db, "BUTTON", 3)
+    assert [row[:2] for row in first] == [("b", 9), ("e", 9), ("a", 5)]
+    username, score = first[-1][:2]
+    rest = score_manager.top_scores(db, "BUTTON", 3, (score, username))
+    assert [row[:2] for row in rest] == [("c", 5), ("d", 1)]
+
+
+def test_top_scores_window(db):
+    """Test windowed top_scores read the best scores of the current period."""
+    entries = [("TIMING", "a", 4.5), ("TIMING", "b", 3.0), ("TIMING", "a", 2.0)]
+    score_manager.insert_or_update_scores(db, entries)
+    db.execute("UPDATE score_rollup SET period = '2000-01-01' WHERE username = 'b';")
+    score_manager.insert_or_update_scores(db, [("TIMING", "a", 6.0)])
+    history = db.execute("SELECT count(*) FROM score_history;").fetchone()[0]
+    assert history == len(entries) + 1
+    for window in score_manager.WINDOWS:
+        rows = score_manager.top_scores(db, "TIMING", 10, window=window)
+        assert [row[:2] for row in rows] == [("a", 2.0)]
+    rows = score_manager.top_scores(db, "TIMING", 10)
+    assert [row[:2] for row in rows] == [("a", 2.0), ("b", 3.0)]
+
+
+def test_import_scores(db):
+    """Test import_scores keeps the best score and latest date."""
+    entries = [
+        {"game": "button", "username": "a", "score": "4", "date": "2024-01-02"},
+        {"game": "button", "username": "a", "score": "6", "date": "2024-01-01"},
+        {"game": "timing", "username": "a", "score": "1.5"},
+    ]
+    score_manager.import_scores(db, map(score_manager.parse_import_entry, entries))
+    button = db.execute(
+        "SELECT username, score, date FROM scores WHERE game = 'BUTTON';"
+    ).fetchall()
+    assert button == [("a", 6, "2024-01-02")]
+    [(date,)] = db.execute("SELECT date FROM scores WHERE game = 'TIMING';").fetchall()
+    assert date is not None
+    with pytest.raises(ValueError):
+        score_manager.parse_import_entry(["button", "a", "1"])
@@ -1,6 +1,15 @@
 """Test score_server routines."""
 
+import sqlite3
+import threading
+
+import pytest
+
 import score_server
+from score_server import score_manager, wsgi
+from score_server.connection_manager import shard_paths
+
+RANK_MAX_AGE = 30
 
 
 def test_clear_db(db, db_entries):
@@ -24,3 +33,151 @@ def test_clear_db(db, db_entries):
         for table in db_entries.keys()
     ]
     assert all(entry == [] for entry in entries_by_table)
+
+
+def test_init_db_migrates_game_tables(db):
+    """Test scores in per-game tables of older databases are moved over."""
+    db.executescript(
+        """
+        CREATE TABLE button (username TEXT UNIQUE, score INTEGER, date DATETIME);
+        CREATE TABLE timing (username TEXT UNIQUE, score FLOAT, date DATETIME);
+        CREATE TABLE timing_history (username TEXT, score, date DATETIME);
+        CREATE TABLE timing_rollup (
+            span TEXT, period DATE, username TEXT, score, date DATETIME
+        );
+        INSERT INTO button VALUES ('a', 5, '2024-01-01'), ('b', 7, '2024-01-02');
+        INSERT INTO timing VALUES ('a', 2.5, '2024-01-03');
+        INSERT INTO timing_history VALUES ('a', 2.5, '2024-01-03');
+        INSERT INTO timing_rollup VALUES ('day', date('now'), 'a', 2.5, datetime());
+        """
+    )
+    score_server.init_db(db)
+    assert score_manager.top_scores(db, "BUTTON", 10) == [
+        ("b", 7, "2024-01-02"),
+        ("a", 5, "2024-01-01"),
+    ]
+    rows = score_manager.top_scores(db, "TIMING", 10, window="day")
+    assert [row[:2] for row in rows] == [("a", 2.5)]
+    assert db.execute("SELECT count(*) FROM score_history;").fetchone() == (1,)
+    tables = db.execute("SELECT name FROM sqlite_master WHERE type = 'table';")
+    expected = {"tokens", "used_challenges", *score_manager.SCORE_TABLES}
+    assert {name for (name,) in tables} == expected
+
+
+def test_sharded_app(tmp_path, monkeypatch):
+    """Test each game's scores are kept in a shard of their own and can be cleared."""
+    monkeypatch.chdir(tmp_path)
+    app = score_server.init_app(wsgi.DATABASE, sharded=True)
+    with app.config["POOL"].connection() as conn:
+        score_manager.insert_or_update_scores(
+            conn, [("BUTTON", "user", 10), ("TIMING", "user", 1.5)]
+        )
+        assert score_manager.top_scores(conn, "TIMING", 10)[0][:2] == ("user", 1.5)
+    score_server.close_app(app)
+
+    shards = shard_paths(wsgi.DATABASE)
+    for schema, score in [("button", 10), ("timing", 1.5)]:
+        with sqlite3.connect(shards[schema]) as shard:
+            scores = shard.execute("SELECT game, score FROM scores;").fetchall()
+            assert scores == [(schema.upper(), score)]
+    with sqlite3.connect(wsgi.DATABASE) as main:
+        tables = main.execute("SELECT name FROM sqlite_master;").fetchall()
+        assert ("scores",) not in tables
+
+    wsgi.clear_database()
+    for path in shards.values():
+        with sqlite3.connect(path) as shard:
+            assert shard.execute("SELECT * FROM scores;").fetchall() == []
+
+
+def test_sharded_app_moves_game_shard_tables(tmp_path):
+    """Test scores in the per-game tables of older shards are kept."""
+    database = tmp_path / "scores.db"
+    shards = shard_paths(database)
+    with sqlite3.connect(shards["button"]) as shard:
+        shard.execute("CREATE TABLE button (username TEXT UNIQUE, score, date);")
+        shard.execute("INSERT INTO button VALUES ('a', 4, '2024-01-01 00:00:00');")
+    app = score_server.init_app(database, sharded=True)
+    store = app.config["SCORE_STORE"]
+    assert [row[:2] for row in store.top("BUTTON", 10)] == [("a", 4)]
+    score_server.close_app(app)
+    with sqlite3.connect(shards["button"]) as shard:
+        tables = shard.execute("SELECT name FROM sqlite_master;").fetchall()
+        assert ("button",) not in tables
+
+
+def test_create_database(tmp_path, monkeypatch):
+    """Test the database and its shards are created without starting an app."""
+    monkeypatch.chdir(tmp_path)
+    threads = threading.active_count()
+    wsgi.create_database(sharded=True)
+    assert threading.active_count() == threads
+    for path in shard_paths(wsgi.DATABASE).values():
+        with sqlite3.connect(path) as shard:
+            assert shard.execute("SELECT count(*) FROM scores;").fetchone() == (0,)
+
+
+def test_sharded_app_refuses_unsharded_db(tmp_path):
+    """Test sharding isn't enabled over a database with score tables in it."""
+    database = tmp_path / "scores.db"
+    score_server.close_app(score_server.init_app(database))
+    with pytest.raises(ValueError):
+        score_server.init_app(database, sharded=True)
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".jsonl"])
+def test_export_import_database(tmp_path, monkeypatch, suffix):
+    """Test scores survive an export and merge with keep-best on import."""
+    monkeypatch.chdir(tmp_path)
+    app = score_server.init_app(wsgi.DATABASE)
+    with app.config["POOL"].connection() as conn:
+        conn.executemany(
+            "INSERT INTO scores VALUES (?, ?, ?, ?, ?);",
+            [
+                ("BUTTON", "a", 5, -5, "2024-01-01 00:00:00"),
+                ("BUTTON", "b", 7, -7, "2024-02-01 00:00:00"),
+                ("TIMING", "a", 2.5, 2.5, "2024-03-01 00:00:00"),
+            ],
+        )
+    score_server.close_app(app)
+    dump = str(tmp_path / f"dump{suffix}")
+    monkeypatch.setattr("sys.argv", ["basic-games-export", "--output", dump])
+    wsgi.export_database()
+
+    with sqlite3.connect(wsgi.DATABASE) as conn:
+        conn.execute(
+            "UPDATE scores SET score = 9, rank_key = -9, date = '2023-01-01' "
+            "WHERE game = 'BUTTON' AND username = 'a';"
+        )
+        conn.execute("DELETE FROM scores WHERE game = 'BUTTON' AND username = 'b';")
+        conn.execute(
+            "UPDATE scores SET score = 3.5, rank_key = 3.5 WHERE game = 'TIMING';"
+        )
+    monkeypatch.setattr("sys.argv", ["basic-games-import", "--batch-size", "1", dump])
+    wsgi.import_database()
+
+    with sqlite3.connect(wsgi.DATABASE) as conn:
+        select = "SELECT username, score, date FROM scores WHERE game = ? "
+        button = conn.execute(select + "ORDER BY username;", ("BUTTON",)).fetchall()
+        timing = conn.execute(select, ("TIMING",)).fetchall()
+    assert button == [("a", 9, "2024-01-01 00:00:00"), ("b", 7, "2024-02-01 00:00:00")]
+    assert timing == [("a", 2.5, "2024-03-01 00:00:00")]
+
+
+@pytest.mark.parametrize("store", ["--token-store", "--score-store"])
+def test_prefork_refuses_memory_stores(store):
+    """Test in-memory stores, which workers can't share, are refused."""
+    args = wsgi.PARSER.parse_args(["--workers", "2", store, "memory"])
+    with pytest.raises(SystemExit):
+        wsgi.serve_prefork(None, args)
+
+
+def test_rank_max_age_defaults_with_workers():
+    """Test several workers reload their rank indexes unless told otherwise."""
+    args = wsgi.PARSER.parse_args(["--workers", "2"])
+    assert wsgi.rank_max_age(args) == wsgi.WORKER_RANK_MAX_AGE
+    args = wsgi.PARSER.parse_args(
+        ["--workers", "2", "--rank-max-age", str(RANK_MAX_AGE)]
+    )
+    assert wsgi.rank_max_age(args) == RANK_MAX_AGE
+    assert wsgi.rank_max_age(wsgi.PARSER.parse_args([])) is None
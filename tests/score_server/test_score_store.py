@@ -0,0 +1,130 @@
+"""Test score_server/score_store routines."""
+
+import sqlite3
+import threading
+
+import pytest
+import requests
+
+import score_server
+from score_server import auth_manager, score_store
+from score_server.score_store import MemoryScoreStore
+
+STRIPES = 4
+THREADS = 4
+WRITES_PER_THREAD = 250
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def store_app(request, tmp_path):
+    """App with each kind of score store."""
+    app = score_server.init_app(str(tmp_path / "scores.db"), score_store=request.param)
+    yield app
+    score_server.close_app(app)
+
+
+def test_upsert_keeps_best(store_app):
+    """Test both stores keep the best score and report improvements."""
+    store = store_app.config["SCORE_STORE"]
+    entry = {"game": "button", "username": "a", "score": "4"}
+    assert store.upsert(entry)
+    assert not store.upsert({**entry, "score": "2"})
+    store.upsert_many([("TIMING", "a", 2.5), ("TIMING", "a", 1.5)])
+    assert [row[:2] for row in store.top("BUTTON", 10)] == [("a", 4)]
+    assert [row[:2] for row in store.top("TIMING", 10)] == [("a", 1.5)]
+    with pytest.raises(ValueError):
+        store.upsert({**entry, "game": "chess"})
+
+
+def test_top_pages(store_app):
+    """Test both stores page best first with ties broken by username."""
+    store = store_app.config["SCORE_STORE"]
+    store.upsert_many(
+        [("BUTTON", name, score) for name, score in zip("abcde", [5, 9, 5, 1, 9])]
+    )
+    first = store.top("BUTTON", 3)
+    assert [row[:2] for row in first] == [("b", 9), ("e", 9), ("a", 5)]
+    username, score = first[-1][:2]
+    rest = store.top("BUTTON", 3, (score, username))
+    assert [row[:2] for row in rest] == [("c", 5), ("d", 1)]
+    for window in ("day", "week"):
+        rows = store.top("BUTTON", 1, window=window)
+        assert [row[:2] for row in rows] == [("b", 9)]
+
+
+def test_rank_and_iterate(store_app):
+    """Test both stores rank usernames and iterate in either order."""
+    store = store_app.config["SCORE_STORE"]
+    store.upsert_many(
+        [("TIMING", name, score) for name, score in zip("abcd", [3.0, 1.0, 3.0, 2.0])]
+    )
+    assert store.around("TIMING", "c", 1) == [(3, "a", 3.0), (3, "c", 3.0)]
+    assert store.around("TIMING", "z", 1) == []
+    assert store.count("TIMING") == len("abcd")
+    best = [row[0] for row in store.iterate("TIMING")]
+    assert best == ["b", "d", "a", "c"]
+    by_name = [row[0] for row in store.iterate("TIMING", "username", 2)]
+    assert by_name == ["a", "b"]
+    store.clear()
+    assert store.count("TIMING") == 0
+
+
+def test_sqlite_iterate_pages(tmp_path, monkeypatch):
+    """Test exports read in pages leave the database free for writers."""
+    monkeypatch.setattr(score_store, "EXPORT_PAGE_SIZE", 2)
+    database = str(tmp_path / "scores.db")
+    app = score_server.init_app(database)
+    store = app.config["SCORE_STORE"]
+    store.upsert_many([("BUTTON", name, ord(name)) for name in "abcde"])
+    assert [row[0] for row in store.iterate("BUTTON", limit=3)] == ["e", "d", "c"]
+    assert [row[0] for row in store.iterate("BUTTON", "username")] == list("abcde")
+
+    rows = store.iterate("BUTTON")
+    assert next(rows)[0] == "e"
+    with sqlite3.connect(database, timeout=0) as writer:
+        writer.execute("DELETE FROM scores WHERE username = 'a';")
+    assert [row[0] for row in rows] == ["d", "c", "b"]
+    score_server.close_app(app)
+
+
+def test_memory_store_concurrent_writes():
+    """Test writes from many threads across stripes all land."""
+    store = MemoryScoreStore(STRIPES)
+
+    def write(thread):
+        store.upsert_many(
+            ("BUTTON", f"user{i}", thread) for i in range(WRITES_PER_THREAD)
+        )
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.count("BUTTON") == WRITES_PER_THREAD
+    assert {score for _, score, _ in store.iterate("BUTTON")} == {THREADS - 1}
+
+
+def test_memory_store_app(tmp_path):
+    """Test submitting and reading scores with the memory score store."""
+    app = score_server.init_app(
+        str(tmp_path / "scores.db"), score_store="memory", token_store="memory"
+    )
+    client = app.test_client()
+    client.environ_base["HTTP_USER_AGENT"] = "basic-games"
+    client.get("/auth")
+    sc = client.get_cookie("_SC").value
+    client.set_cookie("_CR", auth_manager.expected_response(sc))
+    form = {"game": "button", "username": "a", "score": 3}
+    response = client.post("/submit", data=form)
+    assert response.status_code == requests.codes.SEE_OTHER
+    assert client.get("/rank/button/a").json["rank"] == 1
+    body = client.get("/api/scores/button").get_data(as_text=True)
+    assert '"username": "a"' in body
+    with app.config["POOL"].connection() as conn:
+        assert conn.execute("SELECT count(*) FROM scores;").fetchone()[0] == 0
+    score_server.close_app(app)
+    with pytest.raises(ValueError):
+        score_server.init_app(
+            str(tmp_path / "scores.db"), score_store="memory", write_behind=True
+        )
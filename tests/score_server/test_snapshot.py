@@ -0,0 +1,95 @@
+"""Test score_server/snapshot routines."""
+
+import sqlite3
+import time
+
+import pytest
+import requests
+
+import score_server
+from score_server import score_manager
+from score_server.snapshot import ReadSnapshot
+
+MAX_WRITES = 2
+REFRESH_TIMEOUT = 5  # seconds
+
+
+@pytest.fixture(params=[False, True], ids=["unsharded", "sharded"])
+def snapshot_app(request, tmp_path):
+    """App serving reads from a snapshot that is only refreshed after writes."""
+    app = score_server.init_app(
+        str(tmp_path / "scores.db"),
+        sharded=request.param,
+        snapshot_max_age=3600,
+        snapshot_max_writes=MAX_WRITES,
+    )
+    yield app
+    score_server.close_app(app)
+
+
+def write(app, game, username, score):
+    app.config["SCORE_STORE"].upsert_many([(game, username, score)])
+
+
+def read(snapshot, game):
+    with snapshot.connection() as conn:
+        return [row[:2] for row in score_manager.top_scores(conn, game, 10)]
+
+
+def test_snapshot_refresh(snapshot_app):
+    """Test snapshot reads lag writes until the snapshot is refreshed."""
+    # not started, so only refreshed here
+    snapshot = ReadSnapshot(snapshot_app.config["POOL"], 3600, MAX_WRITES)
+    snapshot.refresh()
+    write(snapshot_app, "BUTTON", "a", 3)
+    assert read(snapshot, "BUTTON") == []
+    assert not snapshot.stale()
+    write(snapshot_app, "TIMING", "a", 1.5)
+    assert snapshot.stale()
+    snapshot.refresh()
+    assert read(snapshot, "BUTTON") == [("a", 3)]
+    assert read(snapshot, "TIMING") == [("a", 1.5)]
+    snapshot.close()
+
+
+def test_snapshot_refresh_during_read(snapshot_app):
+    """Test a replaced copy serves reads in flight and is then freed."""
+    snapshot = ReadSnapshot(snapshot_app.config["POOL"], 3600)
+    snapshot.refresh()
+    write(snapshot_app, "BUTTON", "a", 3)
+    with snapshot.connection() as conn:
+        old = snapshot._current
+        snapshot.refresh()
+        assert score_manager.top_scores(conn, "BUTTON", 10) == []
+        assert read(snapshot, "BUTTON") == [("a", 3)]
+    assert old.readers._idle.qsize() == 0
+    assert old.checkouts == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        old.copies[0].execute("SELECT 1;")
+    snapshot.close()
+    assert snapshot._current.checkouts == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        snapshot._current.copies[0].execute("SELECT 1;")
+
+
+def test_snapshot_refreshes_after_writes(snapshot_app):
+    """Test the app's snapshot is refreshed in the background after writes."""
+    snapshot = snapshot_app.config["READ_SNAPSHOT"]
+    for score in range(MAX_WRITES):
+        write(snapshot_app, "BUTTON", "a", score)
+    deadline = time.monotonic() + REFRESH_TIMEOUT
+    while read(snapshot, "BUTTON") != [("a", MAX_WRITES - 1)]:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_snapshot_scores_page(snapshot_app):
+    """Test the scoreboard is read from the snapshot and reports its age."""
+    client = snapshot_app.test_client()
+    response = client.get("/scores")
+    assert response.status_code == requests.codes.OK
+    assert float(response.headers["X-Snapshot-Age"]) >= 0
+    write(snapshot_app, "BUTTON", "someone", 3)
+    snapshot_app.config["READ_SNAPSHOT"].refresh()
+    assert b"someone" in client.get("/scores").data
+    assert "X-Snapshot-Age" not in client.get("/index").headers
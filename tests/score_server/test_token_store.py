@@ -0,0 +1,114 @@
+"""Test score_server/token_store routines."""
+
+import secrets
+
+import pytest
+
+import score_server
+from score_server import auth_manager
+from score_server.connection_manager import ConnectionPool
+from score_server.token_store import MemoryTokenStore, SignedChallengeStore
+
+
+@pytest.fixture
+def pool(tmp_path):
+    """Sample pool for a temporary database with the used challenges table."""
+    pool = ConnectionPool(tmp_path / "tokens.db")
+    with pool.connection() as conn:
+        score_server.init_db(conn)
+    yield pool
+    pool.close()
+
+
+def test_memory_token_single_use():
+    """Test tokens can be consumed once."""
+    store = MemoryTokenStore()
+    store.add("token")
+    assert len(store) == 1
+    assert store.consume("token")
+    assert not store.consume("token")
+    assert not store.consume("missing")
+    assert len(store) == 0
+
+
+def test_memory_token_expiry(monkeypatch):
+    """Test tokens expire after the configured time."""
+    now = 1000.0
+    monkeypatch.setattr("time.monotonic", lambda: now)
+    store = MemoryTokenStore(expire=10)
+    store.add("expired")
+    now += 5
+    store.add("remaining")
+    now += 6
+    assert not store.consume("expired")
+    assert store.consume("remaining")
+
+
+def test_memory_token_bounded():
+    """Test the oldest tokens are dropped once the store is full."""
+    max_tokens = 2
+    store = MemoryTokenStore(max_tokens=max_tokens)
+    for token in ["first", "second", "third"]:
+        store.add(token)
+    assert len(store) == max_tokens
+    assert not store.consume("first")
+    assert store.consume("third")
+
+
+def test_signed_challenge_single_use(pool):
+    """Test a signed challenge's response is accepted once."""
+    store = SignedChallengeStore(pool)
+    sc = auth_manager.init_auth(store)
+    cr = auth_manager.expected_response(sc)
+    assert len(sc) == len(auth_manager.random_challenge())
+    assert not store.consume("wrong", challenge=sc)
+    assert store.consume(cr, challenge=sc)
+    assert not store.consume(cr, challenge=sc)
+    store.restore(cr, sc)
+    assert store.consume(cr, challenge=sc)
+    assert not store.consume(cr)
+
+
+def test_signed_challenge_forged(pool):
+    """Test challenges not signed with the shared secret are rejected."""
+    store = SignedChallengeStore(pool)
+    sc = auth_manager.random_challenge()
+    assert not store.consume(auth_manager.expected_response(sc), challenge=sc)
+    raw = bytearray(secrets.base64.b64decode(store.challenge()))
+    raw[0] ^= 1
+    forged = secrets.base64.b64encode(raw).decode()
+    assert not store.consume(auth_manager.expected_response(forged), challenge=forged)
+
+
+def test_signed_challenge_expiry(pool, monkeypatch):
+    """Test signed challenges expire and used ones are forgotten after."""
+    now = 1000.0
+    monkeypatch.setattr("time.time", lambda: now)
+    store = SignedChallengeStore(pool, expire=10)
+    used = store.challenge()
+    assert store.consume(auth_manager.expected_response(used), challenge=used)
+    expired = store.challenge()
+    now += 11
+    assert not store.consume(auth_manager.expected_response(expired), challenge=expired)
+    fresh = store.challenge()
+    assert store.consume(auth_manager.expected_response(fresh), challenge=fresh)
+    assert len(store) == 1
+
+
+def test_signed_challenge_shared(pool):
+    """Test a challenge used in one process is refused by the others."""
+    workers = [SignedChallengeStore(pool), SignedChallengeStore(pool)]
+    sc = workers[0].challenge()
+    cr = auth_manager.expected_response(sc)
+    with pool.connection() as conn:
+        assert workers[0].consume(cr, conn, sc)
+    assert not workers[1].consume(cr, challenge=sc)
+    # a challenge used by a submission that is rolled back can be used again
+    rolled_back = workers[1].challenge()
+    cr = auth_manager.expected_response(rolled_back)
+    conn = pool.acquire()
+    pool.begin(conn)
+    assert workers[1].consume(cr, conn, rolled_back)
+    conn.rollback()
+    pool.release(conn)
+    assert workers[0].consume(cr, challenge=rolled_back)